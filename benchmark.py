@@ -0,0 +1,213 @@
+#This script benchmarks the flight node pipeline of the WES project on any Linux box.
+#It selects the simulated devices (sim_devices.py), joins the LoRa transmitter to
+#a ground-side sink through a simulated serial link, starts the same thread set
+#as main.main, and reports samples/s, channel depths, the radio's backlogs, CPU per
+#thread and memory every interval. The offered sensor rate is printed next to what
+#the link can carry at its duty cycle. Example:
+#   python benchmark.py --duration 120 --rate 25 --profile balloon --loss 0.05
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Simulated flight node benchmark")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between report rows")
+    parser.add_argument("--rate", type=float, default=25.0, help="Sensor readings per second (burst mode); 0 for the normal interval")
+    parser.add_argument("--profile", choices=["static", "drone", "balloon"], default="drone")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Simulated flight seconds per real second")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability a packet is dropped")
+    parser.add_argument("--latency", type=float, default=0.0, help="Link latency in seconds")
+    parser.add_argument("--no-camera", action="store_true", help="Leave the camera thread out")
+    parser.add_argument("--workdir", type=str, help="Where logs and images are written (default: a temp dir)")
+    parser.add_argument("--output", type=str, help="Also write the report rows to this CSV file")
+    return parser.parse_args()
+
+class LinkSink:
+    #Ground end of the simulated link: counts what arrives without plotting it,
+    #and acknowledges reliable messages as the ground station would
+    def __init__(self, port, ack_interval=0.5):
+        import serial
+        from serial_reader import SerialFrameReader
+        from reliable_link import ReliableReceiver
+        self.serial = serial.Serial(port, timeout=0.2)
+        self.reader = SerialFrameReader(self.serial)
+        self.reliable = ReliableReceiver()
+        self.ack_interval = ack_interval
+        self.samples = 0
+        self.frames = 0
+        self.lines = 0
+        self.messages = 0
+        self.stop_event = threading.Event()
+        self.threads = [threading.Thread(target=self._run, name="Benchmark Sink", daemon=True),
+                        threading.Thread(target=self._ack, name="Benchmark Sink ACK", daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        from telemetry_codec import FRAME_SAMPLE, FRAME_BATCH, FRAME_RELIABLE, decode_telemetry
+        for kind, message in self.reader.messages(self.stop_event):
+            if kind == 'text':
+                self.lines += 1
+                continue
+            self.frames += 1
+            if message.frame_type in (FRAME_SAMPLE, FRAME_BATCH):
+                self.samples += len(decode_telemetry(message))
+            elif message.frame_type == FRAME_RELIABLE:
+                self.messages += len(self.reliable.handle_frame(message))
+
+    def _ack(self):
+        while not self.stop_event.wait(self.ack_interval):
+            for _, ack in self.reliable.acks():
+                self.serial.write(ack)
+
+    def close(self):
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout=2)
+        self.serial.close()
+
+def link_capacity():
+    #Sensor samples/s the duty cycle allows if the radio sent nothing but full telemetry
+    #batches (of BATCH_MAX_BYTES, so a lower bound for that case)
+    from lora_transmitter import TX_FORMAT, BATCH_MAX_SAMPLES, BATCH_MAX_BYTES
+    from telemetry_codec import HEADER, CRC, SAMPLE
+    from tx_scheduler import DUTY_CYCLE, lora_airtime
+    if TX_FORMAT == "batch":
+        samples, size = BATCH_MAX_SAMPLES, BATCH_MAX_BYTES
+    else:
+        samples, size = 1, SAMPLE.size
+    return DUTY_CYCLE * samples / lora_airtime(HEADER.size + size + CRC.size)
+
+def backlog_columns(link_backlogs):
+    #Report columns for the LoRa transmitter's scheduler classes and reliable sender
+    from tx_scheduler import TxScheduler, CLASS_NAMES
+    columns = {}
+    for backlog in link_backlogs:
+        if isinstance(backlog, TxScheduler):
+            for priority, name in CLASS_NAMES.items():
+                columns[f"backlog tx {name}"] = backlog.backlog(priority)
+        else:
+            stats = backlog.stats()
+            columns["reliable pending"] = stats['pending']
+            columns["reliable in flight"] = stats['in_flight']
+    return columns
+
+def thread_cpu_times(process):
+    #native thread id -> user + system CPU seconds
+    return {t.id: t.user_time + t.system_time for t in process.threads()}
+
+def run(args):
+    #Device selection happens at import time, so configure the environment first
+    os.environ["WES_BACKEND"] = "sim"
+    from sim_devices import SimulatedSerialLink
+    link = SimulatedSerialLink(baud=args.baud, loss=args.loss, latency=args.latency, seed=1)
+    os.environ["WES_LORA_PORT"] = link.ports[0]
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="wes_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.argv = sys.argv[:1]     #object_detection parses its own arguments
+
+    import bme280Data
+    import main
+    from shared_resources import channels, csv_queue, link_backlogs, stop_event, tracer
+    from channels import channel_report
+
+    bme280Data.SIM_PROFILE = args.profile
+    bme280Data.SIM_TIME_SCALE = args.time_scale
+    if args.rate > 0:
+        bme280Data.BURST_MODE = True
+        bme280Data.BURST_RATE_HZ = args.rate
+    offered = args.rate if args.rate > 0 else 1 / bme280Data.SAMPLE_INTERVAL
+    capacity = link_capacity()
+    print(f"[Benchmark] Offered load {offered:.1f} samples/s, link capacity about {capacity:.1f} samples/s "
+          f"(telemetry only, at the duty cycle)")
+    if offered > capacity:
+        print("[Benchmark] Offered load exceeds the link capacity: expect telemetry drops and growing latency")
+
+    sink = LinkSink(link.ports[1])
+    process = psutil.Process()
+    process.cpu_percent()
+    started = time.monotonic()
+    threads = main.start_threads(stop_event, camera=not args.no_camera)
+
+    rows = []
+    last_time = started
+    last_produced = last_received = 0
+    last_cpu = thread_cpu_times(process)
+    children = {}   #The camera runs in a child process (main.CAMERA_PROCESS)
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(args.interval)
+            now = time.monotonic()
+            elapsed = now - last_time
+            cpu = thread_cpu_times(process)
+            produced = csv_queue.put_count
+            row = {
+                'time_s': round(now - started, 1),
+                'samples_per_s': round((produced - last_produced) / elapsed, 1),
+                'received_per_s': round((sink.samples - last_received) / elapsed, 1),
+                'rss_mb': round(process.memory_info().rss / 1e6, 1),
+                'cpu_total_pct': round(process.cpu_percent(), 1),
+            }
+            for child in process.children():
+                child = children.setdefault(child.pid, child)
+                try:
+                    row[f"cpu% process {child.pid}"] = round(child.cpu_percent(), 1)
+                    row[f"rss_mb process {child.pid}"] = round(child.memory_info().rss / 1e6, 1)
+                except psutil.NoSuchProcess:
+                    pass
+            for channel in channels:
+                row[f"depth {channel.name}"] = channel.qsize()
+            row.update(backlog_columns(link_backlogs))
+            for t in threading.enumerate():
+                if t.native_id in cpu:
+                    used = cpu[t.native_id] - last_cpu.get(t.native_id, 0.0)
+                    row[f"cpu% {t.name}"] = round(100 * used / elapsed, 1)
+            rows.append(row)
+            print("[Benchmark] " + ", ".join(f"{key}={value}" for key, value in row.items()))
+            last_time, last_produced, last_received, last_cpu = now, produced, sink.samples, cpu
+    except KeyboardInterrupt:
+        print("[Benchmark] Interrupted")
+    finally:
+        stop_event.set()
+        for t in threads:
+            t.join(timeout=5)
+        sink.close()
+        link.close()
+
+    total = time.monotonic() - started
+    print(f"[Benchmark] {total:.0f}s in {workdir}")
+    print(f"[Benchmark] Sensor samples: {csv_queue.put_count} ({csv_queue.put_count / total:.1f}/s), "
+          f"received over the link: {sink.samples} ({sink.frames} frames, {sink.lines} text lines, "
+          f"{sink.messages} reliable messages)")
+    print(f"[Benchmark] Link: packets delivered={link.sent[0]} dropped={link.dropped[0]}, "
+          f"uplink delivered={link.sent[1]} dropped={link.dropped[1]}, "
+          f"peak RSS {max((row['rss_mb'] for row in rows), default=0)} MB")
+    print(f"[Benchmark] Offered load {offered:.1f} samples/s, link capacity about {capacity:.1f} samples/s")
+    print(channel_report(channels, backlogs=link_backlogs))
+    print(tracer.report())
+
+    if args.output and rows:
+        fields = []
+        for row in rows:
+            fields.extend(key for key in row if key not in fields)
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"[Benchmark] Report rows written to {args.output}")
+    return rows
+
+if __name__ == "__main__":
+    run(get_args())
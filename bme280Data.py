@@ -1,70 +1,212 @@
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import smbus2
 import bme280
 
-from shared_resources import data_queue, stop_event, csv_queue
+from queue import Full
+from rolling_stats import FlightStats, AdaptivePolicy, ACTIVE, STABLE
+from shared_resources import data_queue, csv_queue, sensor_samples, stop_event, i2c_lock, tracer, startup, DEVICE_BACKEND
 
 #Constants
-I2C_BUS = smbus2.SMBus(1)  #I2C bus 1 (default for Raspberry Pi)
+I2C_BUS_NUMBER = 1         #I2C bus 1 (default for Raspberry Pi), opened by get_sensor()
 BME280_ADDRESS = 0x76      #Default I2C address for BME280
 sensor_id = "BME280-01"    #Optional ID for logging
 SEA_LEVEL_PRESSURE = 1013.25  #Standard sea level pressure in hPa
 
+#Sampling settings
+SAMPLE_INTERVAL = 10.0     #Seconds between readings in normal operation
+BURST_MODE = False         #Continuous (normal mode) reading for dense vertical profiles
+BURST_RATE_HZ = 25         #Readings per second in burst mode
+OVERSAMPLING = 1           #Register code for all channels: 0 skip, 1 x1, 2 x2, 3 x4, 4 x8, 5 x16
+IIR_FILTER = 0             #Register code: 0 off, 1 x2, 2 x4, 3 x8, 4 x16
+PRINT_EVERY = 50           #In burst mode, only print every Nth reading
+SAMPLE_PUT_TIMEOUT = 1.0   #Longest the sensor waits for room in a blocking channel
+SIM_PROFILE = "drone"      #Flight profile of the simulated sensor (static, drone, balloon)
+SIM_TIME_SCALE = 1.0       #Simulated seconds of flight per real second
+
+#Adaptive sampling (see rolling_stats.py): every ACTIVE_INTERVAL seconds with each
+#sample sent while the smoothed vertical rate is at least CLIMB_RATE; every
+#SAMPLE_INTERVAL seconds with one summary per SUMMARY_WINDOW sent once it has
+#stayed below half of it for CALM_HOLD seconds. Burst mode always samples at BURST_RATE_HZ.
+ADAPTIVE_SAMPLING = True
+CLIMB_RATE = 0.5           #m/s
+CALM_HOLD = 30.0           #Seconds
+ACTIVE_INTERVAL = 1.0      #Seconds between readings while climbing or descending
+SUMMARY_WINDOW = 60.0      #Seconds of steady readings per downlink summary
+
+#BME280 registers
+REG_CTRL_HUM = 0xF2
+REG_CTRL_MEAS = 0xF4
+REG_CONFIG = 0xF5
+REG_DATA = 0xF7
+MODE_FORCED = 0b01
+MODE_NORMAL = 0b11
+STANDBY_0_5_MS = 0b000
+
 #Class for SensorData
 class SensorData:
-    def __init__(self, timestamp, temperature, humidity, pressure, altitude, sensor_id):
+    def __init__(self, timestamp, temperature, humidity, pressure, altitude, sensor_id, monotonic=None):
         self.timestamp = timestamp
         self.temperature = temperature
         self.humidity = humidity
         self.pressure = pressure
         self.altitude = altitude
         self.sensor_id = sensor_id
+        self.monotonic = monotonic  #time.monotonic() of the reading, for precise spacing
+
+#Class for the BME280 driver
+class BME280Sensor:
+    #Loads the calibration once and shares the I2C bus through a lock.
+    #Forced mode triggers one measurement per read; burst mode leaves the sensor
+    #measuring continuously (normal mode) so a read is a single 8-byte block read.
+    def __init__(self, bus, address=BME280_ADDRESS, lock=i2c_lock, oversampling=OVERSAMPLING,
+                 iir_filter=IIR_FILTER, burst=False):
+        self.bus = bus
+        self.address = address
+        self.lock = lock
+        self.oversampling = oversampling
+        self.iir_filter = iir_filter
+        self.burst = burst
+        #Datasheet max measurement time for the chosen oversampling, in seconds
+        factor = (1 << oversampling) // 2 if oversampling else 0
+        self.measurement_time = (1.25 + 2.3 * factor + 2 * (2.3 * factor + 0.575)) / 1000
+        with self.lock:
+            self.calibration = bme280.load_calibration_params(bus, address)
+        self.configure()
+
+    def configure(self):
+        mode = MODE_NORMAL if self.burst else MODE_FORCED
+        with self.lock:
+            self.bus.write_byte_data(self.address, REG_CONFIG, (STANDBY_0_5_MS << 5) | (self.iir_filter << 2))
+            #ctrl_hum only takes effect after a write to ctrl_meas
+            self.bus.write_byte_data(self.address, REG_CTRL_HUM, self.oversampling)
+            self.bus.write_byte_data(self.address, REG_CTRL_MEAS, (self.oversampling << 5) | (self.oversampling << 2) | mode)
+
+    def read(self):
+        #Returns temperature (°C), pressure (hPa), humidity (%) and the monotonic time of the reading
+        with self.lock:
+            if not self.burst:
+                self.bus.write_byte_data(self.address, REG_CTRL_MEAS,
+                                         (self.oversampling << 5) | (self.oversampling << 2) | MODE_FORCED)
+                time.sleep(self.measurement_time)
+            block = self.bus.read_i2c_block_data(self.address, REG_DATA, 8)
+            read_time = time.monotonic()
+        data = bme280.compensated_readings(bme280.uncompensated_readings(block), self.calibration)
+        return data.temperature, data.pressure, data.humidity, read_time
+
+_sensor = None
+
+#Rolling statistics and sampling policy of the running sensor loop (set by BME_running)
+flight_stats = None
+sampling_policy = None
+
+def get_sensor():
+    global _sensor
+    if _sensor is None:
+        if DEVICE_BACKEND == "sim":
+            from sim_devices import SimulatedBME280
+            _sensor = SimulatedBME280(SIM_PROFILE, time_scale=SIM_TIME_SCALE, burst=BURST_MODE)
+        else:
+            _sensor = BME280Sensor(smbus2.SMBus(I2C_BUS_NUMBER), burst=BURST_MODE)
+    return _sensor
 
 def read_bme280():
-    #Use global I2C bus
-    calibration_params = bme280.load_calibration_params(I2C_BUS, BME280_ADDRESS)
-    data = bme280.sample(I2C_BUS, BME280_ADDRESS, calibration_params)
-    return data.temperature, data.pressure, data.humidity
+    temperature, pressure, humidity, _ = get_sensor().read()
+    return temperature, pressure, humidity
 
 def calculate_altitude(pressure):
     #Calculate altitude in meters from pressure in hPa
     return (1 - (pressure / SEA_LEVEL_PRESSURE) ** (1 / 5.255)) * 44330.0
 
+def queue_summary(summary):
+    #A window summary goes to the LoRa channel only; its samples are already in the CSV log
+    if summary is not None:
+        data_queue.put(summary)
+        print(f"[BME280] Queued summary of {summary.count} samples over {summary.duration:.0f}s "
+              f"(altitude {summary.altitude.mean:.1f} m, rate {summary.vertical_rate:+.2f} m/s)")
+
 def BME_running(stop_event):
+    global flight_stats, sampling_policy
+    flight_stats = FlightStats(sensor_id)
+    sampling_policy = AdaptivePolicy(CLIMB_RATE, hold=CALM_HOLD, active_interval=ACTIVE_INTERVAL,
+                                     stable_interval=SAMPLE_INTERVAL)
+    adaptive = ADAPTIVE_SAMPLING and not BURST_MODE
+    mode = ACTIVE
     try:
+        sensor = get_sensor()
+        startup.ready("sensor")
+        interval = 1.0 / BURST_RATE_HZ if BURST_MODE else SAMPLE_INTERVAL
+        #Wall-clock timestamps are derived from the monotonic clock so spacing stays exact
+        start_wall = datetime.now()
+        start_mono = time.monotonic()
+        next_read = start_mono
+        count = 0
         while not stop_event.is_set():
-                print('Reading sensor...')
-                
+                verbose = not BURST_MODE or count % PRINT_EVERY == 0
+                if verbose:
+                    print('Reading sensor...')
+
                 #Extract values
-                temperature, pressure, humidity = read_bme280()  # Unpack the tuple
+                temperature, pressure, humidity, read_time = sensor.read()
                 altitude = calculate_altitude(pressure)  # Calculate altitude based on pressure
-                timestamp = datetime.now()
+                timestamp = start_wall + timedelta(seconds=read_time - start_mono)
                 #data.sensor_id = SENSOR_ID
 
                 #Create an instance of SensorData
-                sensor_data = SensorData(timestamp, temperature, humidity, pressure, altitude, sensor_id)
+                sensor_data = SensorData(timestamp, temperature, humidity, pressure, altitude, sensor_id, read_time)
 
-                #Output to console
-                print(f"Sensor ID: {sensor_id}")
-                print(f"Timestamp: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"Temperature: {temperature:.2f} °C")
-                print(f"Pressure: {pressure:.2f} hPa")
-                print(f"Humidity: {humidity:.2f} %")
-                print(f"Altitude: {altitude:.2f} m")
-                print("-" * 40)
-    
-                data_queue.put(sensor_data)  # Put data in the queue
-                csv_queue.put(sensor_data)  # Put data in the queue
+                #The steady window as it was before this sample, in case the sample ends it
+                stable_window = flight_stats.window_snapshot() if mode == STABLE else None
+                rate = flight_stats.add(sensor_data)
+                previous_mode = mode
+                if adaptive:
+                    mode = sampling_policy.update(rate, read_time)
+                    interval = sampling_policy.interval()
 
-                print(f"[DEBUG BME CODE] Data queued. Current size: {data_queue.qsize()}")
-                print(f"[Sensor] data_queue id: {id(data_queue)}")
+                try:
+                    if mode == ACTIVE:
+                        #Send what is left of a steady window (without this sample, which
+                        #goes out on its own below), then every sample again
+                        if previous_mode == STABLE:
+                            queue_summary(stable_window)
+                        flight_stats.reset_window()
+                        #One put reaches both the LoRa TX and CSV channels
+                        tracer.mark(read_time, 'read', t=read_time)
+                        sensor_samples.put(sensor_data, timeout=SAMPLE_PUT_TIMEOUT)
+                        tracer.mark(read_time, 'enqueue')
+                    else:
+                        csv_queue.put(sensor_data, timeout=SAMPLE_PUT_TIMEOUT)
+                        if flight_stats.window_age(read_time) >= SUMMARY_WINDOW:
+                            queue_summary(flight_stats.window_summary())
+                except Full:
+                    print("[BME280] CSV channel full, sample not logged")
+                if not count:
+                    startup.stage("sensor", "first sample queued")
+                count += 1
 
+                #Output to console
+                if verbose:
+                    print(f"Sensor ID: {sensor_id}")
+                    print(f"Timestamp: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
+                    print(f"Temperature: {temperature:.2f} °C")
+                    print(f"Pressure: {pressure:.2f} hPa")
+                    print(f"Humidity: {humidity:.2f} %")
+                    print(f"Altitude: {altitude:.2f} m")
+                    print(f"Vertical rate: {rate:+.2f} m/s ({mode})")
+                    print("-" * 40)
+                    print(f"[DEBUG BME CODE] Data queued. Current size: {data_queue.qsize()}")
 
-                time.sleep(10)  # Wait before next reading
+                #Wait for the next reading on a fixed schedule; skip ahead if we fell behind
+                next_read += interval
+                now = time.monotonic()
+                if next_read < now:
+                    next_read = now
+                stop_event.wait(next_read - now)
 
     except KeyboardInterrupt:
         print("Program stopped by user.")
     except Exception as e:
         print(f"A BME280 error has occurred: {e}")
+    finally:
+        print(flight_stats.report())
         #This code reads data from a BME280 sensor and plots the temperature, humidity, pressure, and altitude in real-time.
@@ -0,0 +1,186 @@
+#This module runs the camera pipeline in its own process for the WES project.
+#cv2 drawing, detection post-processing and JPEG encoding then no longer share
+#the GIL with the sensor and radio threads, so their timing does not depend on
+#camera load. The process reports back through a CameraLink:
+#   events      bounded multiprocessing queue of small tuples (detection reports, startup stages)
+#   slots       shared memory cut into fixed-size slots for thumbnail bytes; only
+#               the slot number and length go through the queue
+#   free_slots  slot numbers the camera process may fill
+#camera_supervisor() runs on a thread of main.py: it starts the process, forwards
+#its events into ai_data_queue / image_queue, restarts it if it dies and stops it
+#when stop_event is set.
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+from queue import Empty, Full
+
+from shared_resources import ai_data_queue, image_queue, startup
+
+EVENT_QUEUE_SIZE = 64
+SLOT_COUNT = 8
+SLOT_SIZE = 4096            #Thumbnails are kept under image_transfer.THUMBNAIL_BUDGET (768 bytes at 10% duty)
+SHUTDOWN_TIMEOUT = 10.0     #Seconds the process gets to clean up before it is terminated
+RESTART_DELAY = 5.0
+MAX_RESTARTS = 3
+
+#Spawned, not forked: the parent already runs the sensor and radio threads
+context = mp.get_context("spawn")
+
+class CameraLink:
+    def __init__(self, slots=SLOT_COUNT, slot_size=SLOT_SIZE, queue_size=EVENT_QUEUE_SIZE):
+        self.slot_count = slots
+        self.slot_size = slot_size
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.events = context.Queue(queue_size)
+        self.free_slots = context.Queue(slots)
+        for slot in range(slots):
+            self.free_slots.put(slot)
+        self.stop = context.Event()
+        self.dropped = 0
+
+    #Camera process side
+
+    def send(self, message, timeout=None):
+        #Returns False if the queue stayed full (the message is dropped)
+        try:
+            if timeout:
+                self.events.put(message, timeout=timeout)
+            else:
+                self.events.put_nowait(message)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def send_thumbnail(self, data, label, confidence):
+        if len(data) > self.slot_size:
+            print(f"[Camera] Thumbnail of {label} ({len(data)} bytes) does not fit a slot")
+            return False
+        try:
+            slot = self.free_slots.get_nowait()
+        except Empty:
+            #The radio is behind on thumbnails; this one is dropped like a full image_queue would
+            self.dropped += 1
+            return False
+        start = slot * self.slot_size
+        self.memory.buf[start:start + len(data)] = data
+        if not self.send(('thumbnail', slot, len(data), label, confidence)):
+            self.free_slots.put(slot)
+            return False
+        return True
+
+    #Supervisor side
+
+    def forward(self, timeout=0.5):
+        #Move the events waiting on the queue into the flight node's channels.
+        #Returns the number forwarded (0 if nothing arrived within timeout).
+        count = 0
+        while True:
+            try:
+                message = self.events.get(timeout=timeout if not count else 0)
+            except Empty:
+                return count
+            except (EOFError, OSError):
+                return count
+            count += 1
+            kind = message[0]
+            if kind == 'detection':
+                ai_data_queue.put(message[1])
+            elif kind == 'thumbnail':
+                _, slot, length, label, confidence = message
+                start = slot * self.slot_size
+                data = bytes(self.memory.buf[start:start + length])
+                self.free_slots.put(slot)
+                image_queue.put((data, label, confidence))
+            elif kind == 'stage':
+                startup.stage(message[1], message[2])
+            elif kind == 'ready':
+                startup.ready(message[1])
+
+    def close(self):
+        self.events.close()
+        self.free_slots.close()
+        self.memory.close()
+        self.memory.unlink()
+
+class DetectionSink:
+    #Stands in for ai_data_queue inside the camera process
+    def __init__(self, link):
+        self.link = link
+
+    def put(self, report, block=True, timeout=None):
+        return self.link.send(('detection', report))
+
+class ThumbnailSink:
+    #Stands in for image_queue inside the camera process
+    def __init__(self, link):
+        self.link = link
+
+    def put(self, item, block=True, timeout=None):
+        data, label, confidence = item
+        return self.link.send_thumbnail(data, label, confidence)
+
+class StageSink:
+    #Stands in for shared_resources.startup; stages are timed by the supervisor when they arrive
+    def __init__(self, link):
+        self.link = link
+
+    def stage(self, name, stage):
+        self.link.send(('stage', name, stage), timeout=1.0)
+
+    def ready(self, name):
+        self.link.send(('ready', name), timeout=1.0)
+
+def camera_process_main(link):
+    #Entry point of the camera process: the heavy imports happen here, not in the parent
+    import signal
+    #Ctrl-C reaches the whole process group; the supervisor decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stages = StageSink(link)
+    try:
+        from object_detection import camera_running
+    except Exception as e:
+        print(f"[Camera Process] Could not load object_detection: {e}")
+        return
+    stages.stage("camera", "object_detection imported")
+    camera_running(link.stop, DetectionSink(link), ThumbnailSink(link), stages)
+    if link.dropped:
+        print(f"[Camera Process] Dropped {link.dropped} events (supervisor behind)")
+
+def run_once(stop_event):
+    #One camera process from start to exit; returns its exit code
+    link = CameraLink()
+    process = context.Process(target=camera_process_main, args=(link,), name="Camera Process", daemon=True)
+    process.start()
+    startup.stage("camera", f"process started (pid {process.pid})")
+    try:
+        while process.is_alive() and not stop_event.is_set():
+            link.forward()
+        if process.is_alive():
+            link.stop.set()
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+            while process.is_alive() and time.monotonic() < deadline:
+                link.forward(timeout=0.2)
+            if process.is_alive():
+                print("[Camera Process] Did not stop in time, terminating")
+                process.terminate()
+        process.join(timeout=5)
+        link.forward(timeout=0)
+    finally:
+        link.close()
+    return process.exitcode
+
+def camera_supervisor(stop_event):
+    restarts = 0
+    while not stop_event.is_set():
+        exitcode = run_once(stop_event)
+        if stop_event.is_set():
+            break
+        restarts += 1
+        print(f"[Camera Process] Exited with code {exitcode}")
+        if restarts > MAX_RESTARTS:
+            print(f"[Camera Process] Giving up after {MAX_RESTARTS} restarts")
+            break
+        print(f"[Camera Process] Restarting in {RESTART_DELAY:.0f}s ({restarts}/{MAX_RESTARTS})")
+        stop_event.wait(RESTART_DELAY)
+    print("[Camera Process] Supervisor stopped.")
@@ -0,0 +1,153 @@
+#This module provides bounded message channels for the WES project.
+#A Channel is a drop-in replacement for queue.Queue (put, get, get_nowait, qsize,
+#empty) with a capacity and an overflow policy, plus counters for depth,
+#high-water mark, drops and enqueue-to-dequeue latency:
+#   "block"        put waits for room (lossless, back-pressures the producer)
+#   "drop_oldest"  the oldest waiting item is discarded to make room
+#   "drop_newest"  the new item is discarded
+#   "coalesce"     an item with the same key replaces the waiting one in place;
+#                  otherwise behaves like drop_oldest
+#A FanOut delivers one put to several channels, each with its own policy.
+import threading
+import time
+from collections import deque
+from queue import Empty, Full
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+class Channel:
+    def __init__(self, name, capacity, policy=BLOCK, key=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if policy == COALESCE and key is None:
+            raise ValueError("A coalescing channel needs a key function")
+        self.name = name
+        self.capacity = capacity
+        self.policy = policy
+        self.key = key
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        #Returns False if the item was dropped (drop_newest); raises queue.Full if a
+        #blocking put times out
+        now = time.monotonic()
+        with self.cond:
+            self.put_count += 1
+            if self.policy == COALESCE:
+                key = self.key(item)
+                for i, (waiting, enqueued_at) in enumerate(self.items):
+                    if self.key(waiting) == key:
+                        #Keep the original place in line and enqueue time
+                        self.items[i] = (item, enqueued_at)
+                        self.coalesced += 1
+                        return True
+            if len(self.items) >= self.capacity:
+                if self.policy == BLOCK:
+                    if not block:
+                        raise Full
+                    deadline = None if timeout is None else now + timeout
+                    while len(self.items) >= self.capacity:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise Full
+                        self.cond.wait(remaining)
+                elif self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self.items.popleft()
+                    self.dropped += 1
+            self.items.append((item, now))
+            self.high_water = max(self.high_water, len(self.items))
+            self.cond.notify_all()
+        return True
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            if not block:
+                timeout = 0
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self.items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self.cond.wait(remaining)
+            item, enqueued_at = self.items.popleft()
+            latency = time.monotonic() - enqueued_at
+            self.get_count += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.cond.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self.cond:
+            return len(self.items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.capacity
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': len(self.items),
+                'capacity': self.capacity,
+                'high_water': self.high_water,
+                'put': self.put_count,
+                'got': self.get_count,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'latency_avg': self.latency_total / self.get_count if self.get_count else 0.0,
+                'latency_max': self.latency_max,
+            }
+
+    def report(self):
+        s = self.stats()
+        return (f"  {self.name:<14} depth={s['depth']}/{s['capacity']} high={s['high_water']} "
+                f"put={s['put']} got={s['got']} dropped={s['dropped']} coalesced={s['coalesced']} "
+                f"latency avg={s['latency_avg']:.3f}s max={s['latency_max']:.3f}s")
+
+class FanOut:
+    #Delivers each item to every subscribed channel (the item itself is shared, not copied)
+    def __init__(self, name, *channels):
+        self.name = name
+        self.channels = list(channels)
+
+    def subscribe(self, channel):
+        self.channels.append(channel)
+        return channel
+
+    def put(self, item, block=True, timeout=None):
+        delivered = True
+        for channel in self.channels:
+            delivered = channel.put(item, block, timeout) and delivered
+        return delivered
+
+def channel_report(channels, title="[Channels] Report:", backlogs=()):
+    #backlogs: queues downstream of the channels (TxScheduler, ReliableSender), reported
+    #by their backlog_lines() so a backlog that moved past the channels still shows
+    lines = [title] + [channel.report() for channel in channels]
+    for backlog in backlogs:
+        lines += backlog.backlog_lines()
+    return "\n".join(lines)
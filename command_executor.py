@@ -0,0 +1,129 @@
+#This module runs remote "run <script>" commands for the WES ground station.
+#Scripts run on a small worker pool with a timeout so the receive loop never
+#waits on them; results are put on a queue for reporting.
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+CommandResult = namedtuple('CommandResult', ['script', 'path', 'returncode', 'stdout', 'stderr', 'duration', 'error'])
+
+def _text(output):
+    #TimeoutExpired can carry bytes even when text=True was requested
+    if isinstance(output, bytes):
+        return output.decode('utf-8', errors='replace')
+    return output or ''
+
+class ScriptIndex:
+    #Cached map of runnable script names to paths.
+    #Directories are re-listed only when their modification time changes, and
+    #their mtimes are checked at most once per refresh_interval seconds.
+    def __init__(self, directories, extensions=('.py',), refresh_interval=5.0):
+        self.directories = list(directories)
+        self.extensions = tuple(extensions)
+        self.refresh_interval = refresh_interval
+        self.scripts = {}
+        self.mtimes = {}
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def _scan(self, mtimes):
+        scripts = {}
+        #Earlier directories win, like the old search order
+        for directory in reversed(self.directories):
+            if mtimes.get(directory) is None:
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith(self.extensions):
+                    scripts[entry.name] = entry.path
+        return scripts
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.checked < self.refresh_interval:
+                return
+            self.checked = now
+            mtimes = {}
+            for directory in self.directories:
+                try:
+                    mtimes[directory] = os.stat(directory).st_mtime_ns
+                except OSError:
+                    mtimes[directory] = None
+            if force or mtimes != self.mtimes:
+                self.scripts = self._scan(mtimes)
+                self.mtimes = mtimes
+
+    def lookup(self, script_name):
+        #Only bare names listed in the index can run (no paths)
+        if not script_name or os.path.basename(script_name) != script_name:
+            return None
+        self.refresh()
+        return self.scripts.get(script_name)
+
+class CommandExecutor:
+    def __init__(self, index, max_workers=2, max_pending=8, timeout=60.0, interpreter=sys.executable):
+        self.index = index
+        self.timeout = timeout
+        self.interpreter = interpreter
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Command")
+        self.results = queue.Queue()
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, script_name):
+        #Returns immediately; False if the script is unknown or too many commands are waiting
+        path = self.index.lookup(script_name)
+        if path is None:
+            print(f"[Command] Script '{script_name}' not found.")
+            return False
+        with self.lock:
+            if self.pending >= self.max_pending:
+                print(f"[Command] Too many commands pending, dropping '{script_name}'.")
+                return False
+            self.pending += 1
+        print(f"[Command] Running script: {path}")
+        self.pool.submit(self._run, script_name, path)
+        return True
+
+    def _run(self, script_name, path):
+        started = time.monotonic()
+        try:
+            completed = subprocess.run([self.interpreter, path], capture_output=True, text=True, timeout=self.timeout)
+            result = CommandResult(script_name, path, completed.returncode, completed.stdout, completed.stderr,
+                                   time.monotonic() - started, None)
+        except subprocess.TimeoutExpired as e:
+            result = CommandResult(script_name, path, None, _text(e.stdout), _text(e.stderr),
+                                   time.monotonic() - started, f"timed out after {self.timeout:.0f}s")
+        except Exception as e:
+            result = CommandResult(script_name, path, None, '', '', time.monotonic() - started, str(e))
+        finally:
+            with self.lock:
+                self.pending -= 1
+        self.results.put(result)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait, cancel_futures=not wait)
+
+def report_results(results, stop_event):
+    #Print command results as they complete
+    while not stop_event.is_set():
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            continue
+        if result.error:
+            print(f"[Command] Script '{result.script}' failed: {result.error}")
+        elif result.returncode != 0:
+            print(f"[Command] Script '{result.script}' exited with code {result.returncode} ({result.duration:.1f}s)")
+        else:
+            print(f"[Command] Script '{result.script}' finished ({result.duration:.1f}s)")
+        if result.stdout:
+            print(f"[Command] Script output:\n{result.stdout}")
+        if result.stderr:
+            print(f"[Command] Script error output:\n{result.stderr}")
@@ -0,0 +1,103 @@
+#This module provides a buffered CSV writer for the WES project.
+#The file stays open between rows; rows are flushed in batches (by row count or
+#age, optionally with fsync) and the file can be rotated by size or per flight.
+import csv
+import os
+import threading
+import time
+from queue import Empty
+
+class BufferedCSVWriter:
+    def __init__(self, filename, header, flush_rows=20, flush_interval=5.0, fsync=False, max_bytes=None):
+        self.base_filename = filename
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.part = 0
+        self.file = None
+        self.writer = None
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.filename = filename
+        self._open(filename)
+
+    def _open(self, filename):
+        self.filename = filename
+        self.file = open(filename, mode='a', newline='')
+        self.writer = csv.writer(self.file)
+        #Only a brand new (empty) file gets the header
+        if self.file.tell() == 0 and self.header:
+            self.writer.writerow(self.header)
+        self.last_flush = time.monotonic()
+
+    def _flush(self, check_size=True):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        if check_size and self.max_bytes and self.file.tell() >= self.max_bytes:
+            self._rotate(None)
+
+    def _rotate(self, suffix):
+        self.file.close()
+        stem, ext = os.path.splitext(self.base_filename)
+        if suffix is None:
+            self.part += 1
+            suffix = f"{self.part:03d}"
+        self._open(f"{stem}_{suffix}{ext}")
+
+    def _due(self):
+        return (self.pending >= self.flush_rows
+                or (self.pending and time.monotonic() - self.last_flush >= self.flush_interval))
+
+    def write_row(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        with self.lock:
+            for row in rows:
+                self.writer.writerow(row)
+                self.pending += 1
+            if self._due():
+                self._flush()
+
+    def flush_if_due(self):
+        #Call periodically so a quiet stream still gets flushed after flush_interval
+        with self.lock:
+            if self.file and self._due():
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            if self.file:
+                self._flush()
+
+    def rotate(self, suffix=None):
+        #Start a new file, e.g. one per flight: rotate("flight2") -> bme280_log_flight2.csv
+        with self.lock:
+            self._flush(check_size=False)
+            self._rotate(suffix)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self._flush(check_size=False)
+                self.file.close()
+                self.file = None
+
+def get_batch(source, max_items, timeout=1.0):
+    #Block for the first item, then take whatever else is already queued (up to max_items)
+    try:
+        items = [source.get(timeout=timeout)]
+    except Empty:
+        return []
+    while len(items) < max_items:
+        try:
+            items.append(source.get_nowait())
+        except Empty:
+            break
+    return items
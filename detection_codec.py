@@ -0,0 +1,121 @@
+#This module packs detection events into compact records for the WES project.
+#A detection used to go down the link as the path of its saved image (about 50
+#bytes of text, with the label and confidence parsed back out of the file name).
+#A DETECTIONS payload carries the events of one or more camera frames instead:
+#
+#   header: count u8, codebook u16, base time (epoch s u32, ms u16)
+#   record: label index u8, confidence u8 (1/255), time since base (ms u16),
+#           box x, y, w, h u8 (1/255 of the image width / height)
+#
+#Label indexes point into a codebook: the network's label list (intrinsics.labels,
+#or assets/coco_labels.txt). Each side hashes its list, and the ground station
+#only names labels when the hash in the payload matches its own.
+import binascii
+import struct
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from telemetry_codec import FRAME_DETECTIONS, FrameError, encode_frame
+from reliable_link import MAX_MESSAGE
+
+HEADER = struct.Struct('>BHIH')
+RECORD = struct.Struct('>BBHBBBB')
+MAX_RECORDS = (MAX_MESSAGE - HEADER.size) // RECORD.size       #30: one reliable message
+MAX_SPAN = 0xFFFF / 1000                                        #Seconds a payload can cover
+
+#box is x, y, w, h as fractions of the image size
+Detection = namedtuple('Detection', ['category', 'confidence', 'box'])
+#What the camera reports for one frame: timestamp is epoch seconds, codebook the
+#digest of its label list, image_path the saved image (sent in text mode; None if it
+#could not be saved)
+DetectionReport = namedtuple('DetectionReport', ['timestamp', 'codebook', 'detections', 'image_path'])
+ReceivedDetection = namedtuple('ReceivedDetection', ['node_id', 'timestamp', 'label', 'confidence', 'box'])
+
+def label_digest(labels):
+    #CRC-32 of the label list folded to 16 bits
+    crc = binascii.crc32("\n".join(labels).encode('utf-8'))
+    return (crc ^ (crc >> 16)) & 0xFFFF
+
+class LabelCodebook:
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.digest = label_digest(self.labels)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(f.read().splitlines())
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label(self, index):
+        if 0 <= index < len(self.labels):
+            return self.labels[index]
+        return f"class_{index}"
+
+def _unit(value):
+    return max(0, min(255, int(round(value * 255))))
+
+def normalize_box(box, width, height):
+    #Pixel x, y, w, h -> fractions of the image size
+    x, y, w, h = box
+    return (x / width, y / height, w / width, h / height)
+
+def report_records(report):
+    #Detections of a report that have a label index the codebook format can carry
+    return [detection for detection in report.detections if 0 <= detection.category <= 255]
+
+def pack_detections(reports):
+    #One payload from reports that share a codebook, oldest first; see fits()
+    base = reports[0].timestamp
+    seconds = int(base)
+    ms = int(round((base - seconds) * 1000))
+    if ms >= 1000:
+        seconds, ms = seconds + 1, ms - 1000
+    records = bytearray()
+    count = 0
+    for report in reports:
+        dt = int(round((report.timestamp - seconds - ms / 1000) * 1000))
+        dt = max(0, min(0xFFFF, dt))
+        for detection in report_records(report):
+            records += RECORD.pack(detection.category, _unit(detection.confidence), dt,
+                                   *(_unit(value) for value in detection.box))
+            count += 1
+    return HEADER.pack(count, reports[0].codebook, seconds & 0xFFFFFFFF, ms) + bytes(records)
+
+def fits(reports, report):
+    #Whether report can join a payload already holding reports
+    if not reports:
+        return len(report_records(report)) <= MAX_RECORDS
+    return (report.codebook == reports[0].codebook
+            and 0 <= report.timestamp - reports[0].timestamp <= MAX_SPAN
+            and sum(len(report_records(r)) for r in reports) + len(report_records(report)) <= MAX_RECORDS)
+
+def encode_detections(reports, node_id, seq):
+    return encode_frame(FRAME_DETECTIONS, node_id, seq, pack_detections(reports))
+
+def decode_detections(frame, codebook=None):
+    #Returns (codebook digest, [ReceivedDetection]). Labels are named from codebook
+    #when its digest matches; otherwise they are "class_<index>".
+    if frame.frame_type != FRAME_DETECTIONS or len(frame.payload) < HEADER.size:
+        raise FrameError("Not a detections frame")
+    count, digest, seconds, ms = HEADER.unpack_from(frame.payload)
+    if len(frame.payload) != HEADER.size + count * RECORD.size:
+        raise FrameError(f"Detections payload of {len(frame.payload)} bytes does not hold {count} records")
+    base = datetime.fromtimestamp(seconds) + timedelta(milliseconds=ms)
+    names = codebook if codebook is not None and codebook.digest == digest else LabelCodebook([])
+    detections = []
+    for i in range(count):
+        index, confidence, dt, x, y, w, h = RECORD.unpack_from(frame.payload, HEADER.size + i * RECORD.size)
+        detections.append(ReceivedDetection(frame.node_id, base + timedelta(milliseconds=dt), names.label(index),
+                                            confidence / 255, (x / 255, y / 255, w / 255, h / 255)))
+    return digest, detections
+
+def make_report(events, codebook, width, height, image_path=None, timestamp=None):
+    #events: tracker events (box in pixels, category, conf) reported for one frame
+    return DetectionReport(time.time() if timestamp is None else timestamp, codebook.digest,
+                           tuple(Detection(int(event.category), float(event.conf),
+                                           normalize_box(event.box, width, height)) for event in events),
+                           image_path)
@@ -0,0 +1,118 @@
+#This module turns IMX500 network outputs into detections for the WES project.
+#Both the SSD and nanodet paths share it: thresholding uses NumPy masks, box
+#coordinates for the whole frame are converted in one vectorized step, and the
+#result is a DetectionBatch of arrays instead of one Python object per box.
+from collections import namedtuple
+
+import numpy as np
+
+DetectionRecord = namedtuple('DetectionRecord', ['box', 'category', 'conf'])
+
+class LabelTable:
+    #Label strings as a NumPy object array so a whole batch is looked up at once
+    def __init__(self, labels):
+        self.labels = np.asarray(list(labels) or ['unknown'], dtype=object)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def lookup(self, categories):
+        return self.labels[np.clip(np.asarray(categories, dtype=np.intp), 0, len(self.labels) - 1)]
+
+    def label(self, category):
+        return self.labels[min(max(int(category), 0), len(self.labels) - 1)]
+
+class DetectionBatch:
+    #boxes: (N, 4) int32 x, y, w, h in output image pixels; scores: (N,) float32; categories: (N,) int32
+    def __init__(self, boxes, scores, categories, label_table=None):
+        self.boxes = boxes
+        self.scores = scores
+        self.categories = categories
+        self.label_table = label_table
+
+    @classmethod
+    def empty(cls, label_table=None):
+        return cls(np.zeros((0, 4), np.int32), np.zeros(0, np.float32), np.zeros(0, np.int32), label_table)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __iter__(self):
+        #Per-detection records for drawing and tracking (built only when iterated)
+        for box, category, conf in zip(self.boxes.tolist(), self.categories.tolist(), self.scores.tolist()):
+            yield DetectionRecord(tuple(box), category, conf)
+
+    def labels(self):
+        return self.label_table.lookup(self.categories)
+
+    def select(self, mask):
+        return DetectionBatch(self.boxes[mask], self.scores[mask], self.categories[mask], self.label_table)
+
+class CoordinateMapper:
+    #Batched version of IMX500.convert_inference_coords.
+    #For a given ScalerCrop the conversion is a scale and offset followed by a
+    #clamp to the image, so it is measured once with a reference box through the
+    #picamera2 API, cached, and then applied to every box of a frame at once.
+    REFERENCE = (0.25, 0.25, 0.75, 0.75)
+
+    def __init__(self, imx500, picam2, stream="main"):
+        self.imx500 = imx500
+        self.picam2 = picam2
+        self.stream = stream
+        self.cache = {}
+
+    def _transform(self, metadata):
+        key = tuple(metadata.get('ScalerCrop', ()))
+        transform = self.cache.get(key)
+        if transform is None:
+            y0, x0, y1, x1 = self.REFERENCE
+            x, y, w, h = self.imx500.convert_inference_coords(self.REFERENCE, metadata, self.picam2)
+            scale_x = w / (x1 - x0)
+            scale_y = h / (y1 - y0)
+            width, height = self.picam2.camera_configuration()[self.stream]['size']
+            transform = (scale_x, x - x0 * scale_x, scale_y, y - y0 * scale_y, width, height)
+            self.cache[key] = transform
+        return transform
+
+    def convert(self, coords, metadata):
+        #coords: (N, 4) normalized y0, x0, y1, x1 -> (N, 4) int32 x, y, w, h
+        scale_x, offset_x, scale_y, offset_y, width, height = self._transform(metadata)
+        coords = np.maximum(np.asarray(coords, dtype=np.float32).reshape(-1, 4), 0)
+        x0 = np.clip(coords[:, 1] * scale_x + offset_x, 0, width)
+        x1 = np.clip(coords[:, 3] * scale_x + offset_x, 0, width)
+        y0 = np.clip(coords[:, 0] * scale_y + offset_y, 0, height)
+        y1 = np.clip(coords[:, 2] * scale_y + offset_y, 0, height)
+        return np.stack([x0, y0, x1 - x0, y1 - y0], axis=1).astype(np.int32)
+
+def postprocess_outputs(np_outputs, intrinsics, input_size, threshold, iou, max_detections):
+    #Returns normalized boxes (N, 4), scores (N,) and classes (N,) above threshold, best first
+    input_w, input_h = input_size
+    if intrinsics.postprocess == "nanodet":
+        from picamera2.devices.imx500 import postprocess_nanodet_detection
+        from picamera2.devices.imx500.postprocess import scale_boxes
+        boxes, scores, classes = postprocess_nanodet_detection(
+            outputs=np_outputs[0], conf=threshold, iou_thres=iou, max_out_dets=max_detections)[0]
+        boxes = scale_boxes(boxes, 1, 1, input_h, input_w, False, False)
+    else:
+        boxes, scores, classes = np_outputs[0][0], np_outputs[1][0], np_outputs[2][0]
+        if intrinsics.bbox_normalization:
+            boxes = boxes / input_h
+        if intrinsics.bbox_order == "xy":
+            boxes = boxes[:, [1, 0, 3, 2]]
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    classes = np.asarray(classes).reshape(-1).astype(np.int32)
+
+    keep = np.flatnonzero(scores > threshold)
+    keep = keep[np.argsort(scores[keep])[::-1][:max_detections]]
+    return boxes[keep], scores[keep], classes[keep]
+
+def parse_outputs(np_outputs, metadata, intrinsics, input_size, mapper, label_table,
+                  threshold, iou, max_detections):
+    if np_outputs is None:
+        return DetectionBatch.empty(label_table)
+    boxes, scores, classes = postprocess_outputs(np_outputs, intrinsics, input_size, threshold, iou, max_detections)
+    if not len(scores):
+        return DetectionBatch.empty(label_table)
+    return DetectionBatch(mapper.convert(boxes, metadata), scores, classes, label_table)
@@ -0,0 +1,220 @@
+#This module keeps flight logs as a columnar NumPy archive for the WES project.
+#An archive is a directory holding a manifest.json and one typed array per field
+#per chunk: time as int64 epoch nanoseconds, measurements as float32. Chunks are
+#plain .npy files (memory-mapped on load) or, with compression, one .npz per
+#chunk. The manifest records each chunk's row count and time range, so a time
+#slice only opens the chunks it overlaps and nothing is parsed again.
+#   python flight_archive.py convert bme280_log.csv flight1.wesarc [--compress]
+#   python flight_archive.py info flight1.wesarc
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#Field name -> dtype for each kind of log, in CSV column order after the timestamp
+KINDS = {
+    'telemetry': [('time', 'int64'), ('temperature', 'float32'), ('humidity', 'float32'),
+                  ('pressure', 'float32'), ('altitude', 'float32')],
+    'detections': [('time', 'int64'), ('label', 'int16'), ('confidence', 'float32')],
+}
+
+class ArchiveWriter:
+    #Appends rows in chunks of chunk_rows; labels (detections) are stored as codes
+    #into the manifest's label list
+    def __init__(self, path, kind='telemetry', chunk_rows=65536, compress=False, source=None):
+        self.path = path
+        self.kind = kind
+        self.fields = KINDS[kind]
+        self.chunk_rows = chunk_rows
+        self.compress = compress
+        self.manifest = {'version': FORMAT_VERSION, 'kind': kind, 'source': source, 'compressed': compress,
+                         'fields': dict(self.fields), 'labels': [], 'rows': 0, 'chunks': []}
+        self.label_codes = {}
+        self.pending = {name: [] for name, _ in self.fields}
+        os.makedirs(path, exist_ok=True)
+
+    def label_code(self, label):
+        code = self.label_codes.get(label)
+        if code is None:
+            code = self.label_codes[label] = len(self.manifest['labels'])
+            self.manifest['labels'].append(label)
+        return code
+
+    def append(self, time_ns, *values):
+        self.pending['time'].append(time_ns)
+        for (name, _), value in zip(self.fields[1:], values):
+            self.pending[name].append(self.label_code(value) if name == 'label' else value)
+        if len(self.pending['time']) >= self.chunk_rows:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        rows = len(self.pending['time'])
+        if not rows:
+            return
+        index = len(self.manifest['chunks'])
+        arrays = {name: np.asarray(self.pending[name], dtype=dtype) for name, dtype in self.fields}
+        times = arrays['time']
+        chunk = {'rows': rows, 'start': int(times.min()), 'end': int(times.max()),
+                 'sorted': bool(np.all(times[1:] >= times[:-1]))}
+        if self.compress:
+            chunk['file'] = f"chunk_{index:05d}.npz"
+            np.savez_compressed(os.path.join(self.path, chunk['file']), **arrays)
+        else:
+            chunk['files'] = {}
+            for name, array in arrays.items():
+                chunk['files'][name] = f"{name}_{index:05d}.npy"
+                np.save(os.path.join(self.path, chunk['files'][name]), array)
+        self.manifest['chunks'].append(chunk)
+        self.manifest['rows'] += rows
+        self.pending = {name: [] for name, _ in self.fields}
+
+    def close(self):
+        self._write_chunk()
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+class FlightArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported archive version {self.manifest['version']} in {path}")
+        self.fields = list(self.manifest['fields'])
+        self.labels = np.asarray(self.manifest['labels'] or [''], dtype=object)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def chunk(self, index, fields=None):
+        #Arrays of one chunk: memory-mapped for plain chunks, decompressed for .npz chunks
+        chunk = self.manifest['chunks'][index]
+        fields = fields or self.fields
+        if 'file' in chunk:
+            with np.load(os.path.join(self.path, chunk['file'])) as npz:
+                return {name: npz[name] for name in fields}
+        return {name: np.load(os.path.join(self.path, chunk['files'][name]), mmap_mode='r') for name in fields}
+
+    def chunks(self, fields=None):
+        for index in range(len(self.manifest['chunks'])):
+            yield self.chunk(index, fields)
+
+    def column(self, field):
+        #The whole field as one array (memory-mapped if the archive has a single plain chunk)
+        parts = [arrays[field] for arrays in self.chunks([field])]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0, self.manifest['fields'][field])
+
+    def slice(self, start=None, end=None, fields=None):
+        #Rows with start <= time < end (epoch ns), reading only the chunks that overlap.
+        #Returns {field: array}; time is always included.
+        fields = fields or self.fields
+        wanted = list(dict.fromkeys(['time'] + list(fields)))
+        parts = {name: [] for name in wanted}
+        for index, chunk in enumerate(self.manifest['chunks']):
+            if (start is not None and chunk['end'] < start) or (end is not None and chunk['start'] >= end):
+                continue
+            arrays = self.chunk(index, wanted)
+            times = arrays['time']
+            if chunk['sorted']:
+                lo = 0 if start is None else np.searchsorted(times, start, 'left')
+                hi = len(times) if end is None else np.searchsorted(times, end, 'left')
+                selection = slice(lo, hi)
+            else:
+                selection = np.ones(len(times), bool)
+                if start is not None:
+                    selection &= times >= start
+                if end is not None:
+                    selection &= times < end
+            for name in wanted:
+                parts[name].append(np.asarray(arrays[name][selection]))
+        return {name: np.concatenate(parts[name]) if parts[name]
+                else np.zeros(0, self.manifest['fields'][name]) for name in wanted}
+
+class FlightDataset:
+    #Several archives (e.g. one per flight) sliced as one; adds a 'flight' index column
+    def __init__(self, paths):
+        self.archives = [FlightArchive(path) for path in paths]
+
+    def slice(self, start=None, end=None, fields=None):
+        results = [archive.slice(start, end, fields) for archive in self.archives]
+        names = list(results[0]) if results else []
+        combined = {name: np.concatenate([result[name] for result in results]) for name in names}
+        combined['flight'] = np.concatenate([np.full(len(result[names[0]]), i, np.int16)
+                                             for i, result in enumerate(results)] or [np.zeros(0, np.int16)])
+        return combined
+
+def _epoch_ns_parser():
+    #Timestamps repeat within a second, so each distinct string is parsed once
+    cache = {}
+    def parse(text):
+        value = cache.get(text)
+        if value is None:
+            value = cache[text] = int(datetime.strptime(text.strip(), CSV_TIME_FORMAT).timestamp()) * 1_000_000_000
+        return value
+    return parse
+
+def convert_csv(csv_path, archive_path, kind='telemetry', chunk_rows=65536, compress=False):
+    #Convert a BME280 log (main.CSV_FILENAME or the plotter CSV) or an AI detection
+    #log into an archive. Returns (rows written, rows skipped).
+    writer = ArchiveWriter(archive_path, kind, chunk_rows, compress, source=os.path.basename(csv_path))
+    parse_time = _epoch_ns_parser()
+    columns = len(KINDS[kind]) - 1
+    skipped = 0
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            try:
+                values = row[1:1 + columns]
+                if kind == 'telemetry':
+                    values = [float(value) for value in values]
+                else:
+                    values = [values[0], float(values[1])]
+                if len(values) != columns:
+                    raise ValueError
+                writer.append(parse_time(row[0]), *values)
+            except (ValueError, IndexError):
+                skipped += 1
+    writer.close()
+    return writer.manifest['rows'], skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="WES columnar flight archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Convert a CSV log into an archive")
+    convert.add_argument("csv")
+    convert.add_argument("archive")
+    convert.add_argument("--kind", choices=list(KINDS), default="telemetry")
+    convert.add_argument("--chunk-rows", type=int, default=65536)
+    convert.add_argument("--compress", action="store_true")
+    info = commands.add_parser("info", help="Describe an archive")
+    info.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        started = time.perf_counter()
+        rows, skipped = convert_csv(args.csv, args.archive, args.kind, args.chunk_rows, args.compress)
+        print(f"[Archive] Wrote {rows} rows ({skipped} skipped) to {args.archive} in {time.perf_counter() - started:.2f}s")
+    else:
+        archive = FlightArchive(args.archive)
+        manifest = archive.manifest
+        print(f"{args.archive}: {manifest['kind']}, {manifest['rows']} rows in {len(manifest['chunks'])} chunks"
+              f"{' (compressed)' if manifest['compressed'] else ''}, source {manifest['source']}")
+        if manifest['chunks']:
+            first = datetime.fromtimestamp(manifest['chunks'][0]['start'] / 1e9)
+            last = datetime.fromtimestamp(max(chunk['end'] for chunk in manifest['chunks']) / 1e9)
+            print(f"  {first:%Y-%m-%d %H:%M:%S} .. {last:%Y-%m-%d %H:%M:%S}")
+        print("  fields: " + ", ".join(f"{name} {dtype}" for name, dtype in manifest['fields'].items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#This module stores flight data in SQLite for the WES project.
+#The database runs in WAL mode so queries can read while the ground station
+#writes. Rows are buffered and inserted in one transaction per batch. Telemetry
+#and detections are keyed by flight, node and sequence number and indexed by
+#time, so post-flight range and downsampled queries do not scan everything.
+#   python flight_store.py import flights.db --flight test1 --telemetry bme.csv --detections ai.csv
+#   python flight_store.py summary flights.db
+import argparse
+import csv
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS telemetry (
+    flight_id INTEGER NOT NULL REFERENCES flights(id),
+    node_id INTEGER NOT NULL,
+    seq INTEGER,
+    ts REAL NOT NULL,
+    temperature REAL,
+    humidity REAL,
+    pressure REAL,
+    altitude REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS telemetry_key ON telemetry (flight_id, node_id, seq, ts);
+CREATE INDEX IF NOT EXISTS telemetry_time ON telemetry (flight_id, ts);
+CREATE TABLE IF NOT EXISTS detections (
+    flight_id INTEGER NOT NULL REFERENCES flights(id),
+    node_id INTEGER NOT NULL,
+    seq INTEGER,
+    ts REAL NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL,
+    image TEXT
+);
+CREATE INDEX IF NOT EXISTS detections_time ON detections (flight_id, ts);
+"""
+
+TELEMETRY_FIELDS = ('temperature', 'humidity', 'pressure', 'altitude')
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class FlightStore:
+    def __init__(self, path, flight=None, batch_rows=200, batch_interval=2.0):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.batch_interval = batch_interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.telemetry_rows = []
+        self.detection_rows = []
+        self.last_flush = time.monotonic()
+        self.inserted = 0
+        self.flight_id = self.start_flight(flight) if flight else None
+
+    def start_flight(self, name):
+        #Returns the id of the flight called name, creating it if needed; later rows go to it
+        with self.lock:
+            with self.db:
+                self.db.execute("INSERT OR IGNORE INTO flights (name, started) VALUES (?, ?)", (name, time.time()))
+            self.flight_id = self.db.execute("SELECT id FROM flights WHERE name = ?", (name,)).fetchone()[0]
+        return self.flight_id
+
+    def add_telemetry(self, node_id, seq, ts, temperature, humidity, pressure, altitude):
+        #ts: epoch seconds
+        with self.lock:
+            self.telemetry_rows.append((self.flight_id, node_id, seq, ts, temperature, humidity, pressure, altitude))
+            due = len(self.telemetry_rows) + len(self.detection_rows) >= self.batch_rows
+        if due:
+            self.flush()
+
+    def add_detection(self, node_id, ts, label, confidence, image=None, seq=None):
+        with self.lock:
+            self.detection_rows.append((self.flight_id, node_id, seq, ts, label, confidence, image))
+            due = len(self.telemetry_rows) + len(self.detection_rows) >= self.batch_rows
+        if due:
+            self.flush()
+
+    def flush(self):
+        #Insert everything buffered in one transaction (rows already stored are ignored)
+        with self.lock:
+            telemetry, self.telemetry_rows = self.telemetry_rows, []
+            detections, self.detection_rows = self.detection_rows, []
+            self.last_flush = time.monotonic()
+            if not telemetry and not detections:
+                return 0
+            with self.db:
+                self.db.executemany("INSERT OR IGNORE INTO telemetry VALUES (?, ?, ?, ?, ?, ?, ?, ?)", telemetry)
+                self.db.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)", detections)
+            self.inserted += len(telemetry) + len(detections)
+        return len(telemetry) + len(detections)
+
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= self.batch_interval:
+            self.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.db.close()
+
+    def _where(self, start, end, node_id, flight_id):
+        flight_id = self.flight_id if flight_id is None else flight_id
+        clauses, params = ["flight_id = ?"], [flight_id]
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if node_id is not None:
+            clauses.append("node_id = ?")
+            params.append(node_id)
+        return " AND ".join(clauses), params
+
+    def telemetry(self, start=None, end=None, node_id=None, flight_id=None):
+        #Rows of (node_id, seq, ts, temperature, humidity, pressure, altitude) in time order
+        where, params = self._where(start, end, node_id, flight_id)
+        with self.lock:
+            return self.db.execute(
+                f"SELECT node_id, seq, ts, {', '.join(TELEMETRY_FIELDS)} FROM telemetry "
+                f"WHERE {where} ORDER BY ts", params).fetchall()
+
+    def downsample(self, field, bucket_seconds, start=None, end=None, node_id=None, flight_id=None):
+        #Rows of (bucket start, min, max, avg, count) for one telemetry field
+        if field not in TELEMETRY_FIELDS:
+            raise ValueError(f"Unknown telemetry field: {field}")
+        where, params = self._where(start, end, node_id, flight_id)
+        with self.lock:
+            return self.db.execute(
+                f"SELECT CAST(ts / ? AS INTEGER) * ? AS bucket, MIN({field}), MAX({field}), AVG({field}), COUNT(*) "
+                f"FROM telemetry WHERE {where} GROUP BY bucket ORDER BY bucket",
+                [bucket_seconds, bucket_seconds] + params).fetchall()
+
+    def detections(self, start=None, end=None, node_id=None, flight_id=None):
+        #Rows of (node_id, ts, label, confidence, image) in time order
+        where, params = self._where(start, end, node_id, flight_id)
+        with self.lock:
+            return self.db.execute(
+                f"SELECT node_id, ts, label, confidence, image FROM detections WHERE {where} ORDER BY ts",
+                params).fetchall()
+
+    def flights(self):
+        #Rows of (id, name, started, telemetry rows, first ts, last ts)
+        with self.lock:
+            return self.db.execute(
+                "SELECT f.id, f.name, f.started, COUNT(t.ts), MIN(t.ts), MAX(t.ts) "
+                "FROM flights f LEFT JOIN telemetry t ON t.flight_id = f.id GROUP BY f.id ORDER BY f.id").fetchall()
+
+def _epoch(text):
+    return datetime.strptime(text.strip(), CSV_TIME_FORMAT).timestamp()
+
+def import_csv(store, telemetry_csv=None, detections_csv=None, node_id=0):
+    #One-shot import of the existing CSV logs into the store's current flight.
+    #The CSVs have no sequence numbers, so the row number is used instead.
+    counts = {'telemetry': 0, 'detections': 0, 'skipped': 0}
+    if telemetry_csv:
+        with open(telemetry_csv, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for seq, row in enumerate(reader):
+                try:
+                    store.add_telemetry(node_id, seq, _epoch(row[0]), *map(float, row[1:5]))
+                    counts['telemetry'] += 1
+                except (ValueError, IndexError):
+                    counts['skipped'] += 1
+    if detections_csv:
+        with open(detections_csv, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                try:
+                    store.add_detection(node_id, _epoch(row[0]), row[1], float(row[2]))
+                    counts['detections'] += 1
+                except (ValueError, IndexError):
+                    counts['skipped'] += 1
+    store.flush()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="WES flight database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Import CSV logs as one flight")
+    importer.add_argument("db")
+    importer.add_argument("--flight", required=True)
+    importer.add_argument("--telemetry", help="BME280 CSV (Timestamp, Temperature, Humidity, Pressure, Altitude)")
+    importer.add_argument("--detections", help="AI detection CSV (Timestamp, Detected Object, Confidence)")
+    importer.add_argument("--node", type=int, default=0)
+    summary = commands.add_parser("summary", help="List the flights in a database")
+    summary.add_argument("db")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = FlightStore(args.db, flight=args.flight, batch_rows=5000)
+        started = time.perf_counter()
+        counts = import_csv(store, args.telemetry, args.detections, args.node)
+        store.close()
+        print(f"[Flight Store] Imported {counts['telemetry']} telemetry and {counts['detections']} detection rows "
+              f"({counts['skipped']} skipped) into flight '{args.flight}' in {time.perf_counter() - started:.2f}s")
+    else:
+        store = FlightStore(args.db)
+        for flight_id, name, started, rows, first, last in store.flights():
+            span = f"{datetime.fromtimestamp(first):%Y-%m-%d %H:%M:%S} .. {datetime.fromtimestamp(last):%H:%M:%S}" if rows else "empty"
+            print(f"{flight_id:>4}  {name:<24} {rows:>8} rows  {span}")
+        store.close()
+
+if __name__ == "__main__":
+    main()
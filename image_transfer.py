@@ -0,0 +1,323 @@
+#This module sends detection thumbnails over the LoRa link for the WES project.
+#
+#An image goes out as one META frame (size, CRC-32, label, confidence) and a
+#series of numbered CHUNK frames. The ground station answers with a NACK frame
+#holding a bitmap of the chunks it has, and the flight node resends only the
+#missing ones. A bitmap with every bit set means the image is complete.
+#
+#One image is in flight at a time. Thumbnails get IMAGE_AIRTIME_SHARE of the
+#duty-cycle airtime: the next image starts only once the airtime of the last one
+#has been earned back, and THUMBNAIL_BUDGET is the largest image whose frames
+#fit in IMAGE_INTERVAL seconds of that share.
+#
+#   META  payload: image id u16, size u16, crc32 u32, confidence u8, label (utf-8)
+#   CHUNK payload: image id u16, index u8, count u8, data
+#   NACK  payload: image id u16, flags u8 (bit 0: have META), count u8, bitmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from telemetry_codec import (FRAME_IMAGE_META, FRAME_IMAGE_CHUNK, FRAME_IMAGE_NACK,
+                             HEADER_SIZE, CRC, encode_frame)
+from tx_scheduler import DUTY_CYCLE, lora_airtime
+
+CHUNK_SIZE = 64
+MAX_CHUNKS = 255
+
+#Share of the duty-cycle airtime thumbnails may use, and how often one of the
+#largest thumbnails may go out at that share (seconds)
+IMAGE_AIRTIME_SHARE = 0.5
+IMAGE_INTERVAL = 120.0
+#Seconds to wait for the ground station's answer after the last frame of an image was sent
+ANSWER_TIMEOUT = 30.0
+
+META = struct.Struct('>HHIB')
+CHUNK = struct.Struct('>HBB')
+NACK = struct.Struct('>HBB')
+HAVE_META = 0x01
+LABEL_BYTES = 32
+
+def image_airtime(size, airtime=lora_airtime):
+    #Seconds on air for the META frame and every chunk of a size-byte image
+    overhead = HEADER_SIZE + CRC.size
+    count = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    total = airtime(overhead + META.size + LABEL_BYTES)
+    if count:
+        total += (count - 1) * airtime(overhead + CHUNK.size + CHUNK_SIZE)
+        total += airtime(overhead + CHUNK.size + size - (count - 1) * CHUNK_SIZE)
+    return total
+
+def image_budget(duty_cycle=DUTY_CYCLE, interval=IMAGE_INTERVAL, share=IMAGE_AIRTIME_SHARE, airtime=lora_airtime):
+    #Largest image (bytes, whole chunks) whose airtime fits interval seconds of the share
+    allowance = duty_cycle * share * interval
+    count = 1
+    while count < MAX_CHUNKS and image_airtime((count + 1) * CHUNK_SIZE, airtime) <= allowance:
+        count += 1
+    return count * CHUNK_SIZE
+
+THUMBNAIL_BUDGET = image_budget()
+
+def _bitmap(received, count):
+    bitmap = bytearray((count + 7) // 8)
+    for index in received:
+        bitmap[index >> 3] |= 1 << (index & 7)
+    return bytes(bitmap)
+
+def _missing(bitmap, count):
+    missing = []
+    for i in range(count):
+        byte = i >> 3
+        if byte >= len(bitmap) or not bitmap[byte] & (1 << (i & 7)):
+            missing.append(i)
+    return missing
+
+class OutgoingImage:
+    def __init__(self, image_id, data, label, confidence):
+        self.image_id = image_id
+        self.data = data
+        self.label = label
+        self.confidence = confidence
+        self.count = (len(data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+        self.created = time.monotonic()
+        self.resends = 0
+        self.queued = set()         #Chunk indexes (None for META) waiting in the scheduler
+        self.last_sent = None       #time.monotonic() of the last frame written
+
+class ImageSender:
+    #Flight side: sends one thumbnail at a time through the TX scheduler, resends the
+    #chunks the ground station reports missing and starts the next image once this
+    #one is delivered or abandoned and its airtime has been earned back (ready()).
+    def __init__(self, scheduler, priority, node_id, duty_cycle=DUTY_CYCLE, share=IMAGE_AIRTIME_SHARE,
+                 max_resends=5, answer_timeout=ANSWER_TIMEOUT):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.node_id = node_id
+        self.rate = duty_cycle * share      #Seconds of image airtime earned per second
+        self.max_resends = max_resends
+        self.answer_timeout = answer_timeout
+        self.current = None
+        self.next_start = 0.0
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.sent_chunks = 0
+        self.resent_chunks = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.purged_frames = 0
+
+    def _meta_frame(self, image):
+        label = image.label.encode('utf-8')[:LABEL_BYTES]
+        payload = META.pack(image.image_id, len(image.data), zlib.crc32(image.data),
+                            max(0, min(255, int(round(image.confidence * 255))))) + label
+        return encode_frame(FRAME_IMAGE_META, self.node_id, image.image_id, payload)
+
+    def _chunk_frame(self, image, index):
+        data = image.data[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+        payload = CHUNK.pack(image.image_id, index, image.count) + data
+        return encode_frame(FRAME_IMAGE_CHUNK, self.node_id, image.image_id, payload)
+
+    def _submit(self, image, index):
+        #index None is the META frame; a frame already waiting in the scheduler is not queued twice
+        if index in image.queued:
+            return False
+        image.queued.add(index)
+        frame = self._meta_frame(image) if index is None else self._chunk_frame(image, index)
+
+        def on_sent(sent_at):
+            with self.lock:
+                image.queued.discard(index)
+                image.last_sent = sent_at
+        self.scheduler.submit(self.priority, frame, on_sent=on_sent, tag=image)
+        return True
+
+    def ready(self, now=None):
+        #True when a new image may be sent
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self.current is None and now >= self.next_start
+
+    def send(self, data, label, confidence):
+        #Returns the image id, or None if the image was not sent (too large, or not ready())
+        if len(data) > CHUNK_SIZE * MAX_CHUNKS:
+            print(f"[Image TX] Thumbnail too large ({len(data)} bytes), not sent")
+            return None
+        now = time.monotonic()
+        with self.lock:
+            if self.current is not None or now < self.next_start:
+                return None
+            image = OutgoingImage(self.next_id, bytes(data), label, confidence)
+            self.next_id = (self.next_id + 1) & 0xFFFF
+            self.current = image
+            self.next_start = now + image_airtime(len(image.data), self.scheduler.airtime) / self.rate
+            self.sent_chunks += image.count
+            self._submit(image, None)
+            for index in range(image.count):
+                self._submit(image, index)
+        print(f"[Image TX] Queued image #{image.image_id} ({label}, {len(data)} bytes, {image.count} chunks)")
+        return image.image_id
+
+    def _finish(self, image, delivered):
+        #Called with the lock held: frames of an abandoned image still queued are taken back
+        self.current = None
+        purged = self.scheduler.discard(self.priority, image)
+        image.queued.clear()
+        self.purged_frames += purged
+        if delivered:
+            self.completed += 1
+        else:
+            self.abandoned += 1
+        return purged
+
+    def handle_nack(self, frame):
+        image_id, flags, count = NACK.unpack_from(frame.payload)
+        bitmap = bytes(frame.payload[NACK.size:])
+        with self.lock:
+            image = self.current
+            if image is None or image.image_id != image_id:
+                return
+            missing = _missing(bitmap, image.count)
+            if not missing and flags & HAVE_META:
+                self._finish(image, True)
+                print(f"[Image TX] Image #{image_id} delivered")
+                return
+            if image.resends >= self.max_resends:
+                purged = self._finish(image, False)
+                print(f"[Image TX] Giving up on image #{image_id} ({len(missing)} chunks missing, "
+                      f"{purged} queued frames dropped)")
+                return
+            image.resends += 1
+            resent = 0
+            if not flags & HAVE_META:
+                self._submit(image, None)
+            for index in missing:
+                resent += self._submit(image, index)
+            self.resent_chunks += resent
+        print(f"[Image TX] Resending {resent} of {len(missing)} missing chunk(s) of image #{image_id}")
+
+    def poll(self, now=None):
+        #Abandon the image in flight if the ground station stays silent after its last frame
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            image = self.current
+            if image is None or image.queued or image.last_sent is None:
+                return
+            if now - image.last_sent >= self.answer_timeout:
+                self._finish(image, False)
+                print(f"[Image TX] No answer for image #{image.image_id} after {self.answer_timeout:.0f}s, moving on")
+
+    def report(self):
+        with self.lock:
+            in_flight = f"#{self.current.image_id}" if self.current is not None else "none"
+            return (f"[Image TX] {self.completed} delivered, {self.abandoned} abandoned, in flight {in_flight}; "
+                    f"{self.sent_chunks} chunks sent, {self.resent_chunks} resent, {self.purged_frames} purged")
+
+class IncomingImage:
+    def __init__(self, node_id, image_id):
+        self.node_id = node_id
+        self.image_id = image_id
+        self.count = None
+        self.chunks = {}
+        self.size = None
+        self.crc = None
+        self.label = None
+        self.confidence = None
+        self.updated = time.monotonic()
+        self.nacks = 0
+        self.done = False
+
+    def complete(self):
+        return self.count is not None and self.size is not None and len(self.chunks) == self.count
+
+class ImageAssembler:
+    #Ground side: collects chunks per (node, image id), asks for missing ones once
+    #a transfer goes quiet, and writes finished images to the gallery directory.
+    def __init__(self, gallery_dir='gallery', nack_timeout=10.0, max_nacks=5):
+        self.gallery_dir = gallery_dir
+        self.nack_timeout = nack_timeout
+        self.max_nacks = max_nacks
+        self.transfers = {}
+        self.received = 0
+        self.failed = 0
+        #handle_frame runs on each serial reader thread and poll on the NACK thread
+        self.lock = threading.Lock()
+        os.makedirs(gallery_dir, exist_ok=True)
+
+    def _transfer(self, frame, image_id):
+        key = (frame.node_id, image_id)
+        transfer = self.transfers.get(key)
+        if transfer is None:
+            transfer = self.transfers[key] = IncomingImage(frame.node_id, image_id)
+        transfer.updated = time.monotonic()
+        return transfer
+
+    def handle_frame(self, frame):
+        #Returns the saved gallery path when an image completes, else None
+        with self.lock:
+            key = (frame.node_id, struct.unpack_from('>H', frame.payload)[0])
+            if key in self.transfers and self.transfers[key].done:
+                return None
+            if frame.frame_type == FRAME_IMAGE_META:
+                image_id, size, crc, confidence = META.unpack_from(frame.payload)
+                transfer = self._transfer(frame, image_id)
+                transfer.size = size
+                transfer.crc = crc
+                transfer.confidence = confidence / 255
+                transfer.label = bytes(frame.payload[META.size:]).decode('utf-8', errors='replace')
+                if transfer.count is None:
+                    transfer.count = max(1, (size + CHUNK_SIZE - 1) // CHUNK_SIZE)
+            elif frame.frame_type == FRAME_IMAGE_CHUNK:
+                image_id, index, count = CHUNK.unpack_from(frame.payload)
+                transfer = self._transfer(frame, image_id)
+                transfer.count = count
+                transfer.chunks[index] = bytes(frame.payload[CHUNK.size:])
+            else:
+                return None
+            if transfer.complete():
+                return self._finish(transfer)
+            return None
+
+    def _finish(self, transfer):
+        data = b''.join(transfer.chunks[i] for i in range(transfer.count))[:transfer.size]
+        if zlib.crc32(data) != transfer.crc:
+            #Start over: forget the chunks and let the next NACK ask for all of them
+            print(f"[Image RX] Image #{transfer.image_id} from node {transfer.node_id} failed CRC, re-requesting")
+            transfer.chunks.clear()
+            return None
+        label = re.sub(r'[^a-zA-Z0-9_.-]', '_', transfer.label or 'unknown')
+        path = os.path.join(self.gallery_dir,
+                            f"node{transfer.node_id}_{transfer.image_id:05d}_{label}_{int(transfer.confidence * 100)}.jpg")
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.received += 1
+        transfer.done = True
+        print(f"[Image RX] Saved {path} ({len(data)} bytes)")
+        return path
+
+    def poll(self, now=None):
+        #Returns NACK frames to send back: a final all-received bitmap for finished
+        #images, and a bitmap of what arrived for transfers that went quiet
+        now = time.monotonic() if now is None else now
+        nacks = []
+        with self.lock:
+            for key, transfer in list(self.transfers.items()):
+                if transfer.done:
+                    nacks.append(self._nack(transfer))
+                    del self.transfers[key]
+                elif now - transfer.updated >= self.nack_timeout and transfer.count is not None:
+                    if transfer.nacks >= self.max_nacks:
+                        print(f"[Image RX] Giving up on image #{transfer.image_id} from node {transfer.node_id}")
+                        self.failed += 1
+                        del self.transfers[key]
+                        continue
+                    transfer.nacks += 1
+                    transfer.updated = now
+                    nacks.append(self._nack(transfer))
+        return nacks
+
+    def _nack(self, transfer):
+        flags = HAVE_META if transfer.size is not None else 0
+        payload = NACK.pack(transfer.image_id, flags, transfer.count) + _bitmap(transfer.chunks, transfer.count)
+        return encode_frame(FRAME_IMAGE_NACK, transfer.node_id, transfer.image_id, payload)
@@ -0,0 +1,129 @@
+#This module saves detection images for the WES project on background threads.
+#Frames are encoded to JPEG (simplejpeg if installed, otherwise cv2) and written
+#by a small worker pool. The pending queue is bounded; when the SD card falls
+#behind, the oldest waiting frame is dropped so the newest is always kept.
+#The same workers also build the small thumbnails sent over the LoRa link.
+import threading
+from collections import deque
+
+import cv2
+
+from image_transfer import THUMBNAIL_BUDGET
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+def encode_jpeg(frame, quality):
+    if simplejpeg is not None:
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        if channels == 1:
+            return simplejpeg.encode_jpeg(frame.reshape(frame.shape[0], frame.shape[1], 1), quality=quality,
+                                          colorspace='GRAY', colorsubsampling='Gray')
+        colorspace = 'BGRX' if channels == 4 else 'BGR'
+        return simplejpeg.encode_jpeg(frame, quality=quality, colorspace=colorspace)
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("cv2.imencode failed")
+    return encoded.tobytes()
+
+#Thumbnail settings for the LoRa image downlink
+THUMBNAIL_SIZE = 96          #Longest side in pixels
+#(THUMBNAIL_BUDGET, in bytes, follows from the link's duty cycle and airtime; see image_transfer.py)
+THUMBNAIL_QUALITY = (60, 50, 40, 30, 20)
+
+def make_thumbnail(frame, box, budget=THUMBNAIL_BUDGET, size=THUMBNAIL_SIZE):
+    #Crop the detection box (with a little margin), scale it down and lower the
+    #JPEG quality until it fits the budget; shrink further if it still does not
+    x, y, w, h = (int(v) for v in box)
+    margin_x, margin_y = w // 8, h // 8
+    height, width = frame.shape[:2]
+    x0, y0 = max(x - margin_x, 0), max(y - margin_y, 0)
+    x1, y1 = min(x + w + margin_x, width), min(y + h + margin_y, height)
+    crop = frame[y0:y1, x0:x1] if x1 > x0 and y1 > y0 else frame
+    if crop.ndim == 3 and crop.shape[2] == 4:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGRA2BGR)
+    while size >= 16:
+        scale = size / max(crop.shape[:2])
+        thumb = crop
+        if scale < 1:
+            thumb = cv2.resize(crop, (max(int(crop.shape[1] * scale), 1), max(int(crop.shape[0] * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
+        for quality in THUMBNAIL_QUALITY:
+            data = encode_jpeg(thumb, quality)
+            if len(data) <= budget:
+                return data
+        size = size * 3 // 4
+    return None
+
+class ImageWriterPool:
+    def __init__(self, workers=2, max_pending=4, quality=85):
+        self.quality = quality
+        self.pending = deque()
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.closed = False
+        self.saved = 0
+        self.dropped = 0
+        self.failed = 0
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"Image Writer {i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, frame, path, on_saved=None, on_failed=None):
+        #frame must be a private copy (the camera buffer is released right after this call).
+        #on_saved(path) runs once the file is written; on_failed(path) if the frame is
+        #dropped or cannot be encoded or written
+        def save():
+            data = encode_jpeg(frame, self.quality)
+            with open(path, 'wb') as f:
+                f.write(data)
+            print(f"Image saved: {path}")
+            if on_saved is not None:
+                on_saved(path)
+        self.submit_task(save, path, None if on_failed is None else lambda: on_failed(path))
+
+    def submit_task(self, task, description, on_failed=None):
+        #Run any encoding job on the pool, with the same drop-oldest policy
+        dropped = None
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                dropped = self.pending.popleft()
+                self.dropped += 1
+                print(f"[Image Writer] Falling behind, dropped {dropped[0]}")
+            self.pending.append((description, task, on_failed))
+            self.cond.notify()
+        if dropped is not None and dropped[2] is not None:
+            dropped[2]()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                description, task, on_failed = self.pending.popleft()
+            try:
+                task()
+            except Exception as e:
+                with self.cond:
+                    self.failed += 1
+                print(f"Failed to save image: {description} ({e})")
+                if on_failed is not None:
+                    on_failed()
+                continue
+            with self.cond:
+                self.saved += 1
+
+    def close(self, timeout=5):
+        #Finish the frames already queued, then stop the workers
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join(timeout=timeout)
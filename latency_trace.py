@@ -0,0 +1,189 @@
+#This module measures how stale data is as it moves through the WES project.
+#Each sample is traced by a key (its monotonic read time on the flight node,
+#(node id, sequence number) on the ground station). Marking a trace point
+#records the time since the previous point in a per-hop latency histogram:
+#   flight: read -> enqueue -> dequeue -> tx write
+#   ground: sensor read -> rx read -> parse -> persist / render
+#SequenceTracker turns gaps in the 16-bit sequence numbers into link loss, and
+#NodeTraffic counts frames, samples and bytes per node and serial port.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+class LatencyHistogram:
+    #Log-spaced buckets from MIN_LATENCY, each about 9% wider than the last,
+    #so percentiles are accurate to a few percent from 0.1 ms up to about an hour
+    MIN_LATENCY = 1e-4
+    RATIO = 2 ** (1 / 8)
+    BUCKETS = 200
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        seconds = max(seconds, 0.0)
+        if seconds <= self.MIN_LATENCY:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.MIN_LATENCY, self.RATIO)) + 1, self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        #Upper edge of the bucket holding the p-th percentile (never above the max seen)
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.MIN_LATENCY * self.RATIO ** index, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class LatencyTracer:
+    def __init__(self, name, max_traces=4096):
+        self.name = name
+        self.max_traces = max_traces
+        self.traces = OrderedDict()
+        self.hops = OrderedDict()
+        self.lock = threading.Lock()
+
+    def mark(self, key, point, t=None, since=None):
+        #Record that the sample reached point at time t (time.monotonic by default).
+        #The hop is measured from since, or from the last point this sample reached.
+        if key is None:
+            return
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            trace = self.traces.get(key)
+            if trace is not None and point in trace:
+                #Same key reaching a point twice (e.g. a repeated frame) starts a new trace
+                del self.traces[key]
+                trace = None
+            if trace is None:
+                trace = self.traces[key] = OrderedDict()
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+            start = since if since is not None else next(reversed(trace), None)
+            if start in trace:
+                self._record(f"{start} -> {point}", t - trace[start])
+            trace[point] = t
+
+    def span(self, key, start, end):
+        #Record an extra hop between two points the sample already reached
+        with self.lock:
+            trace = self.traces.get(key)
+            if trace is not None and start in trace and end in trace:
+                self._record(f"{start} -> {end}", trace[end] - trace[start])
+
+    def observe(self, hop, seconds):
+        #Record a hop measured elsewhere (e.g. across nodes with wall clocks)
+        with self.lock:
+            self._record(hop, seconds)
+
+    def _record(self, hop, seconds):
+        histogram = self.hops.get(hop)
+        if histogram is None:
+            histogram = self.hops[hop] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def report(self, link=None):
+        lines = [f"[Latency] {self.name} report:"]
+        with self.lock:
+            for hop, histogram in self.hops.items():
+                lines.append(
+                    f"  {hop:<26} n={histogram.count} p50={histogram.percentile(50) * 1000:.1f}ms "
+                    f"p95={histogram.percentile(95) * 1000:.1f}ms p99={histogram.percentile(99) * 1000:.1f}ms "
+                    f"max={histogram.max * 1000:.1f}ms"
+                )
+        if len(lines) == 1:
+            lines.append("  no samples traced yet")
+        if link is not None:
+            lines.extend(link.report_lines())
+        return "\n".join(lines)
+
+class SequenceTracker:
+    #Per-node link loss from 16-bit sequence numbers. A jump forward counts the
+    #skipped numbers as lost; a jump backward (restart or reordering) does not.
+    WINDOW = 0x8000
+
+    def __init__(self):
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+    def received(self, node_id, seq):
+        with self.lock:
+            stats = self.nodes.get(node_id)
+            if stats is None:
+                self.nodes[node_id] = {'next': (seq + 1) & 0xFFFF, 'received': 1, 'lost': 0, 'duplicates': 0}
+                return
+            gap = (seq - stats['next']) & 0xFFFF
+            if gap < self.WINDOW:
+                stats['lost'] += gap
+                stats['next'] = (seq + 1) & 0xFFFF
+            else:
+                stats['duplicates'] += 1
+            stats['received'] += 1
+
+    def loss(self, node_id):
+        stats = self.nodes.get(node_id)
+        if not stats:
+            return 0.0
+        return stats['lost'] / (stats['lost'] + stats['received'])
+
+    def report_lines(self):
+        with self.lock:
+            return [
+                f"  link node {node_id}: received={stats['received']} lost={stats['lost']} "
+                f"loss={100 * stats['lost'] / (stats['lost'] + stats['received']):.1f}% "
+                f"out-of-order={stats['duplicates']}"
+                for node_id, stats in sorted(self.nodes.items())
+            ]
+
+class NodeTraffic:
+    #Per-node throughput on the ground station. Rates are given over the whole run
+    #and since the previous report, so a burst or a silent node shows up.
+    def __init__(self):
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+    def received(self, node_id, port, nbytes, samples=0, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            stats = self.nodes.get(node_id)
+            if stats is None:
+                stats = self.nodes[node_id] = {'frames': 0, 'samples': 0, 'bytes': 0, 'first': now,
+                                               'last': now, 'ports': set(), 'reported': (now, 0, 0)}
+            stats['frames'] += 1
+            stats['samples'] += samples
+            stats['bytes'] += nbytes
+            stats['last'] = now
+            stats['ports'].add(port)
+
+    def report_lines(self, now=None):
+        now = time.monotonic() if now is None else now
+        lines = []
+        with self.lock:
+            for node_id, stats in sorted(self.nodes.items()):
+                since, samples, nbytes = stats['reported']
+                recent = max(now - since, 1e-9)
+                total = max(now - stats['first'], 1e-9)
+                lines.append(
+                    f"  node {node_id} via {', '.join(sorted(stats['ports']))}: frames={stats['frames']} "
+                    f"samples={stats['samples']} bytes={stats['bytes']} "
+                    f"rate={stats['samples'] / total:.2f}/s {stats['bytes'] / total:.0f} B/s "
+                    f"(recent {(stats['samples'] - samples) / recent:.2f}/s {(stats['bytes'] - nbytes) / recent:.0f} B/s), "
+                    f"last heard {now - stats['last']:.1f}s ago")
+                stats['reported'] = (now, stats['samples'], stats['bytes'])
+        return lines
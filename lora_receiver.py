@@ -2,96 +2,267 @@ import serial
 import time
 from datetime import datetime
 import os
-import subprocess
-from plotter import parse_and_plot, handle_ai_detection
-
-# Setup serial port (adjust device if needed)
-try:
-    lora = serial.Serial(
-        port='/dev/ttyUSB0',
-        baudrate=9600,
-        parity=serial.PARITY_NONE,
-        stopbits=serial.STOPBITS_ONE,
-        bytesize=serial.EIGHTBITS,
-        timeout=1
-    )
-except serial.SerialException as e:
-    print(f"[LoRa RX] Could not open serial port: {e}")
-    print("Check USB connection, port name, and permissions.")
-    exit(1)
+import signal
+import threading
+from command_executor import CommandExecutor, ScriptIndex, report_results
+from plotter import (parse_and_plot, plot_frame, plot_summary, handle_ai_detection, handle_detection_frame, render_loop,
+                     persistence_worker, init_plot, tracer, link_stats)
+from telemetry_codec import (FRAME_SAMPLE, FRAME_BATCH, FRAME_IMAGE_META, FRAME_IMAGE_CHUNK, FRAME_SUMMARY,
+                             FRAME_RELIABLE, FRAME_DETECTIONS, HEADER_SIZE, CRC, Frame, decode_frame)
+from latency_trace import NodeTraffic
+from serial_reader import SerialFrameReader
+from image_transfer import ImageAssembler
+from reliable_link import ReliableReceiver, TEXT
+from serial_capture import CapturingPort
+from startup import StartupTracker
+
+# Serial ports, one per ground radio (adjust devices if needed; WES_LORA_PORT overrides
+# them with one port or a comma-separated list, e.g. for simulated links).
+# Set WES_CAPTURE to a file name to record every byte received, for replay.py; with
+# several ports each gets its own file (flight.cap, flight.1.cap, ...).
+LORA_PORTS = [name.strip() for name in os.environ.get("WES_LORA_PORT", "/dev/ttyUSB0").split(",") if name.strip()]
+CAPTURE_FILE = os.environ.get("WES_CAPTURE")
+lora = None         # First port: opened by main(), or a ReplayPort when replaying a capture
+ports = {}          # Port name -> open port, each read by its own thread
+node_ports = {}     # Node id -> name of the port it was last heard on (NACKs and ACKs go back there)
+node_traffic = NodeTraffic()
+
+def capture_path(index):
+    if index == 0:
+        return CAPTURE_FILE
+    root, ext = os.path.splitext(CAPTURE_FILE)
+    return f"{root}.{index}{ext}"
+
+def open_port(name=None, index=0):
+    name = name or LORA_PORTS[0]
+    try:
+        port = serial.Serial(
+            port=name,
+            baudrate=9600,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+    except serial.SerialException as e:
+        print(f"[LoRa RX] Could not open serial port {name}: {e}")
+        print("Check USB connection, port name, and permissions.")
+        exit(1)
+    if CAPTURE_FILE:
+        print(f"[LoRa RX] Capturing bytes received on {name} to {capture_path(index)}")
+        port = CapturingPort(port, capture_path(index))
+    return port
+
+# Seconds between reader statistics reports
+REPORT_INTERVAL = 60.0
+
+# Detection thumbnails sent by the flight node are reassembled into this directory;
+# missing chunks are requested after NACK_TIMEOUT seconds without progress
+GALLERY_DIR = 'gallery'
+NACK_TIMEOUT = 10.0
+image_assembler = ImageAssembler(GALLERY_DIR, nack_timeout=NACK_TIMEOUT)
+
+# Reliable messages (detections, command replies) are acknowledged every ACK_INTERVAL
+# seconds, one ACK per node covering everything that arrived in between
+ACK_INTERVAL = 0.5
+reliable_receiver = ReliableReceiver()
 
 # Directories to look for executable scripts (for "run script.py" commands)
 search_directories = ['/home/intern/WES_env/Lora-HAT', os.getcwd()]
 
-def loraRX_running():
-    print("[LoRa RX] Listening for incoming data...")
-    buffer = ""
+# Remote commands run on a worker pool so receiving never waits on a script
+# (replay.py turns EXECUTE_COMMANDS off so recorded commands are not run again)
+EXECUTE_COMMANDS = True
+COMMAND_WORKERS = 2
+COMMAND_TIMEOUT = 60.0
+script_index = ScriptIndex(search_directories)
+command_executor = CommandExecutor(script_index, max_workers=COMMAND_WORKERS, timeout=COMMAND_TIMEOUT)
+
+# Startup timings: the port is read before the plot window exists
+startup = StartupTracker()
+
+def handle_run_command(line):
+    # Handle remote command to run a script
+    script_name = line[4:].strip()
+    if not EXECUTE_COMMANDS:
+        print(f"[LoRa RX] Not running {script_name} (commands disabled)")
+        return
+    command_executor.submit(script_name)
+
+def handle_image_frame(frame, received_at=None):
+    image_assembler.handle_frame(frame)
+
+def handle_reliable_frame(frame, received_at=None):
+    # Each delivered message is handled as if it had come in on its own: a text line,
+    # or a payload of the frame type it carries (e.g. compact detections)
+    for frame_type, data in reliable_receiver.handle_frame(frame):
+        if frame_type == TEXT:
+            line = data.decode('utf-8', errors='replace').strip()
+            print(f"[LoRa RX] Reliable message from node {frame.node_id}: {line}")
+            handle_line(line)
+        else:
+            dispatch_frame(Frame(frame.version, frame_type, frame.node_id, frame.seq, data), received_at)
+
+def print_latency_report(*_):
+    # Also the handler for SIGUSR1: `pkill -USR1 -f lora_receiver.py` dumps it on demand
+    print(tracer.report(link_stats))
+    print("\n".join(["[LoRa RX] Per-node traffic:"] + (node_traffic.report_lines() or ["  nothing received yet"])
+                    + reliable_receiver.report_lines()))
+
+def handle_report_command(line):
+    print_latency_report()
+
+def handle_ai_detection_line(line):
+    print("\n")  # Add a blank line for easy readabilty
+    print(f"[LoRa RX] AI Detection message received: {line}")  # Debug: Show AI detection message
+    handle_ai_detection(line)
+
+def handle_sensor_line(line):
+    print("\n")  # Add a blank line for easy readabilty
+    parse_and_plot(line)
+
+# Dispatch tables: text lines are matched in order, frames by frame type
+LINE_HANDLERS = [
+    (lambda line: line.startswith("run"), handle_run_command),
+    (lambda line: line.strip() == "report", handle_report_command),
+    (lambda line: "/detected_" in line and line.endswith(".jpg"), handle_ai_detection_line),
+    (lambda line: line.startswith("Temperature:"), handle_sensor_line),
+]
+
+FRAME_HANDLERS = {
+    FRAME_SAMPLE: plot_frame,
+    FRAME_BATCH: plot_frame,
+    FRAME_SUMMARY: plot_summary,
+    FRAME_IMAGE_META: handle_image_frame,
+    FRAME_IMAGE_CHUNK: handle_image_frame,
+    FRAME_RELIABLE: handle_reliable_frame,
+    FRAME_DETECTIONS: handle_detection_frame,
+}
+
+def handle_line(line):
+    print(f"[LoRa RX] Processing line: {line}")  # Debug: Show line being processed
+    for matches, handler in LINE_HANDLERS:
+        if matches(line):
+            handler(line)
+            return
+    print(f"[LoRa RX] Unrecognized message: {line}")
+
+def frame_samples(frame):
+    if frame.frame_type == FRAME_SAMPLE:
+        return 1
+    if frame.frame_type == FRAME_BATCH and frame.payload:
+        return frame.payload[0]
+    return 0
+
+def handle_frame(frame, received_at=None, port_name=None):
+    # Frame handlers take the frame and the time.monotonic() its bytes were read.
+    # port_name is the port the frame arrived on (several ports can be read at once).
+    port_name = port_name or "default"
+    node_ports[frame.node_id] = port_name
+    node_traffic.received(frame.node_id, port_name, HEADER_SIZE + len(frame.payload) + CRC.size,
+                         frame_samples(frame), received_at)
+    dispatch_frame(frame, received_at)
+
+def dispatch_frame(frame, received_at=None):
+    handler = FRAME_HANDLERS.get(frame.frame_type)
+    if handler is None:
+        print(f"[LoRa RX] Unrecognized frame type {frame.frame_type} from node {frame.node_id}")
+        return
+    handler(frame, received_at)
+
+def loraRX_running(stop_event, port=None, port_name=None):
+    # One of these runs per port, so a burst on one radio never delays reading another
+    port = port or lora
+    port_name = port_name or "default"
+    print(f"[LoRa RX] Listening for incoming data on {port_name}...")
+    reader = SerialFrameReader(port)
+    next_report = time.monotonic() + REPORT_INTERVAL
     try:
-        while True:
+        while not stop_event.is_set():
             try:
-                incoming_bytes = lora.readline()
-                if incoming_bytes:
-                    line = incoming_bytes.decode('utf-8', errors='replace').strip()
-                    print(f"[LoRa RX] Received: {line}")  # Debug: Show received line
-                    buffer += line + '\n'  # Add line to buffer with newline
-
-                # Process all complete lines
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    print(f"[LoRa RX] Processing line: {line}")  # Debug: Show line being processed
-                    
-                    # Initialize script_found/name before the if statement
-                    script_found = False
-                    script_name = None
-
-                    # Handle remote command to run a script
-                    if line.startswith("run"):
-                        script_name = line[4:].strip()
-                        script_found = False
-                        for directory in search_directories:
-                            script_path = os.path.join(directory, script_name)
-                            if os.path.exists(script_path):
-                                script_found = True
-                                print(f"[LoRa RX] Running script: {script_path}")
-                                try:
-                                    result = subprocess.run(
-                                        ['python3', script_path],
-                                        capture_output=True, text=True, check=True
-                                    )
-                                    print(f"[LoRa RX] Script output:\n{result.stdout}")
-                                    if result.stderr:
-                                        print(f"[LoRa RX] Script error output:\n{result.stderr}")
-                                except subprocess.CalledProcessError as e:
-                                    print(f"[LoRa RX] Script failed: {e}")
-                                break  # Exit the loop after running the script
-                        if not script_found:
-                            print(f"[LoRa RX] Script '{script_name}' not found.")
-
-                    # Handle AI detection messages
-                    elif "/detected_" in line and line.endswith(".jpg"):
-                        print("\n")  # Add a blank line for easy readabilty
-                        print(f"[LoRa RX] AI Detection message received: {line}")  # Debug: Show AI detection message
-                        handle_ai_detection(line)
-                    
-                    # Handle sensor data lines
-                    elif line.startswith("Temperature:"):
-                        print("\n")  # Add a blank line for easy readabilty
-                        parse_and_plot(line) 
-
+                # Process all complete frames and lines as soon as they arrive
+                for kind, message in reader.messages(stop_event):
+                    if kind == 'frame':
+                        handle_frame(message, reader.last_read, port_name)
                     else:
-                        print(f"[LoRa RX] Unrecognized message: {line}")
-
-                time.sleep(0.1)
+                        print(f"[LoRa RX] Received on {port_name}: {message}")  # Debug: Show received line
+                        handle_line(message)
+                    if time.monotonic() >= next_report:
+                        print(f"[LoRa RX] {port_name}: {reader.report()}")
+                        if port is lora:
+                            print_latency_report()
+                        next_report = time.monotonic() + REPORT_INTERVAL
 
             except Exception as e:
                 print(f"[LoRa RX] Error: {e}")
     except KeyboardInterrupt:
         print("\n[LoRa RX] Stopped by user.")
     finally:
-        if lora.is_open:
-            lora.close()
-            print("[LoRa RX] Serial port closed.")
+        print(f"[LoRa RX] {port_name}: {reader.report()}")
+        if port.is_open:
+            port.close()
+            print(f"[LoRa RX] Serial port {port_name} closed.")
+
+def send_uplink(node_id, data, what):
+    # Answer a node on the port it was last heard on
+    port = ports.get(node_ports.get(node_id), lora)
+    try:
+        port.write(data)
+    except serial.SerialException as e:
+        print(f"[LoRa RX] Could not send {what}: {e}")
+
+def image_nack_worker(stop_event, interval=1.0):
+    # Send chunk bitmaps back to the flight node for stalled and finished thumbnails
+    while not stop_event.wait(interval):
+        for nack in image_assembler.poll():
+            frame, _ = decode_frame(nack)
+            send_uplink(frame.node_id, nack, "image NACK")
+
+def ack_worker(stop_event, interval=ACK_INTERVAL):
+    # Acknowledge reliable messages; waiting a little lets one ACK cover several frames,
+    # which matters on a half-duplex radio where every ACK takes airtime from the node
+    while not stop_event.wait(interval):
+        for node_id, ack in reliable_receiver.acks():
+            send_uplink(node_id, ack, "ACK")
+
+def main(port=None, stop_event=None):
+    # Receiving, CSV persistence and rendering run as separate stages so a slow
+    # redraw or disk write never delays reading the serial port.
+    # port and stop_event let replay.py run the same stages on a recorded capture.
+    global lora
+    if port is not None:
+        ports["replay"] = port
+    else:
+        for index, name in enumerate(LORA_PORTS):
+            ports[name] = open_port(name, index)
+    lora = next(iter(ports.values()))
+    startup.ready("port")
+    stop_event = stop_event or threading.Event()
+    signal.signal(signal.SIGUSR1, print_latency_report)
+    threads = [
+        threading.Thread(target=loraRX_running, args=(stop_event, rx_port, name), name=f"LoRa RX {name}")
+        for name, rx_port in ports.items()
+    ] + [
+        threading.Thread(target=persistence_worker, args=(stop_event,), name="Persistence Thread"),
+        threading.Thread(target=report_results, args=(command_executor.results, stop_event), name="Command Results Thread"),
+        threading.Thread(target=image_nack_worker, args=(stop_event,), name="Image NACK Thread"),
+        threading.Thread(target=ack_worker, args=(stop_event,), name="ACK Thread"),
+    ]
+    for t in threads:
+        t.start()
+    try:
+        init_plot()
+        startup.ready("plot")
+        print(startup.report())
+        render_loop(stop_event)
+    except KeyboardInterrupt:
+        print("\n[LoRa RX] Stopped by user.")
+    finally:
+        stop_event.set()
+        for t in threads:
+            t.join(timeout=5)
+        command_executor.shutdown(wait=False)
+        print_latency_report()
 
 if __name__ == "__main__":
-    loraRX_running()
+    main()
@@ -1,58 +1,300 @@
+import os
 import time
 import serial
 import threading
-from shared_resources import data_queue, ai_data_queue, stop_event
-
-# Setup serial port (adjust device if needed)
-lora = serial.Serial(
-    port='/dev/ttyS0',
-    baudrate=9600,
-    parity=serial.PARITY_NONE,
-    stopbits=serial.STOPBITS_ONE,
-    bytesize=serial.EIGHTBITS,
-    timeout=1
-)
+from queue import Empty
+from shared_resources import (data_queue, ai_data_queue, command_reply_queue, image_queue, link_backlogs, stop_event, tracer,
+                              startup)
+from telemetry_codec import (FRAME_IMAGE_NACK, FRAME_ACK, FRAME_DETECTIONS, TelemetryBatcher, encode_sample, encode_summary, format_text_sample,
+                             format_text_summary, node_id_from_sensor_id)
+from rolling_stats import WindowSummary
+from detection_codec import DetectionReport, MAX_RECORDS, encode_detections, fits, pack_detections, report_records
+from tx_scheduler import TxScheduler, DETECTION, COMMAND_REPLY, TELEMETRY, IMAGE, CLASS_NAMES, DUTY_CYCLE
+from image_transfer import ImageSender
+from reliable_link import ReliableSender
+from serial_reader import SerialFrameReader
+
+# Telemetry format: "batch" packs several samples per packet as deltas,
+# "binary" sends one compact frame per sample, "text" is the old readable format
+TX_FORMAT = "batch"
+
+# Detection format: "compact" sends label indexes, confidences and boxes as 8-byte
+# records (detections waiting together share a packet), "text" sends the image path
+DETECTION_FORMAT = "compact"
+
+# Batch flush thresholds: samples per packet, payload bytes, age of the oldest sample (s)
+BATCH_MAX_SAMPLES = 16
+BATCH_MAX_BYTES = 200
+BATCH_MAX_AGE = 30.0
+# Send the first sample after power-on on its own instead of waiting for a full batch
+FIRST_SAMPLE_IMMEDIATE = True
+
+# Share of time the radio may transmit (tx_scheduler.DUTY_CYCLE, which also sizes the
+# thumbnails), and how much airtime (s) may go out in one burst
+BURST_AIRTIME = 2.0
+# Seconds between scheduler latency/backlog reports
+REPORT_INTERVAL = 60.0
+# Seconds allowed at shutdown to send what is still queued, within the duty cycle
+DRAIN_TIMEOUT = 10.0
+
+# Detections and command replies are resent until the ground station acknowledges
+# them (reliable_link.py); telemetry is always best-effort. RELIABLE_WINDOW messages
+# may be unacknowledged at once, each sent at most RELIABLE_MAX_RETRIES more times.
+RELIABLE_TRANSPORT = True
+RELIABLE_WINDOW = 8
+RELIABLE_MAX_RETRIES = 6
+# Messages that may wait for the window; feeders stop taking from their channel at this
+# many (and at tx_scheduler.CLASS_LIMITS for unreliable classes), so the backlog stays
+# in the bounded channels where their overflow policy applies
+RELIABLE_MAX_PENDING = 16
+
+# Node ID carried by image and reliable frames (telemetry frames take it from the sample's sensor_id)
+NODE_ID = node_id_from_sensor_id("BME280-01")
+
+# Serial port (adjust device if needed; WES_LORA_PORT overrides it, e.g. for a simulated link).
+# Opened by loraTX_running() on its own thread, not at import.
+LORA_PORT = os.environ.get("WES_LORA_PORT", "/dev/ttyS0")
+lora = None
+
+def open_port():
+    global lora
+    lora = serial.Serial(
+        port=LORA_PORT,
+        baudrate=9600,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.EIGHTBITS,
+        timeout=1
+    )
+    return lora
+
+def send_text(scheduler, priority, msg, reliable=None):
+    # Hand a text message to the scheduler, or to the reliable sender when there is one
+    if reliable is not None:
+        reliable.send(priority, str(msg).encode('utf-8'))
+    else:
+        scheduler.submit(priority, f"{msg}\n".encode('utf-8'))
+
+def wait_for_room(scheduler, priority, reliable=None, timeout=0.5):
+    # Whether the next message can be taken from the channel: the reliable sender's
+    # pending list or the scheduler class is below its limit
+    if reliable is not None:
+        return reliable.wait_for_room(timeout)
+    return scheduler.wait_for_room(priority, timeout)
+
+def feed_queue(source, scheduler, priority, stop_event, label, reliable=None):
+    # Block on a text message queue and send each message
+    while not stop_event.is_set():
+        if not wait_for_room(scheduler, priority, reliable):
+            continue
+        try:
+            msg = source.get(timeout=0.5)
+        except Empty:
+            continue
+        send_text(scheduler, priority, msg, reliable)
+        print(f"[LoRa TX] Queued {label}: {msg}")
+
+def feed_detections(scheduler, stop_event, reliable=None):
+    # Block on ai_data_queue and send each camera frame's detections per DETECTION_FORMAT.
+    # Reports already waiting behind the first (the radio was busy) go in the same packet.
+    seq = 0
+    carry = None
+    while not stop_event.is_set():
+        if not wait_for_room(scheduler, DETECTION, reliable):
+            continue
+        if carry is not None:
+            report, carry = carry, None
+        else:
+            try:
+                report = ai_data_queue.get(timeout=0.5)
+            except Empty:
+                continue
+        if DETECTION_FORMAT == "text" or not isinstance(report, DetectionReport):
+            msg = report.image_path if isinstance(report, DetectionReport) else report
+            if msg is None:
+                # Text mode names the detection by its image file, which was not saved
+                print("[LoRa TX] Detection image was not saved, nothing to send in text mode")
+                continue
+            send_text(scheduler, DETECTION, msg, reliable)
+            print(f"[LoRa TX] Queued AI Data: {msg}")
+            continue
+        if not fits([], report):
+            best = sorted(report.detections, key=lambda detection: detection.confidence, reverse=True)
+            report = report._replace(detections=tuple(best[:MAX_RECORDS]))
+        reports = [report]
+        while True:
+            try:
+                waiting = ai_data_queue.get_nowait()
+            except Empty:
+                break
+            if isinstance(waiting, DetectionReport) and DETECTION_FORMAT != "text" and fits(reports, waiting):
+                reports.append(waiting)
+            else:
+                carry = waiting
+                break
+        count = sum(len(report_records(r)) for r in reports)
+        if not count:
+            continue
+        if reliable is not None:
+            payload = pack_detections(reports)
+            reliable.send(DETECTION, payload, FRAME_DETECTIONS)
+        else:
+            payload = encode_detections(reports, NODE_ID, seq)
+            scheduler.submit(DETECTION, payload)
+            seq = (seq + 1) & 0xFFFF
+        print(f"[LoRa TX] Queued {count} detection(s) from {len(reports)} frame(s) ({len(payload)} bytes)")
+
+def feed_telemetry(scheduler, stop_event):
+    # Block on data_queue, packetize samples per TX_FORMAT and hand packets to the scheduler
+    seq = 0
+    batcher = TelemetryBatcher(BATCH_MAX_SAMPLES, BATCH_MAX_BYTES, BATCH_MAX_AGE)
+    batch_keys = []
+    first_sample = FIRST_SAMPLE_IMMEDIATE
+
+    def traced(keys):
+        # Trace keys are the samples' monotonic read times
+        def on_sent(sent_at):
+            startup.once("lora", "first sample transmitted")
+            for key in keys:
+                tracer.mark(key, 'tx write', t=sent_at)
+                tracer.span(key, 'read', 'tx write')
+        return on_sent
+
+    def submit_batch():
+        nonlocal seq
+        count = len(batcher)
+        enqueued_at = batcher.first_added
+        frame = batcher.flush(seq)
+        scheduler.submit(TELEMETRY, frame, enqueued_at, on_sent=traced(list(batch_keys)))
+        batch_keys.clear()
+        print(f"[LoRa TX] Queued BME280 batch #{seq} ({count} samples, {len(frame)} bytes)")
+        seq = (seq + count) & 0xFFFF
+
+    while not stop_event.is_set():
+        # Leave samples in data_queue (which drops the oldest) while the telemetry class is full
+        if not scheduler.wait_for_room(TELEMETRY, 0.5):
+            continue
+        # Wake up in time to flush a batch that reaches its age limit
+        timeout = 0.5
+        if len(batcher):
+            timeout = max(0.0, min(timeout, batcher.first_added + batcher.max_age - time.monotonic()))
+        try:
+            sensor_data_obj = data_queue.get(timeout=timeout)
+        except Empty:
+            sensor_data_obj = None
+
+        if isinstance(sensor_data_obj, WindowSummary):
+            # Steady-altitude summary from the sensor loop: keep it in order behind any
+            # samples still batched; it carries the next sequence number but does not use it
+            if len(batcher):
+                submit_batch()
+            if TX_FORMAT == "text":
+                scheduler.submit(TELEMETRY, format_text_summary(sensor_data_obj).encode('utf-8'))
+            else:
+                scheduler.submit(TELEMETRY, encode_summary(sensor_data_obj, seq))
+            print(f"[LoRa TX] Queued BME280 summary ({sensor_data_obj.count} samples)")
+        elif sensor_data_obj is not None:
+            key = sensor_data_obj.monotonic
+            tracer.mark(key, 'dequeue')
+            if TX_FORMAT == "batch":
+                # Send the current batch first if this sample would overflow it
+                if not batcher.fits(sensor_data_obj):
+                    submit_batch()
+                batcher.add(sensor_data_obj)
+                batch_keys.append(key)
+                if first_sample:
+                    submit_batch()
+            elif TX_FORMAT == "binary":
+                scheduler.submit(TELEMETRY, encode_sample(sensor_data_obj, seq), on_sent=traced([key]))
+                seq = (seq + 1) & 0xFFFF
+            else:
+                scheduler.submit(TELEMETRY, format_text_sample(sensor_data_obj).encode('utf-8'), on_sent=traced([key]))
+            first_sample = False
+
+        if batcher.ready():
+            submit_batch()
+
+    # Don't lose samples still waiting in a partial batch
+    if len(batcher):
+        submit_batch()
+
+def feed_images(sender, stop_event):
+    # Take a thumbnail from image_queue only when the sender is free for a new image,
+    # so newer thumbnails wait (and coalesce) in the channel instead of the scheduler
+    while not stop_event.is_set():
+        sender.poll()
+        if not sender.ready():
+            stop_event.wait(0.5)
+            continue
+        try:
+            data, label, confidence = image_queue.get(timeout=0.5)
+        except Empty:
+            continue
+        sender.send(data, label, confidence)
+
+def listen_uplink(sender, reliable, stop_event):
+    # The ground station answers image transfers with NACK bitmaps and reliable
+    # messages with ACK bitmaps on the same link
+    reader = SerialFrameReader(lora)
+    for kind, message in reader.messages(stop_event):
+        if kind != 'frame':
+            continue
+        if message.frame_type == FRAME_IMAGE_NACK:
+            sender.handle_nack(message)
+        elif message.frame_type == FRAME_ACK and reliable is not None:
+            reliable.handle_ack(message)
 
 def loraTX_running(stop_event):
+    try:
+        open_port()
+    except serial.SerialException as e:
+        print(f"[LoRa TX] Could not open serial port {LORA_PORT}: {e}")
+        return
+    startup.ready("lora")
     print(f"[LoRa TX] Starting. Serial port open: {lora.is_open}")
+    scheduler = TxScheduler(lora.write, duty_cycle=DUTY_CYCLE, burst=BURST_AIRTIME)
+    image_sender = ImageSender(scheduler, IMAGE, NODE_ID, duty_cycle=DUTY_CYCLE)
+    reliable = None
+    if RELIABLE_TRANSPORT:
+        reliable = ReliableSender(scheduler, NODE_ID, window=RELIABLE_WINDOW, max_retries=RELIABLE_MAX_RETRIES,
+                                  max_pending=RELIABLE_MAX_PENDING)
+    link_backlogs[:] = [scheduler] + ([reliable] if reliable is not None else [])
+    feeders = [
+        threading.Thread(target=feed_detections, args=(scheduler, stop_event, reliable),
+                         name="LoRa TX AI Feeder", daemon=True),
+        threading.Thread(target=feed_queue, args=(command_reply_queue, scheduler, COMMAND_REPLY, stop_event, "command reply",
+                                                  reliable),
+                         name="LoRa TX Reply Feeder", daemon=True),
+        threading.Thread(target=feed_telemetry, args=(scheduler, stop_event),
+                         name="LoRa TX Telemetry Feeder", daemon=True),
+        threading.Thread(target=feed_images, args=(image_sender, stop_event),
+                         name="LoRa TX Image Feeder", daemon=True),
+        threading.Thread(target=listen_uplink, args=(image_sender, reliable, stop_event),
+                         name="LoRa TX Uplink Listener", daemon=True),
+    ]
+    if reliable is not None:
+        feeders.append(threading.Thread(target=reliable.run, args=(stop_event,),
+                                        kwargs={'report_interval': REPORT_INTERVAL},
+                                        name="LoRa TX Retransmit Timer", daemon=True))
+    for t in feeders:
+        t.start()
     try:
-        while not stop_event.is_set():
-
-        # Send AI data if available
-            while not ai_data_queue.empty():
-                print(f"[DEBUG TX] ai_data_queue size: {ai_data_queue.qsize()}")
-                ai_msg = ai_data_queue.get()
-                lora.write(ai_msg.encode('utf-8'))
-                print(f"[LoRa TX] Sent AI Data: {ai_msg}")
-                message_sent = True
-                
-                time.sleep(2)
-                
-            # Otherwise send sensor data if available
-
-            while not data_queue.empty():
-                print(f"[DEBUG TX] data_queue size: {data_queue.qsize()}")
-                sensor_data_obj = data_queue.get()
-                data_to_send = (
-                    f"Temperature: {sensor_data_obj.temperature:.2f}°C, "
-                    f"Pressure: {sensor_data_obj.pressure:.2f} hPa, "
-                    f"Humidity: {sensor_data_obj.humidity:.2f}%, "
-                    f"Altitude: {sensor_data_obj.altitude:.2f} m\n"
-                )
-                lora.write(data_to_send.encode('utf-8'))
-                print(f"[LoRa TX] Sent BME280 Data: {data_to_send.strip()}")
-                message_sent = True
-                    
-                    # Wait 10 seconds after each transmission cycle
-                time.sleep(10)
-
-            # If no data, wait a bit before checking again
-        if not message_sent:
-            time.sleep(1)
+        scheduler.run(stop_event, report_interval=REPORT_INTERVAL)
+
+        # Drain what is already queued (e.g. the final partial batch) before closing the port
+        for t in feeders:
+            t.join(timeout=2)
+        discarded = scheduler.drain(DRAIN_TIMEOUT)
+        for priority, count in discarded.items():
+            print(f"[LoRa TX] Discarded {count} {CLASS_NAMES[priority]} packet(s) still queued at shutdown")
 
     except Exception as e:
         print(f"[LoRa TX] Error: {e}")
     finally:
+        print(scheduler.report())
+        print(image_sender.report())
+        if reliable is not None:
+            print(reliable.report())
         if lora.is_open:
             lora.close()
             print("[LoRa TX] Serial port closed.")
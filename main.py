@@ -1,64 +1,125 @@
 import threading
+import importlib
 import os
 import sys
 import queue
-from queue import Empty
-import csv
+import signal
 import time
 
-#Initialize I2C (do this once, globally)
-i2c_lock = threading.Lock() # Lock for I2C communication
-
 #Import functions from other modules
-from shared_resources import data_queue, csv_queue, stop_event
-from bme280Data import BME_running, calculate_altitude
-from lora_transmitter import loraTX_running
-from object_detection import camera_running
+#(the I2C lock lives in shared_resources so device modules can use it too).
+#The device modules are imported by their own threads, see run_subsystem().
+from shared_resources import csv_queue, channels, link_backlogs, stop_event, i2c_lock, tracer, startup
+from channels import channel_report
+from csv_writer import BufferedCSVWriter, get_batch
 
 CSV_FILENAME = 'bme280_log.csv'
+CSV_HEADER = ['Timestamp', 'Temperature (°C)', 'Humidity (%)', 'Pressure (hPa)', 'Altitude (m)']
+
+# CSV writer policy: rows per batch, flush after this many rows or seconds,
+# fsync each flush (safer on power loss, slower on the SD card), rotate at this size
+CSV_BATCH_SIZE = 50
+CSV_FLUSH_ROWS = 20
+CSV_FLUSH_INTERVAL = 10.0
+CSV_FSYNC = False
+CSV_MAX_BYTES = 10 * 1024 * 1024
+
+# Seconds between channel depth/drop/latency and per-hop latency reports
+CHANNEL_REPORT_INTERVAL = 60.0
+
+def print_reports(*_):
+    # Also the handler for SIGUSR1: `pkill -USR1 -f main.py` dumps the reports on demand
+    print(channel_report(channels, backlogs=link_backlogs))
+    print(tracer.report())
 
-def log_to_csv(data):
-    file_exists = os.path.isfile(CSV_FILENAME)
-    with open(CSV_FILENAME, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        if not file_exists:
-            writer.writerow(['Timestamp', 'Temperature (°C)', 'Humidity (%)', 'Pressure (hPa)', 'Altitude (m)'])
-        writer.writerow([
-            data.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            f"{data.temperature:.2f}",
-            f"{data.humidity:.2f}",
-            f"{data.pressure:.2f}",
-            f"{data.altitude:.2f}"
-        ])
+def csv_row(data):
+    return [
+        data.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        f"{data.temperature:.2f}",
+        f"{data.humidity:.2f}",
+        f"{data.pressure:.2f}",
+        f"{data.altitude:.2f}"
+    ]
 
 def csv_logger(stop_event):
+    writer = None
     try:
+        writer = BufferedCSVWriter(CSV_FILENAME, CSV_HEADER, flush_rows=CSV_FLUSH_ROWS,
+                                   flush_interval=CSV_FLUSH_INTERVAL, fsync=CSV_FSYNC, max_bytes=CSV_MAX_BYTES)
         while not stop_event.is_set():
-            try:
-                BMEdata = csv_queue.get(timeout=1)
-                log_to_csv(BMEdata)
-            except Empty:
-                continue
+            batch = get_batch(csv_queue, CSV_BATCH_SIZE, timeout=1)
+            if batch:
+                writer.write_rows(csv_row(BMEdata) for BMEdata in batch)
+            else:
+                writer.flush_if_due()
+
+        # Write whatever is still queued before shutting down
+        while True:
+            batch = get_batch(csv_queue, CSV_BATCH_SIZE, timeout=0)
+            if not batch:
+                break
+            writer.write_rows(csv_row(BMEdata) for BMEdata in batch)
     except Exception as e:
         print(f"[CSV Logger] Error: {e}")
+    finally:
+        if writer:
+            writer.close()
 
-def main():
-    #Create threads for each task
+# Run the camera pipeline in its own process (camera_process.py) so its cv2 and
+# NumPy work does not compete for the GIL with the sensor and radio threads;
+# False runs it as a thread of this process as before
+CAMERA_PROCESS = True
+
+# Subsystems started by start_threads: (name, module, entry point), in start order.
+# The radio and sensor come first so telemetry flows while the camera (cv2,
+# picamera2 and the IMX500 network firmware) is still loading.
+SUBSYSTEMS = [
+    ("lora", "lora_transmitter", "loraTX_running"),
+    ("sensor", "bme280Data", "BME_running"),
+    ("camera", "camera_process", "camera_supervisor") if CAMERA_PROCESS else
+    ("camera", "object_detection", "camera_running"),
+]
+THREAD_NAMES = {"lora": "LoRa TX Thread", "sensor": "BME280 Thread", "camera": "Camera Thread"}
+
+def run_subsystem(name, module, entry, stop_event):
+    #Imports the subsystem's module on its own thread, then runs it; a subsystem that
+    #fails to load is reported and the others keep running
+    try:
+        target = getattr(importlib.import_module(module), entry)
+    except Exception as e:
+        print(f"[Main] Could not load {name} ({module}): {e}")
+        return
+    startup.stage(name, "imported")
+    target(stop_event)
+
+def start_threads(stop_event, camera=True):
+    #Create and start threads for each task (also used by benchmark.py)
     threads = [
-        threading.Thread(target=BME_running, args=(stop_event,), name="BME280 Thread"),
-        threading.Thread(target=loraTX_running, args=(stop_event,), name="LoRa TX Thread"),
-        threading.Thread(target=camera_running, args=(stop_event,), name="Camera Thread"),
-        threading.Thread(target=csv_logger, args=(stop_event,), name="CSV Logger Thread"),
+        threading.Thread(target=run_subsystem, args=(name, module, entry, stop_event), name=THREAD_NAMES[name])
+        for name, module, entry in SUBSYSTEMS if camera or name != "camera"
     ]
-    
-    #Start threads
+    threads.append(threading.Thread(target=csv_logger, args=(stop_event,), name="CSV Logger Thread"))
+
     for t in threads:
         t.start()
         print(f"[Main] Started thread: {t.name}")
+    return threads
+
+def main():
+    signal.signal(signal.SIGUSR1, print_reports)
+    threads = start_threads(stop_event)
 
+    next_report = time.monotonic() + CHANNEL_REPORT_INTERVAL
+    startup_reported = False
     try:
             while any(t.is_alive() for t in threads):
                 time.sleep(1)
+                if not startup_reported and all(startup.is_ready(name) for name, _, _ in SUBSYSTEMS):
+                    print(startup.report())
+                    startup_reported = True
+                if time.monotonic() >= next_report:
+                    print_reports()
+                    next_report = time.monotonic() + CHANNEL_REPORT_INTERVAL
     except KeyboardInterrupt:
             print("[Main] KeyboardInterrupt received, shutting down...")
             stop_event.set()
@@ -67,6 +128,9 @@ def main():
     for t in threads:
         t.join(timeout=5)
         print(f"[Main] Thread {t.name} finished.")
+    print_reports()
+    if not startup_reported:
+        print(startup.report())
 
 if __name__ == "__main__":
     main()
@@ -1,79 +1,77 @@
 import argparse
 import sys
 import os
+import re
 import time
 import cv2
-import numpy as np
 from functools import lru_cache
-from picamera2 import MappedArray, Picamera2
-from picamera2.devices import IMX500
-from picamera2.devices.imx500 import (NetworkIntrinsics, postprocess_nanodet_detection)
+from image_writer import ImageWriterPool, make_thumbnail
+from object_tracker import ObjectTracker
+from detection_postprocess import CoordinateMapper, DetectionBatch, LabelTable, parse_outputs
+from detection_codec import LabelCodebook, make_report
 
 #Needed for transmitting queue data to ground station
 import queue
-from shared_resources import ai_data_queue, stop_event
+from shared_resources import ai_data_queue, image_queue, stop_event, startup, DEVICE_BACKEND
+
+# Camera backend: the real IMX500 on the Pi, or the synthetic one from sim_devices
+if DEVICE_BACKEND == "sim":
+    from sim_devices import IMX500, MappedArray, NetworkIntrinsics, Picamera2
+else:
+    from picamera2 import MappedArray, Picamera2
+    from picamera2.devices import IMX500
+    from picamera2.devices.imx500 import NetworkIntrinsics
 
 # Create the detected_images directory if it doesn't exist
 output_dir = 'detected_images'
 os.makedirs(output_dir, exist_ok=True)
 
+# Tracking: an object is reported when first seen, at a confidence peak and then
+# every REPORT_INTERVAL seconds while it stays in view
+TRACK_IOU = 0.3
+TRACK_MAX_AGE = 3.0
+REPORT_INTERVAL = 60.0
+
+# Image saving, encoded on background threads
+IMAGE_WORKERS = 2
+IMAGE_MAX_PENDING = 4
+JPEG_QUALITY = 85
+SEND_THUMBNAILS = True      # Queue a small crop of each reported object for the LoRa downlink
+
 # Global variables
-last_detections = []
+image_writer = None
+last_detections = DetectionBatch.empty()
+coordinate_mapper = None
+label_table = None
+label_codebook = None
 imx500 = None
 picam2 = None
 last_results = None
 intrinsics = None
-picam2 = None  # Needed for Detection class
-
-class Detection:
-    def __init__(self, coords, category, conf, metadata, imx500_instance, picam2_instance):
-        self.category = category
-        self.conf = conf
-        self.box = imx500_instance.convert_inference_coords(coords, metadata, picam2_instance)
-
-def parse_detections(metadata: dict, imx500):
-   
-    global last_detections, intrinsics
-    bbox_normalization = intrinsics.bbox_normalization
-    bbox_order = intrinsics.bbox_order
-    threshold = args.threshold
-    iou = args.iou
-    max_detections = args.max_detections
-
-    # Check the structure of metadata
-    print("Metadata:", metadata)  # Debugging line
+picam2 = None  # Needed for coordinate conversion
+# Where detections and thumbnails go: the shared channels when the camera runs as a
+# thread, the IPC link when it runs in its own process (see camera_process.py)
+detection_queue = ai_data_queue
+thumbnail_queue = image_queue
 
-    # Ensure that metadata is passed correctly
-    try:
-        np_outputs = imx500.get_outputs(metadata, add_batch=True)  # Adjust if more parameters are needed
-    except TypeError as e:
-        print(f"Error calling get_outputs: {e}")  # Debugging line
-        return last_detections
+def parse_detections(metadata: dict, imx500, np_outputs=None):
+    # Shared post-processing for both SSD and nanodet models; returns a DetectionBatch
+    global last_detections
 
-    input_w, input_h = imx500.get_input_size()
+    # Ensure that metadata is passed correctly
+    if np_outputs is None:
+        try:
+            np_outputs = imx500.get_outputs(metadata, add_batch=True)  # Adjust if more parameters are needed
+        except TypeError as e:
+            print(f"Error calling get_outputs: {e}")  # Debugging line
+            return last_detections
 
     if np_outputs is None:
         return last_detections
 
-    if intrinsics.postprocess == "nanodet":
-        boxes, scores, classes = postprocess_nanodet_detection(outputs=np_outputs[0], conf=threshold, iou_thres=iou,
-                                                               max_out_dets=max_detections)[0]
-        from picamera2.devices.imx500.postprocess import scale_boxes
-        boxes = scale_boxes(boxes, 1, 1, input_h, input_w, False, False)
-    else:
-        boxes, scores, classes = np_outputs[0][0], np_outputs[1][0], np_outputs[2][0]
-        if bbox_normalization:
-            boxes = boxes / input_h
-        if bbox_order == "xy":
-            boxes = boxes[:, [1, 0, 3, 2]]
-        boxes = np.array_split(boxes, 4, axis=1)
-        boxes = zip(*boxes)
-
-    last_detections = [
-        Detection(box, category, score, metadata, imx500, picam2)
-        for box, score, category in zip(boxes, scores, classes)
-        if score > threshold
-    ]
+    last_detections = parse_outputs(np_outputs, metadata, intrinsics, imx500.get_input_size(),
+                                    coordinate_mapper, label_table,
+                                    args.threshold, args.iou, args.max_detections)
     return last_detections
 
 @lru_cache
@@ -107,16 +105,34 @@ def draw_detections(request, stream="main"):
             if detection.conf >= 0.3:
                 save_detected_image(m.array, detection.conf, labels[int(detection.category)])
 
-def save_detected_image(frame, confidence, category):
-    import re
-
+def detection_image_path(category, confidence):
     sanitized_category = re.sub(r'[^a-zA-Z0-9_.-]', '_', category)
-    image_path = os.path.join(output_dir, f'detected_{sanitized_category}_{int(time.time())}_{int(confidence * 100)}.jpg')
+    return os.path.join(output_dir, f'detected_{sanitized_category}_{int(time.time())}_{int(confidence * 100)}.jpg')
+
+def queue_thumbnail(frame, box, label, confidence):
+    # Built on the image writer threads; the result goes to the LoRa transmitter
+    def build():
+        data = make_thumbnail(frame, box)
+        if data is None:
+            print(f"[Camera] Could not fit a thumbnail of {label} in the budget")
+            return
+        thumbnail_queue.put((data, label, confidence))
+    image_writer.submit_task(build, f"thumbnail of {label}")
+
+def report_callbacks(report):
+    # The report goes to the LoRa transmitter once its image is written, or without
+    # the image path if the image writer dropped the frame or could not write it
+    def saved(path):
+        detection_queue.put(report)
+        print(f"[DEBUG ODC] {len(report.detections)} detection(s) added to queue, image {path}")
+    def failed(path):
+        detection_queue.put(report._replace(image_path=None))
+        print(f"[DEBUG ODC] {len(report.detections)} detection(s) added to queue, image {path} not saved")
+    return saved, failed
 
-    if cv2.imwrite(image_path, frame):
-        print(f"Image saved: {image_path}")
-    else:
-        print(f"Failed to save image: {image_path}")
+def save_detected_image(frame, confidence, category):
+    # Copy now: frame usually points into a camera buffer that is about to be released
+    image_writer.submit(frame.copy(), detection_image_path(category, confidence))
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -133,15 +149,22 @@ def get_args():
     parser.add_argument("--print-intrinsics", action="store_true")
     return parser.parse_args()
 
-def camera_running(stop_event):
+def camera_running(stop_event, detection_out=ai_data_queue, thumbnail_out=image_queue, stages=startup):
     
     print("[Camera] Starting camera thread...")
 
-    global picam2, last_results, intrinsics, args, imx500
+    global picam2, last_results, intrinsics, args, imx500, image_writer, coordinate_mapper, label_table, label_codebook
+    global detection_queue, thumbnail_queue
+    detection_queue, thumbnail_queue = detection_out, thumbnail_out
 
     args = get_args()
+    image_writer = ImageWriterPool(workers=IMAGE_WORKERS, max_pending=IMAGE_MAX_PENDING, quality=JPEG_QUALITY)
+    tracker = ObjectTracker(iou_threshold=TRACK_IOU, max_age=TRACK_MAX_AGE, report_interval=REPORT_INTERVAL)
 
+    # Loading the network firmware is the slow part of startup; telemetry is
+    # already running on the other threads while this waits
     imx500 = IMX500(args.model)
+    stages.stage("camera", "network loaded")
     intrinsics = imx500.network_intrinsics or NetworkIntrinsics()
     intrinsics.task = "object detection"
     intrinsics.update_with_defaults()
@@ -150,6 +173,11 @@ def camera_running(stop_event):
         with open("assets/coco_labels.txt", "r") as f:
             intrinsics.labels = f.read().splitlines()
 
+    label_table = LabelTable(intrinsics.labels)
+    # Detections go down the link as indexes into this list; its hash tells the
+    # ground station whether its own copy of the labels matches
+    label_codebook = LabelCodebook(intrinsics.labels)
+
     picam2 = Picamera2(imx500.camera_num)
     config = picam2.create_preview_configuration(
     controls={
@@ -159,79 +187,66 @@ def camera_running(stop_event):
     buffer_count=12)
 
     picam2.start(config)
+    coordinate_mapper = CoordinateMapper(imx500, picam2)
+    stages.ready("camera")
 
     try:
         while not stop_event.is_set():
             request = picam2.capture_request()
             metadata = request.get_metadata()
 
-            # Get model outputs
+            # Get model outputs and post-process them in one vectorized pass
             np_outputs = imx500.get_outputs(metadata, add_batch=True)
             if np_outputs is None:
                 print("[Camera] No outputs from model.")
                 request.release()
                 continue
-
-            input_w, input_h = imx500.get_input_size()
-
-            # Postprocess detections
-            if intrinsics.postprocess == "nanodet":
-                boxes, scores, classes = postprocess_nanodet_detection(
-                    outputs=np_outputs[0], conf=args.threshold, iou_thres=args.iou,
-                    max_out_dets=args.max_detections)[0]
-                from picamera2.devices.imx500.postprocess import scale_boxes
-                boxes = scale_boxes(boxes, 1, 1, input_h, input_w, False, False)
-            else:
-                boxes, scores, classes = np_outputs[0][0], np_outputs[1][0], np_outputs[2][0]
-                if intrinsics.bbox_normalization:
-                    boxes = boxes / input_h
-                if intrinsics.bbox_order == "xy":
-                    boxes = boxes[:, [1, 0, 3, 2]]
-                boxes = np.array_split(boxes, 4, axis=1)
-                boxes = zip(*boxes)
-
-            detections = []
-            for box, score, category in zip(boxes, scores, classes):
-                if score > args.threshold:
-                    det = Detection(box, category, score, metadata, imx500, picam2)
-                    detections.append(det)
+            detections = parse_detections(metadata, imx500, np_outputs)
 
             if not detections:
                 print("[Camera] No objects detected.")
             else:
                 print(f"[Camera] {len(detections)} object(s) detected.")
                    
-            # Draw detections and save images
+            # Only track events (new object, confidence peak, periodic re-report) are saved and sent
+            events = tracker.update(list(detections.select(detections.scores >= 0.3)))
+            reported = []
+            for event in events:
+                label = label_table.label(event.category)
+                print(f"[Camera] Track {event.track_id} {event.kind}: {label} ({event.conf:.2f})")
+                if event.kind != 'lost':
+                    reported.append(event)
+
+            # Draw detections, copy the frame once if it has something to report, then release the request
+            frame = None
             with MappedArray(request, "main") as m:
                 for det in detections:
                     x, y, w, h = det.box
-                    label = f"{intrinsics.labels[int(det.category)]} ({det.conf:.2f})"
+                    label = f"{label_table.label(det.category)} ({det.conf:.2f})"
                     cv2.rectangle(m.array, (x, y), (x + w, y + h), (0, 255, 0), 2)
                     cv2.putText(m.array, label, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
-                    detected_msg = f"Detected {intrinsics.labels[int(det.category)]} with confidence {det.conf:.2f}"
+                    detected_msg = f"Detected {label_table.label(det.category)} with confidence {det.conf:.2f}"
                     print(detected_msg)
 
-                    if det.conf >= 0.3:
-                        filename = f"detected_{intrinsics.labels[int(det.category)]}_{int(time.time())}_{int(det.conf*100)}.jpg"
-                        filepath = os.path.join(output_dir, filename)
-                        cv2.imwrite(filepath, m.array)
-                        
-                        print(f"Image saved: {filepath}")
-                        
-                        ai_data_queue.put(filepath)
-                        print(f"[DEBUG ODC] Image filename added to queue: {filepath}")            
-                        
-                        '''
-                        filepath_str = str(filepath)
-                        ai_data_queue.put(filepath_str)
-
-                        print(f"[DEBUG ODC] ai_data_queue size: {ai_data_queue.qsize()}")
-                        '''
+                if reported:
+                    frame = m.array.copy()
 
             request.release()
 
-            time.sleep(1)  # Wait before next detection
+            # One image per frame, named after its most confident event; encoding and
+            # writing happen on the image writer threads
+            if frame is not None:
+                best = max(reported, key=lambda event: event.conf)
+                filepath = detection_image_path(label_table.label(best.category), best.conf)
+                # Every event of the frame goes out in one compact report (the LoRa
+                # transmitter sends the image path instead in text mode), queued once
+                # the image writer is done with the frame
+                height, width = frame.shape[:2]
+                on_saved, on_failed = report_callbacks(make_report(reported, label_codebook, width, height, filepath))
+                image_writer.submit(frame, filepath, on_saved, on_failed)
+                if SEND_THUMBNAILS:
+                    queue_thumbnail(frame, best.box, label_table.label(best.category), best.conf)
 
     except Exception as e:
         print(f"[Camera] Exception: {e}")
@@ -239,4 +254,5 @@ def camera_running(stop_event):
     finally:
         print("[Camera] Cleaning up...")
         picam2.stop()
+        image_writer.close()
         cv2.destroyAllWindows()
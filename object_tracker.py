@@ -0,0 +1,133 @@
+#This module follows detected objects across camera frames for the WES project.
+#Per-frame detections are matched to existing tracks (IoU, with a centroid
+#distance fallback for small or fast objects), so an object that stays in view
+#produces a few events instead of one message per frame:
+#   "new"    first time a track is confirmed
+#   "peak"   confidence rose clearly above the best reported so far
+#   "update" still in view after report_interval seconds
+#   "lost"   not seen for max_age seconds
+import itertools
+import time
+from collections import namedtuple
+
+import numpy as np
+
+TrackEvent = namedtuple('TrackEvent', ['kind', 'track_id', 'category', 'conf', 'box'])
+
+def iou_matrix(boxes_a, boxes_b):
+    #Pairwise IoU of (N, 4) and (M, 4) arrays of x, y, w, h boxes
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+def centroid_distance(boxes_a, boxes_b):
+    #Pairwise centroid distance, relative to the larger box diagonal of each pair
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ca = a[:, :2] + a[:, 2:] / 2
+    cb = b[:, :2] + b[:, 2:] / 2
+    dist = np.linalg.norm(ca[:, None, :] - cb[None, :, :], axis=2)
+    diag = np.maximum(np.hypot(a[:, 2], a[:, 3])[:, None], np.hypot(b[:, 2], b[:, 3])[None, :])
+    return dist / np.maximum(diag, 1e-9)
+
+class Track:
+    def __init__(self, track_id, category, conf, box, now):
+        self.track_id = track_id
+        self.category = category
+        self.conf = conf
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.reported_conf = None
+        self.last_reported = None
+
+class ObjectTracker:
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_age=3.0, min_hits=2,
+                 report_interval=60.0, peak_margin=0.1):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.report_interval = report_interval
+        self.peak_margin = peak_margin
+        self.tracks = []
+        self.ids = itertools.count(1)
+
+    def _associate(self, boxes, categories):
+        #Greedy assignment on the IoU matrix (best pairs first); pairs of different
+        #classes never match. Returns {detection index: track index}.
+        if not self.tracks or not len(boxes):
+            return {}
+        track_boxes = [t.box for t in self.tracks]
+        same_class = np.asarray(categories)[:, None] == np.asarray([t.category for t in self.tracks])[None, :]
+        iou = iou_matrix(boxes, track_boxes)
+        close = centroid_distance(boxes, track_boxes) < self.centroid_threshold
+        allowed = same_class & ((iou >= self.iou_threshold) | close)
+        #Score: IoU first, centroid-only matches after all IoU matches
+        score = np.where(allowed, iou + close * 1e-3, -1.0)
+        matches = {}
+        used_tracks = set()
+        for flat in np.argsort(score, axis=None)[::-1]:
+            d, t = np.unravel_index(flat, score.shape)
+            if score[d, t] < 0:
+                break
+            if d in matches or t in used_tracks:
+                continue
+            matches[int(d)] = int(t)
+            used_tracks.add(t)
+        return matches
+
+    def update(self, detections, now=None):
+        #detections: objects with .box (x, y, w, h), .category and .conf.
+        #Returns the TrackEvents produced by this frame.
+        now = time.monotonic() if now is None else now
+        boxes = [d.box for d in detections]
+        categories = [int(d.category) for d in detections]
+        matches = self._associate(boxes, categories)
+        events = []
+
+        for d, det in enumerate(detections):
+            if d in matches:
+                track = self.tracks[matches[d]]
+                track.box = det.box
+                track.conf = float(det.conf)
+                track.last_seen = now
+                track.hits += 1
+            else:
+                track = Track(next(self.ids), categories[d], float(det.conf), det.box, now)
+                self.tracks.append(track)
+            event = self._event_for(track, now)
+            if event is not None:
+                events.append(event)
+
+        alive = []
+        for track in self.tracks:
+            if now - track.last_seen > self.max_age:
+                if track.last_reported is not None:
+                    events.append(TrackEvent('lost', track.track_id, track.category, track.conf, track.box))
+            else:
+                alive.append(track)
+        self.tracks = alive
+        return events
+
+    def _event_for(self, track, now):
+        if track.hits < self.min_hits:
+            return None
+        if track.last_reported is None:
+            kind = 'new'
+        elif track.conf >= track.reported_conf + self.peak_margin:
+            kind = 'peak'
+        elif now - track.last_reported >= self.report_interval:
+            kind = 'update'
+        else:
+            return None
+        track.last_reported = now
+        track.reported_conf = max(track.conf, track.reported_conf or 0.0)
+        return TrackEvent(kind, track.track_id, track.category, track.conf, track.box)
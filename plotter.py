@@ -1,52 +1,285 @@
-import matplotlib.pyplot as plt
-from datetime import datetime
+import matplotlib.dates as mdates
+import numpy as np
+from datetime import datetime, timedelta
 import time
-import csv
+import atexit
 import os
+import queue
+from csv_writer import BufferedCSVWriter, get_batch
+from series_store import RingSeries
+from telemetry_codec import decode_telemetry, decode_summary
+from detection_codec import LabelCodebook, decode_detections
+from latency_trace import LatencyTracer, SequenceTracker
+from flight_store import FlightStore
 
-# Data buffers
-timestamps, temp_values, humidity_values, pressure_values, altitude_values = [], [], [], [], []
+# Data buffers: one preallocated ring buffer per node for the plot window
+WINDOW_POINTS = 20000       # Samples kept on screen per node (a full flight at 1 Hz is ~3600)
+MAX_RENDER_POINTS = 2000    # Longer windows are drawn decimated so redraw cost stays flat
+FIELDS = ['temperature', 'humidity', 'pressure', 'altitude']
+node_series = {}            # node id -> RingSeries; only touched by the render thread
+
+def series_for(node_id):
+    store = node_series.get(node_id)
+    if store is None:
+        store = node_series[node_id] = RingSeries(WINDOW_POINTS, FIELDS)
+    return store
+
+# Stage queues: the receive loop only parses and enqueues rows; a persistence
+# thread writes the CSVs and the render loop draws them at a capped frame rate
+render_queue = queue.Queue()
+persist_queue = queue.Queue()
+RENDER_FPS = 5              # Max plot redraws per second; rows arriving in between are drawn together
+PERSIST_BATCH_SIZE = 100
+
+# Per-hop latency of received samples, keyed by (node id, sequence number), and link loss per node
+tracer = LatencyTracer("ground station")
+link_stats = SequenceTracker()
+
+# Latest steady-altitude window summary received from each node (node id -> TelemetrySummary)
+node_summaries = {}
+
+# Label list the flight node's detection records index into (the same file the camera
+# falls back to); a list with a different hash is reported and its labels shown as class_<n>.
+# Found next to this file, since replay.py changes the working directory before importing it
+CODEBOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "coco_labels.txt")
+try:
+    label_codebook = LabelCodebook.load(CODEBOOK_FILE)
+except OSError as e:
+    print(f"[AI Detection] Could not load label codebook {CODEBOOK_FILE}: {e}")
+    label_codebook = LabelCodebook([])
+unknown_codebooks = set()
 
 # CSV files
 bme_csv = "bme280_data_log_400.csv"
 ai_csv = "ai_detection_log.csv"
 
-# Create CSV files with headers if they don't exist
-if not os.path.exists(bme_csv):
-    with open(bme_csv, 'w', newline='') as f:
-        csv.writer(f).writerow(["Timestamp", "Temperature (°C)", "Humidity (%)", "Pressure (hPa)", "Altitude (m)"])
+# Open the CSV files once (headers are written if they are new); rows are flushed in batches
+bme_writer = BufferedCSVWriter(bme_csv, ["Timestamp", "Temperature (°C)", "Humidity (%)", "Pressure (hPa)", "Altitude (m)"],
+                               flush_rows=10, flush_interval=5.0)
+ai_writer = BufferedCSVWriter(ai_csv, ["Timestamp", "Detected Object", "Confidence"],
+                              flush_rows=1, flush_interval=5.0)
+atexit.register(bme_writer.close)
+atexit.register(ai_writer.close)
 
-if not os.path.exists(ai_csv):
-    with open(ai_csv, 'w', newline='') as f:
-        csv.writer(f).writerow(["Timestamp", "Detected Object", "Confidence"])
+CSV_WRITERS = {'bme': bme_writer, 'ai': ai_writer}
 
-# Setup live plotting
-plt.ion()
-fig, axs = plt.subplots(4, 1, figsize=(10, 10), sharex=True)
-fig.suptitle("Live BME280 Data")
+# Telemetry from these nodes goes to bme_csv (text lines are node 0, BME280-01 is node 1),
+# so a single-payload flight logs exactly as before; other nodes get their own file
+SHARED_CSV_NODES = (0, 1)
 
-labels = ['Temperature (°C)', 'Humidity (%)', 'Pressure (hPa)', 'Altitude (m)']
-for ax, label in zip(axs, labels):
-    ax.set_ylabel(label)
-axs[-1].set_xlabel('Time')
+def bme_writer_for(node_id):
+    # Only called from the persistence thread
+    if node_id in SHARED_CSV_NODES:
+        return bme_writer
+    writer = CSV_WRITERS.get(('bme', node_id))
+    if writer is None:
+        root, ext = os.path.splitext(bme_csv)
+        writer = CSV_WRITERS[('bme', node_id)] = BufferedCSVWriter(
+            f"{root}_node{node_id}{ext}", bme_writer.header, flush_rows=10, flush_interval=5.0)
+        atexit.register(writer.close)
+    return writer
 
-def update_plot():
-    for ax, values, label in zip(axs, [temp_values, humidity_values, pressure_values, altitude_values], labels):
-        ax.clear()
-        #Plot the line
-        ax.plot(timestamps, values, label=label, color='tab:blue', linewidth=3)
-        #Plot the dots
-        ax.scatter(timestamps, values, color="tab:pink", s=30) 
-        ax.set_ylabel(label)
-        ax.legend(loc='upper left')
-        ax.grid(True)
+# Flight database (SQLite, WAL mode): every persisted row also goes here, keyed by
+# flight, node and sequence number. WES_FLIGHT names the flight (default: start time).
+DB_FILE = "flights.db"
+FLIGHT_NAME = os.environ.get("WES_FLIGHT") or datetime.now().strftime("flight_%Y%m%d_%H%M%S")
+flight_store = FlightStore(DB_FILE, flight=FLIGHT_NAME)
+atexit.register(flight_store.close)
+
+# Live plot: built by init_plot() on the render thread once receiving has started,
+# so importing pyplot and opening the window never delays the serial port.
+# Each node gets a column of four panels; the grid is rebuilt when a new node appears.
+PLOT_LABELS = ['Temperature (°C)', 'Humidity (%)', 'Pressure (hPa)', 'Altitude (m)']
+fig = None
+panels = {}                 # node id -> (axes, lines, dots), one entry per field
+backgrounds = None
+
+def init_plot():
+    global fig
+    if fig is not None:
+        return
+    import matplotlib.pyplot as plt
+    plt.ion()
+    fig = plt.figure(figsize=(10, 10))
+    fig.canvas.mpl_connect('resize_event', invalidate_backgrounds)
+    layout_panels()
+
+def layout_panels():
+    fig.clear()
+    panels.clear()
+    fig.suptitle("Live BME280 Data")
+    nodes = sorted(node_series) or [None]
+    grid = fig.subplots(4, len(nodes), sharex=True, squeeze=False)
+    for column, node_id in enumerate(nodes):
+        axes, lines, dots = list(grid[:, column]), [], []
+        for ax, label in zip(axes, PLOT_LABELS):
+            # The artists are created once and only get new data; animated artists are left
+            # out of full redraws and drawn by blitting on top of the cached background
+            line, = ax.plot([], [], label=label, color='tab:blue', linewidth=3, animated=True)
+            dot, = ax.plot([], [], linestyle='none', marker='o', color='tab:pink', markersize=5.5, animated=True)
+            lines.append(line)
+            dots.append(dot)
+            if column == 0:
+                ax.set_ylabel(label)
+            ax.grid(True)
+            ax.xaxis_date()
+        axes[0].set_title("Waiting for data" if node_id is None else f"Node {node_id}")
+        axes[-1].set_xlabel('Time')
+        panels[node_id] = (axes, lines, dots)
     fig.autofmt_xdate(rotation=45)
-    plt.pause(0.1)	#Allow the plot to update
+    invalidate_backgrounds()
+
+def invalidate_backgrounds(event=None):
+    global backgrounds
+    backgrounds = None
+
+def rescale_time(ax, first, last):
+    # Only move the limits when data leaves them, with headroom so this stays rare.
+    # The time axis is shared by every panel. Returns True if the limits changed.
+    x_min, x_max = ax.get_xlim()
+    span = max(last - first, 60 / 86400)  # At least one minute (x is in days)
+    if backgrounds is None or last > x_max or first - x_min > span * 0.25:
+        ax.set_xlim(first, last + span * 0.25)
+        return True
+    return False
+
+def rescale_values(axes, columns):
+    changed = False
+    for ax, values in zip(axes, columns):
+        low, high = np.nanmin(values), np.nanmax(values)
+        y_min, y_max = ax.get_ylim()
+        if backgrounds is None or low < y_min or high > y_max:
+            margin = max((high - low) * 0.1, 0.5)
+            ax.set_ylim(low - margin, high + margin)
+            changed = True
+    return changed
+
+def update_plot():
+    global backgrounds
+    stores = {node_id: store for node_id, store in node_series.items() if len(store)}
+    if not stores:
+        return
+    init_plot()
+    if set(panels) != set(node_series):
+        layout_panels()
+
+    first = min(store.times()[0] for store in stores.values())
+    last = max(store.times()[-1] for store in stores.values())
+    changed = rescale_time(next(iter(panels.values()))[0][0], first, last)
+    for node_id, store in stores.items():
+        axes, lines, dots = panels[node_id]
+        x = store.times()
+        columns = store.columns()
+        # Stride views keep the number of drawn points bounded without copying; the
+        # stride is anchored at the newest sample so the right edge is always drawn
+        step = max(1, len(x) // MAX_RENDER_POINTS)
+        start = (len(x) - 1) % step
+        for line, dot, values in zip(lines, dots, columns):
+            line.set_data(x[start::step], values[start::step])
+            dot.set_data(x[start::step], values[start::step])
+        changed = rescale_values(axes, columns) or changed
+
+    if changed or backgrounds is None:
+        fig.canvas.draw()
+        backgrounds = {ax: fig.canvas.copy_from_bbox(ax.bbox) for axes, _, _ in panels.values() for ax in axes}
+
+    for axes, lines, dots in panels.values():
+        for ax, line, dot in zip(axes, lines, dots):
+            fig.canvas.restore_region(backgrounds[ax])
+            ax.draw_artist(line)
+            ax.draw_artist(dot)
+            fig.canvas.blit(ax.bbox)
+    fig.canvas.flush_events()  # Let the GUI process events without blocking
+
+def log_to_csv(timestamp, temp, humidity, pressure, altitude, trace_key=None, node_id=0):
+    # trace_key is (node id, sequence number) for binary frames, None for text lines and summaries
+    persist_queue.put(('bme', node_id, [timestamp.strftime("%Y-%m-%d %H:%M:%S"), temp, humidity, pressure, altitude],
+                       trace_key, timestamp))
+
+def add_sample(temp, pressure, humidity, altitude, timestamp=None, trace_key=None, node_id=None):
+    # Rows are routed by node id: the one given, else the trace key's, else 0 (text lines)
+    if timestamp is None:
+        timestamp = datetime.now()
+    if node_id is None:
+        node_id = trace_key[0] if trace_key is not None else 0
+    render_queue.put((node_id, (timestamp, temp, humidity, pressure, altitude), trace_key))
 
-def log_to_csv(timestamp, temp, humidity, pressure, altitude):
-    with open(bme_csv, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow([timestamp.strftime("%Y-%m-%d %H:%M:%S"), temp, humidity, pressure, altitude])
+    # Log to CSV
+    log_to_csv(timestamp, temp, humidity, pressure, altitude, trace_key, node_id)
+
+def plot_sample(temp, pressure, humidity, altitude, timestamp=None):
+    # Kept for callers of the old API; drawing now happens in render_loop
+    add_sample(temp, pressure, humidity, altitude, timestamp)
+
+def drain_render_queue():
+    # Move every row received since the last frame into the nodes' series stores.
+    # Returns the trace keys of the rows moved (one entry per row).
+    rows = {}
+    keys = []
+    while True:
+        try:
+            node_id, row, key = render_queue.get_nowait()
+        except queue.Empty:
+            break
+        rows.setdefault(node_id, []).append(row)
+        keys.append(key)
+    for node_id, node_rows in rows.items():
+        timestamps = mdates.date2num([row[0] for row in node_rows])
+        series_for(node_id).extend(timestamps, [row[1:] for row in node_rows])
+    return keys
+
+def render_loop(stop_event, fps=RENDER_FPS):
+    # Runs on the main thread (matplotlib GUIs are not thread-safe)
+    frame_time = 1.0 / fps
+    init_plot()
+    while not stop_event.is_set():
+        started = time.monotonic()
+        keys = drain_render_queue()
+        if keys:
+            update_plot()
+            rendered_at = time.monotonic()
+            for key in keys:
+                tracer.mark(key, 'render', t=rendered_at, since='parse')
+                tracer.span(key, 'rx read', 'render')
+        else:
+            fig.canvas.flush_events()  # Keep the window responsive while idle
+        remaining = frame_time - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+def persistence_worker(stop_event):
+    # Writes queued CSV rows in batches so disk I/O never runs on the receive thread
+    while not stop_event.is_set():
+        batch = get_batch(persist_queue, PERSIST_BATCH_SIZE, timeout=1)
+        write_persist_batch(batch)
+        flush_logs()
+    # Write out anything still queued before exiting
+    while True:
+        batch = get_batch(persist_queue, PERSIST_BATCH_SIZE, timeout=0)
+        if not batch:
+            break
+        write_persist_batch(batch)
+    for writer in CSV_WRITERS.values():
+        writer.flush()
+    flight_store.flush()
+
+def write_persist_batch(batch):
+    rows = {}
+    for kind, node_id, row, key, timestamp in batch:
+        rows.setdefault((kind, node_id), []).append(row)
+        seq = key[1] if key is not None else None
+        if kind == 'bme':
+            flight_store.add_telemetry(node_id, seq, timestamp.timestamp(), *row[1:5])
+        else:
+            flight_store.add_detection(node_id, timestamp.timestamp(), row[1], row[2])
+    for (kind, node_id), kind_rows in rows.items():
+        writer = bme_writer_for(node_id) if kind == 'bme' else CSV_WRITERS[kind]
+        writer.write_rows(kind_rows)
+    # One database transaction per batch
+    flight_store.flush()
+    persisted_at = time.monotonic()
+    for _, _, _, key, _ in batch:
+        tracer.mark(key, 'persist', t=persisted_at, since='parse')
 
 def parse_and_plot(data_line: str):
     try:
@@ -60,35 +293,58 @@ def parse_and_plot(data_line: str):
         else:
             temp, pressure, humidity, altitude = map(float, map(str.strip, parts))
 
-        timestamp = datetime.now()
-        timestamps.append(timestamp)
-        temp_values.append(temp)
-        humidity_values.append(humidity)
-        pressure_values.append(pressure)
-        altitude_values.append(altitude)
-
-        # Limit data length for performance
-        max_points = 50
-        if len(timestamps) > max_points:
-            timestamps.pop(0)
-            temp_values.pop(0)
-            humidity_values.pop(0)
-            pressure_values.pop(0)
-            altitude_values.pop(0)
-
-        # Update plot
-        update_plot()
-        
-        # Log to CSV
-        log_to_csv(timestamp, temp, humidity, pressure, altitude)
-
+        plot_sample(temp, pressure, humidity, altitude)
 
     except Exception as e:
         print(f"[Plotter] Error parsing/plotting data: {e} | Input: '{data_line}'")
 
-def log_ai_detection_to_csv(timestamp, detected_object, confidence):
-    with open(ai_csv, 'a', newline='') as f:
-        csv.writer(f).writerow([timestamp.strftime("%Y-%m-%d %H:%M:%S"), detected_object, confidence])
+def plot_frame(frame, received_at=None):
+    # received_at: time.monotonic() when the frame's bytes were read from the port
+    try:
+        received_at = time.monotonic() if received_at is None else received_at
+        received_wall = time.time() - (time.monotonic() - received_at)
+        # A batch frame unpacks into several timestamped rows
+        samples = decode_telemetry(frame)
+        parsed_at = time.monotonic()
+        for sample in samples:
+            key = (sample.node_id, sample.seq)
+            link_stats.received(sample.node_id, sample.seq)
+            tracer.mark(key, 'rx read', t=received_at)
+            tracer.mark(key, 'parse', t=parsed_at)
+            if sample.timestamp is not None:
+                # Crosses nodes, so it relies on both clocks being set (GPS/NTP)
+                tracer.observe('sensor read -> rx read', received_wall - sample.timestamp.timestamp())
+            print(f"[Plotter] Sample #{sample.seq} from node {sample.node_id}: "
+                  f"{sample.temperature:.2f}°C, {sample.pressure:.2f} hPa, "
+                  f"{sample.humidity:.2f}%, {sample.altitude:.2f} m")
+            add_sample(sample.temperature, sample.pressure, sample.humidity, sample.altitude, sample.timestamp, key)
+    except Exception as e:
+        print(f"[Plotter] Error decoding frame: {e} | Frame: {frame}")
+
+def plot_summary(frame, received_at=None):
+    # A steady-altitude window from the flight node: its mean is plotted and logged as
+    # one row at the middle of the window (the raw samples stay in the node's own CSV)
+    try:
+        summary = decode_summary(frame)
+        node_summaries[summary.node_id] = summary
+        print(f"[Plotter] Summary from node {summary.node_id}: {summary.count} samples over "
+              f"{summary.duration:.0f}s, altitude {summary.altitude.mean:.2f} m "
+              f"({summary.altitude.min:.2f}..{summary.altitude.max:.2f}), "
+              f"rate {summary.vertical_rate:+.2f} m/s, {summary.temperature.mean:.2f}°C "
+              f"(std {summary.temperature.std:.2f})")
+        add_sample(summary.temperature.mean, summary.pressure.mean, summary.humidity.mean, summary.altitude.mean,
+                   summary.timestamp + timedelta(seconds=summary.duration / 2), node_id=summary.node_id)
+    except Exception as e:
+        print(f"[Plotter] Error decoding summary: {e} | Frame: {frame}")
+
+def flush_logs():
+    # Flush CSV rows that have been waiting longer than the flush interval
+    for writer in list(CSV_WRITERS.values()):
+        writer.flush_if_due()
+    flight_store.flush_if_due()
+
+def log_ai_detection_to_csv(timestamp, detected_object, confidence, node_id=0):
+    persist_queue.put(('ai', node_id, [timestamp.strftime("%Y-%m-%d %H:%M:%S"), detected_object, confidence], None, timestamp))
 
 def handle_ai_detection(ai_message_string: str):
     try:
@@ -104,11 +360,12 @@ def handle_ai_detection(ai_message_string: str):
         if len(parts) < 4:  # Ensure there are enough parts
             raise ValueError("Incomplete AI detection data")
 
-        # Extract detected object (second part) and confidence (fourth part)
-        detected_object = parts[1]  # e.g., "cat"
+        # The label sits between "detected" and the last two parts (time and confidence),
+        # and may itself contain underscores (e.g. "traffic_light")
+        detected_object = '_'.join(parts[1:-2])  # e.g., "cat"
         
-        # Confidence is the number before .jpg, so we split it at '.' and take the first part
-        confidence = float(parts[3].split('.')[0]) / 100.0  # e.g., "56" (before the .jpg)
+        # Confidence is the last part, in percent
+        confidence = float(parts[-1]) / 100.0  # e.g., "56"
 
         # Get live timestamp
         timestamp = datetime.now()
@@ -118,3 +375,21 @@ def handle_ai_detection(ai_message_string: str):
 
     except Exception as e:
         print(f"[AI Detection Error] {e} in message '{ai_message_string}'")
+
+def handle_detection_frame(frame, received_at=None):
+    # Compact detection records (see detection_codec.py), timestamped on the flight node
+    try:
+        digest, detections = decode_detections(frame, label_codebook)
+    except Exception as e:
+        print(f"[AI Detection Error] {e} in frame from node {frame.node_id}")
+        return
+    if digest != label_codebook.digest and digest not in unknown_codebooks:
+        unknown_codebooks.add(digest)
+        print(f"[AI Detection] Node {frame.node_id} uses label codebook {digest:04x}, not {label_codebook.digest:04x} "
+              f"from {CODEBOOK_FILE}; labels are logged as class numbers")
+    for detection in detections:
+        x, y, w, h = detection.box
+        print(f"[AI Detection] Node {detection.node_id} detected '{detection.label}' with confidence "
+              f"{detection.confidence:.2f} at {detection.timestamp:%H:%M:%S.%f} "
+              f"(box x={x:.2f} y={y:.2f} w={w:.2f} h={h:.2f})")
+        log_ai_detection_to_csv(detection.timestamp, detection.label, round(detection.confidence, 2), detection.node_id)
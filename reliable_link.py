@@ -0,0 +1,341 @@
+#This module is an optional reliable transport over the LoRa link for the WES project.
+#Detections and command replies go out as numbered RELIABLE frames and are
+#resent until the ground station acknowledges them; telemetry stays best-effort.
+#
+#   RELIABLE  frame seq: message seq; payload: flags u8, base u16, message
+#             flags bit 0: SYN; high nibble: frame type of the message (0: a text line)
+#   ACK       frame seq: next seq expected; payload: bitmap of the seqs after it
+#             that arrived (bit i = seq + 1 + i), trailing zero bytes left out
+#
+#The sender keeps up to window messages in flight (selective repeat, not
+#stop-and-wait). base is its oldest unacknowledged seq, so the ground station
+#stops waiting for a message the sender gave up on. The first seq is random and
+#SYN is set until the first ACK. A restarted flight node is therefore told apart
+#from old retransmissions. A message is resent when its timeout expires, or at once
+#when a message sent after it is acknowledged (the link does not reorder).
+#The timeout follows the measured round trip (RFC 6298), which on this link
+#includes duty-cycle waits and the ground station's ACK delay.
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+from telemetry_codec import FRAME_RELIABLE, FRAME_ACK, MAX_PAYLOAD, encode_frame
+
+RELIABLE = struct.Struct('>BH')
+SYN = 0x01
+TEXT = 0                #Message type of a text line; other types are frame types (FRAME_DETECTIONS, ...)
+MAX_WINDOW = 32         #Largest window the ACK bitmap can describe (4 bytes)
+MAX_MESSAGE = MAX_PAYLOAD - RELIABLE.size
+
+def _diff(a, b):
+    #Distance from b forward to a in 16-bit sequence space
+    return (a - b) & 0xFFFF
+
+class OutgoingMessage:
+    def __init__(self, seq, priority, data, queued_at, frame_type=TEXT):
+        self.seq = seq
+        self.priority = priority
+        self.data = data
+        self.frame_type = frame_type
+        self.queued_at = queued_at
+        self.sent_at = None             #time.monotonic() of the last write to the radio
+        self.in_scheduler = False       #Waiting in the TX scheduler, so no timer is running
+        self.transmissions = 0
+
+class ReliableSender:
+    #Flight side. send() never blocks: messages wait in pending until the window has room.
+    #At most max_pending wait; callers hold back with wait_for_room() so the backlog stays
+    #in their bounded channel.
+    def __init__(self, scheduler, node_id, window=8, initial_rto=5.0, min_rto=1.0, max_rto=60.0, max_retries=6,
+                 max_pending=16):
+        if not 0 < window <= MAX_WINDOW:
+            raise ValueError(f"window must be 1..{MAX_WINDOW}")
+        self.scheduler = scheduler
+        self.node_id = node_id
+        self.window = window
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.rto = initial_rto
+        self.srtt = None
+        self.rttvar = None
+        self.pending = deque()
+        self.inflight = OrderedDict()
+        self.next_seq = random.getrandbits(16)
+        self.synced = False
+        self.lock = threading.Condition()
+        self.started = time.monotonic()
+        self.messages = 0
+        self.delivered = 0
+        self.delivered_bytes = 0
+        self.transmissions = 0
+        self.retransmissions = 0
+        self.fast_retransmits = 0
+        self.timeouts = 0
+        self.failed = 0
+        self.acks = 0
+        self.rejected = 0
+
+    @property
+    def base(self):
+        return next(iter(self.inflight), self.next_seq)
+
+    def wait_for_room(self, timeout=None):
+        #Block until fewer than max_pending messages wait; returns False if timeout passed first
+        with self.lock:
+            return self.lock.wait_for(lambda: len(self.pending) < self.max_pending, timeout)
+
+    def send(self, priority, data, frame_type=TEXT):
+        #Returns False if the message is too long for one frame or max_pending are already waiting
+        if len(data) > MAX_MESSAGE:
+            print(f"[Reliable TX] Message of {len(data)} bytes is longer than {MAX_MESSAGE}, not sent")
+            return False
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.rejected += 1
+                print(f"[Reliable TX] {len(self.pending)} messages already waiting, message not sent")
+                return False
+            self.pending.append((priority, bytes(data), time.monotonic(), frame_type))
+            self.messages += 1
+            self._fill()
+        return True
+
+    def _fill(self):
+        while self.pending and _diff(self.next_seq, self.base) < self.window:
+            priority, data, queued_at, frame_type = self.pending.popleft()
+            self.lock.notify_all()
+            message = OutgoingMessage(self.next_seq, priority, data, queued_at, frame_type)
+            self.inflight[message.seq] = message
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+            self._transmit(message)
+
+    def _transmit(self, message):
+        flags = (message.frame_type << 4) | (0 if self.synced else SYN)
+        frame = encode_frame(FRAME_RELIABLE, self.node_id, message.seq,
+                             RELIABLE.pack(flags, self.base) + message.data)
+        message.in_scheduler = True
+        message.transmissions += 1
+        self.transmissions += 1
+        if message.transmissions > 1:
+            self.retransmissions += 1
+        enqueued_at = message.queued_at if message.transmissions == 1 else None
+        self.scheduler.submit(message.priority, frame, enqueued_at, on_sent=self._on_sent(message))
+
+    def _on_sent(self, message):
+        def on_sent(sent_at):
+            with self.lock:
+                message.sent_at = sent_at
+                message.in_scheduler = False
+        return on_sent
+
+    def _retransmit(self, message):
+        if message.transmissions > self.max_retries:
+            del self.inflight[message.seq]
+            self.failed += 1
+            print(f"[Reliable TX] Giving up on message #{message.seq} after {message.transmissions} transmissions")
+            return
+        self._transmit(message)
+
+    def _update_rto(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = max(self.min_rto, min(self.max_rto, self.srtt + 4 * self.rttvar))
+
+    def handle_ack(self, frame, now=None):
+        if frame.node_id != self.node_id:
+            return
+        now = time.monotonic() if now is None else now
+        expected = frame.seq
+        bitmap = bytes(frame.payload)
+        with self.lock:
+            self.acks += 1
+            self.synced = True
+            latest_sent = None
+            for seq, message in list(self.inflight.items()):
+                offset = _diff(seq, expected)
+                if offset == 0:
+                    continue
+                if offset < 0x8000:
+                    bit = offset - 1
+                    if bit >= len(bitmap) * 8 or not bitmap[bit >> 3] & (1 << (bit & 7)):
+                        continue
+                del self.inflight[seq]
+                self.delivered += 1
+                self.delivered_bytes += len(message.data)
+                if message.sent_at is not None:
+                    #Karn: only messages sent once give an unambiguous round trip
+                    if message.transmissions == 1:
+                        self._update_rto(now - message.sent_at)
+                    latest_sent = message.sent_at if latest_sent is None else max(latest_sent, message.sent_at)
+            if latest_sent is not None:
+                #Anything written before an acknowledged message and still missing was lost
+                for message in list(self.inflight.values()):
+                    if not message.in_scheduler and message.sent_at is not None and message.sent_at < latest_sent:
+                        self.fast_retransmits += 1
+                        self._retransmit(message)
+            self._fill()
+
+    def timeout(self, message):
+        #Each resend of a message waits twice as long as the one before
+        return min(self.rto * 2 ** (message.transmissions - 1), self.max_rto)
+
+    def poll(self, now=None):
+        #Resend messages whose timeout expired
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            expired = [message for message in self.inflight.values()
+                       if not message.in_scheduler and message.sent_at is not None
+                       and now - message.sent_at >= self.timeout(message)]
+            if not expired:
+                return 0
+            self.timeouts += len(expired)
+            for message in expired:
+                self._retransmit(message)
+            self._fill()
+        return len(expired)
+
+    def run(self, stop_event, interval=0.2, report_interval=60.0):
+        next_report = time.monotonic() + report_interval
+        while not stop_event.wait(interval):
+            self.poll()
+            if report_interval and time.monotonic() >= next_report:
+                print(self.report())
+                next_report = time.monotonic() + report_interval
+
+    def stats(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {
+                'messages': self.messages,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'in_flight': len(self.inflight),
+                'pending': len(self.pending),
+                'rejected': self.rejected,
+                'transmissions': self.transmissions,
+                'retransmissions': self.retransmissions,
+                'retransmission_rate': self.retransmissions / self.transmissions if self.transmissions else 0.0,
+                'fast_retransmits': self.fast_retransmits,
+                'timeouts': self.timeouts,
+                'acks': self.acks,
+                'goodput': self.delivered_bytes / elapsed,
+                'srtt': self.srtt,
+                'rto': self.rto,
+            }
+
+    def backlog_lines(self):
+        #Waiting and in-flight messages in the format of the channel report
+        with self.lock:
+            return [f"  {'reliable tx':<14} pending={len(self.pending)}/{self.max_pending} "
+                    f"in_flight={len(self.inflight)}/{self.window} refused={self.rejected}"]
+
+    def report(self):
+        stats = self.stats()
+        srtt = f"{stats['srtt']:.2f}s" if stats['srtt'] is not None else "n/a"
+        return ("[Reliable TX] "
+                f"{stats['delivered']}/{stats['messages']} messages delivered, {stats['failed']} failed, "
+                f"{stats['in_flight']} in flight, {stats['pending']}/{self.max_pending} waiting ({stats['rejected']} refused); "
+                f"goodput {stats['goodput']:.1f} B/s, retransmissions {stats['retransmissions']}/{stats['transmissions']} "
+                f"({100 * stats['retransmission_rate']:.1f}%, {stats['fast_retransmits']} fast, {stats['timeouts']} timeouts), "
+                f"{stats['acks']} ACKs, srtt {srtt} rto {stats['rto']:.2f}s")
+
+class PeerState:
+    def __init__(self, expected):
+        self.expected = expected
+        self.buffer = {}
+        self.ack_due = False
+        self.delivered = 0
+        self.bytes = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.skipped = 0
+        self.restarts = 0
+        self.first = time.monotonic()
+
+class ReliableReceiver:
+    #Ground side: delivers each node's messages once and in order, and builds the ACKs
+    #the uplink worker sends back (one per node per interval, however many frames arrived)
+    def __init__(self, window=MAX_WINDOW):
+        self.window = window
+        self.peers = {}
+        self.lock = threading.Lock()
+
+    def handle_frame(self, frame):
+        #Returns the messages this frame made deliverable as (frame type, bytes), oldest first
+        flags, base = RELIABLE.unpack_from(frame.payload)
+        message = (flags >> 4, bytes(frame.payload[RELIABLE.size:]))
+        delivered = []
+        with self.lock:
+            peer = self.peers.get(frame.node_id)
+            if peer is None:
+                peer = self.peers[frame.node_id] = PeerState(base)
+            elif flags & SYN and min(_diff(peer.expected, base), _diff(base, peer.expected)) > self.window:
+                #A new session nowhere near where the old one was: the sender restarted
+                print(f"[Reliable RX] Node {frame.node_id} restarted its sequence at #{base}")
+                peer.expected = base
+                peer.buffer.clear()
+                peer.restarts += 1
+            peer.ack_due = True
+            if frame.seq in peer.buffer or _diff(frame.seq, peer.expected) >= 0x8000:
+                peer.duplicates += 1
+                return delivered
+            #The sender gave up on the messages before base
+            while _diff(base, peer.expected) < 0x8000 and base != peer.expected:
+                self._deliver_next(peer, delivered, skip=True)
+            while peer.expected in peer.buffer:
+                self._deliver_next(peer, delivered)
+            offset = _diff(frame.seq, peer.expected)
+            if offset >= 0x8000:
+                peer.duplicates += 1
+            elif offset >= self.window:
+                print(f"[Reliable RX] Message #{frame.seq} from node {frame.node_id} is outside the window, dropped")
+            else:
+                if offset:
+                    peer.out_of_order += 1
+                peer.buffer[frame.seq] = message
+            while peer.expected in peer.buffer:
+                self._deliver_next(peer, delivered)
+        return delivered
+
+    def _deliver_next(self, peer, delivered, skip=False):
+        message = peer.buffer.pop(peer.expected, None)
+        if message is None:
+            if skip:
+                peer.skipped += 1
+        else:
+            delivered.append(message)
+            peer.delivered += 1
+            peer.bytes += len(message[1])
+        peer.expected = (peer.expected + 1) & 0xFFFF
+
+    def acks(self):
+        #ACK frames owed since the last call, as (node id, frame)
+        out = []
+        with self.lock:
+            for node_id, peer in self.peers.items():
+                if not peer.ack_due:
+                    continue
+                peer.ack_due = False
+                bitmap = bytearray(self.window // 8)
+                for seq in peer.buffer:
+                    bit = _diff(seq, peer.expected) - 1
+                    bitmap[bit >> 3] |= 1 << (bit & 7)
+                out.append((node_id, encode_frame(FRAME_ACK, node_id, peer.expected, bytes(bitmap).rstrip(b'\0'))))
+        return out
+
+    def report_lines(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                f"  reliable node {node_id}: delivered={peer.delivered} bytes={peer.bytes} "
+                f"goodput={peer.bytes / max(now - peer.first, 1e-9):.1f} B/s duplicates={peer.duplicates} "
+                f"out-of-order={peer.out_of_order} given-up={peer.skipped} waiting={len(peer.buffer)}"
+                for node_id, peer in sorted(self.peers.items())
+            ]
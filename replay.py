@@ -0,0 +1,157 @@
+#This script replays a recorded serial capture into the WES ground station.
+#Record one by running lora_receiver.py with WES_CAPTURE=flight.cap, then:
+#   python replay.py flight.cap              real time, with the live plot
+#   python replay.py flight.cap --speed 20   twenty times faster
+#   python replay.py flight.cap --speed 0 --headless
+#The normal mode runs lora_receiver.main on the capture. Headless mode runs the
+#same decode, persistence and plot stages in one thread without a window and
+#reports parse throughput and the persistence/render cost per message.
+#Logs, CSVs and images go to --workdir (a temp dir by default), and recorded
+#"run" commands are never executed.
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from serial_capture import ReplayPort
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Replay a serial capture into the ground station")
+    parser.add_argument("capture", type=str, help="Capture file written with WES_CAPTURE")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 real time, N times faster, 0 unthrottled")
+    parser.add_argument("--headless", action="store_true", help="No window; measure per-stage cost")
+    parser.add_argument("--verbose", action="store_true", help="Keep the per-message output in headless mode")
+    parser.add_argument("--workdir", type=str, help="Where the replayed CSVs and images go (default: a temp dir)")
+    return parser.parse_args()
+
+class StageTimer:
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+
+    @contextlib.contextmanager
+    def measure(self, items=1):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.calls += 1
+            self.items += items
+
+    def per_item_us(self):
+        return 1e6 * self.seconds / self.items if self.items else 0.0
+
+def run_live(port):
+    import lora_receiver
+    lora_receiver.EXECUTE_COMMANDS = False
+    stop_event = threading.Event()
+
+    def stop_when_finished():
+        while not port.finished and not stop_event.is_set():
+            time.sleep(0.2)
+        # Give persistence and the last redraw a moment before shutting down
+        stop_event.wait(2.0)
+        stop_event.set()
+
+    threading.Thread(target=stop_when_finished, name="Replay Watcher", daemon=True).start()
+    lora_receiver.main(port=port, stop_event=stop_event)
+
+def run_headless(port, verbose=False):
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import lora_receiver
+    import plotter
+    from csv_writer import get_batch
+    from serial_reader import SerialFrameReader
+    lora_receiver.EXECUTE_COMMANDS = False
+    lora_receiver.lora = port
+
+    reader = SerialFrameReader(port)
+    parse = {'frame': StageTimer(), 'text': StageTimer()}
+    persist = StageTimer()
+    render = StageTimer()
+    # Persist and redraw on the capture's own clock, as the live stages would
+    render_interval = 1.0 / plotter.RENDER_FPS
+    persist_interval = 1.0
+    next_render = next_persist = None
+
+    def persist_pending():
+        while True:
+            batch = get_batch(plotter.persist_queue, plotter.PERSIST_BATCH_SIZE, timeout=0)
+            if not batch:
+                return
+            with persist.measure(len(batch)):
+                plotter.write_persist_batch(batch)
+                plotter.flush_logs()
+
+    def render_pending():
+        rows = plotter.render_queue.qsize()
+        if rows:
+            with render.measure(rows):
+                plotter.drain_render_queue()
+                plotter.update_plot()
+
+    output = sys.stdout if verbose else open(os.devnull, 'w')
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        while not port.finished:
+            reader.read()
+            for kind, message in reader.parser.messages():
+                with parse[kind].measure():
+                    if kind == 'frame':
+                        lora_receiver.handle_frame(message, reader.last_read, "replay")
+                    else:
+                        lora_receiver.handle_line(message)
+            now = port.last_arrival
+            if now is None:
+                continue
+            if next_persist is None or now >= next_persist:
+                persist_pending()
+                next_persist = now + persist_interval
+            if next_render is None or now >= next_render:
+                render_pending()
+                next_render = now + render_interval
+        persist_pending()
+        render_pending()
+        for writer in plotter.CSV_WRITERS.values():
+            writer.flush()
+        plotter.flight_store.flush()
+    elapsed = time.perf_counter() - started
+    if not verbose:
+        output.close()
+
+    messages = parse['frame'].items + parse['text'].items
+    parse_seconds = parse['frame'].seconds + parse['text'].seconds
+    print(f"[Replay] {messages} messages ({parse['frame'].items} frames, {parse['text'].items} lines), "
+          f"{port.bytes_replayed} bytes in {elapsed:.2f}s")
+    if parse_seconds > 0:
+        print(f"[Replay] Parse: {messages / parse_seconds:.0f} messages/s, "
+              f"{port.bytes_replayed / parse_seconds / 1000:.1f} kB/s "
+              f"(frame {parse['frame'].per_item_us():.0f} us, line {parse['text'].per_item_us():.0f} us)")
+    print(f"[Replay] Persist: {persist.items} rows in {persist.calls} batches, {persist.per_item_us():.0f} us/row")
+    print(f"[Replay] Render: {render.calls} redraws of {render.items} rows, "
+          f"{1000 * render.seconds / max(render.calls, 1):.1f} ms/redraw, {render.per_item_us():.0f} us/row")
+    print(reader.report())
+    print(plotter.tracer.report(plotter.link_stats))
+    print("\n".join(lora_receiver.node_traffic.report_lines()))
+    lora_receiver.command_executor.shutdown(wait=False)
+
+def main():
+    args = get_args()
+    port = ReplayPort(os.path.abspath(args.capture), speed=args.speed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="wes_replay_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"[Replay] Replaying {args.capture} at "
+          f"{'unthrottled' if args.speed <= 0 else f'{args.speed:g}x'} speed into {workdir}")
+    if args.headless:
+        run_headless(port, verbose=args.verbose)
+    else:
+        run_live(port)
+
+if __name__ == "__main__":
+    main()
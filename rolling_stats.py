@@ -0,0 +1,178 @@
+#This module keeps on-board rolling statistics for the WES project.
+#RunningStats is Welford's single-pass mean/variance with min and max, so a
+#window or a whole flight costs a few floats no matter how many samples it saw.
+#VerticalRate smooths the altitude from calculate_altitude and differentiates it
+#into a climb rate (m/s). AdaptivePolicy turns that rate into a sampling and
+#downlink mode: dense raw samples while climbing or descending, sparse samples
+#and one summary per window while the altitude is steady.
+import math
+import time
+from collections import namedtuple
+
+FIELDS = ('temperature', 'humidity', 'pressure', 'altitude')
+
+#Sampling/downlink modes
+ACTIVE = "active"
+STABLE = "stable"
+
+FieldStats = namedtuple('FieldStats', ['mean', 'std', 'min', 'max'])
+#Summary of one window: timestamp is the datetime of the window's first sample,
+#duration is in seconds, vertical_rate is the smoothed rate at the end (m/s)
+WindowSummary = namedtuple('WindowSummary', ['sensor_id', 'timestamp', 'duration', 'count', 'vertical_rate',
+                                             'temperature', 'humidity', 'pressure', 'altitude'])
+
+class RunningStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def variance(self):
+        #Sample variance (0 until there are two values)
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def snapshot(self):
+        return FieldStats(self.mean, self.std(), self.min, self.max)
+
+class VerticalRate:
+    #Exponential smoothing with time constants, so the result does not depend on the
+    #sample interval: the altitude is smoothed first (BME280 altitude is noisy at the
+    #metre level), then its derivative is smoothed again
+    def __init__(self, altitude_tau=3.0, rate_tau=5.0):
+        self.altitude_tau = altitude_tau
+        self.rate_tau = rate_tau
+        self.altitude = None
+        self.rate = 0.0
+        self.last_time = None
+
+    def add(self, altitude, t):
+        #t: time.monotonic() of the reading; returns the smoothed rate in m/s
+        if self.last_time is None:
+            self.altitude, self.last_time = altitude, t
+            return self.rate
+        dt = t - self.last_time
+        if dt <= 0:
+            return self.rate
+        previous = self.altitude
+        self.altitude += (1 - math.exp(-dt / self.altitude_tau)) * (altitude - self.altitude)
+        self.rate += (1 - math.exp(-dt / self.rate_tau)) * ((self.altitude - previous) / dt - self.rate)
+        self.last_time = t
+        return self.rate
+
+class FlightStats:
+    #Per-field statistics for the current window and for the whole flight, plus the vertical rate
+    def __init__(self, sensor_id, altitude_tau=3.0, rate_tau=5.0):
+        self.sensor_id = sensor_id
+        self.window = {field: RunningStats() for field in FIELDS}
+        self.flight = {field: RunningStats() for field in FIELDS}
+        self.vertical_rate = VerticalRate(altitude_tau, rate_tau)
+        self.window_started = None      #(timestamp, monotonic) of the window's first sample
+        self.last_sample = None
+
+    def add(self, sensor_data):
+        #Returns the smoothed vertical rate after this sample
+        if self.window_started is None:
+            self.window_started = (sensor_data.timestamp, sensor_data.monotonic)
+        for field in FIELDS:
+            value = getattr(sensor_data, field)
+            self.window[field].add(value)
+            self.flight[field].add(value)
+        self.last_sample = sensor_data
+        return self.vertical_rate.add(sensor_data.altitude, sensor_data.monotonic)
+
+    def window_count(self):
+        return self.window['altitude'].count
+
+    def window_age(self, now=None):
+        if self.window_started is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return now - self.window_started[1]
+
+    def _summary(self, stats, started):
+        timestamp, monotonic = started
+        return WindowSummary(self.sensor_id, timestamp, self.last_sample.monotonic - monotonic,
+                             stats['altitude'].count, self.vertical_rate.rate,
+                             *(stats[field].snapshot() for field in FIELDS))
+
+    def window_snapshot(self):
+        #Summary of the current window (None if it is empty), which keeps going
+        if not self.window_count():
+            return None
+        return self._summary(self.window, self.window_started)
+
+    def window_summary(self):
+        #Summary of the samples since the last call (None if there were none); starts a new window
+        summary = self.window_snapshot()
+        self.reset_window()
+        return summary
+
+    def reset_window(self):
+        for stats in self.window.values():
+            stats.reset()
+        self.window_started = None
+
+    def report(self):
+        lines = [f"[Stats] {self.sensor_id}: {self.flight['altitude'].count} samples, "
+                 f"vertical rate {self.vertical_rate.rate:+.2f} m/s"]
+        for field in FIELDS:
+            stats = self.flight[field]
+            if stats.count:
+                lines.append(f"  {field:<12} mean={stats.mean:9.2f} std={stats.std():7.2f} "
+                             f"min={stats.min:9.2f} max={stats.max:9.2f}")
+        return "\n".join(lines)
+
+class AdaptivePolicy:
+    #ACTIVE as soon as |vertical rate| reaches climb_rate; back to STABLE once it has
+    #stayed below climb_rate * calm_ratio for hold seconds (hysteresis, so hovering
+    #near the threshold does not flap between modes)
+    def __init__(self, climb_rate=0.5, calm_ratio=0.5, hold=30.0, active_interval=1.0, stable_interval=10.0):
+        self.climb_rate = climb_rate
+        self.calm_rate = climb_rate * calm_ratio
+        self.hold = hold
+        self.intervals = {ACTIVE: active_interval, STABLE: stable_interval}
+        self.mode = ACTIVE      #Dense until the first hold period shows the altitude is steady
+        self.calm_since = None
+        self.changes = 0
+
+    def update(self, vertical_rate, now=None):
+        #Returns the mode after this rate; changes are counted and printed
+        now = time.monotonic() if now is None else now
+        rate = abs(vertical_rate)
+        mode = self.mode
+        if rate >= self.climb_rate:
+            mode = ACTIVE
+            self.calm_since = None
+        elif rate < self.calm_rate:
+            if self.calm_since is None:
+                self.calm_since = now
+            if now - self.calm_since >= self.hold:
+                mode = STABLE
+        else:
+            self.calm_since = None
+        if mode != self.mode:
+            print(f"[Stats] Vertical rate {vertical_rate:+.2f} m/s: switching to {mode} mode")
+            self.mode = mode
+            self.changes += 1
+        return mode
+
+    def interval(self):
+        return self.intervals[self.mode]
@@ -0,0 +1,120 @@
+#This module records and replays raw LoRa serial traffic for the WES project.
+#A capture file is a short header followed by one record per serial read:
+#   arrival time (epoch seconds, f64), length (u32), the bytes as received
+#CapturingPort wraps a live port and records everything read through it;
+#ReplayPort looks like a serial port to SerialFrameReader but hands back the
+#recorded reads at their original pace, N times faster, or as fast as possible.
+import struct
+import time
+
+MAGIC = b'WESCAP1\n'
+RECORD = struct.Struct('>dI')
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, data, arrival=None):
+        self.file.write(RECORD.pack(time.time() if arrival is None else arrival, len(data)))
+        self.file.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            print(f"[Capture] Wrote {self.records} reads ({self.bytes} bytes) to {self.path}")
+
+def read_capture(path):
+    #Generator of (arrival time, bytes) records
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a serial capture file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            arrival, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield arrival, data
+
+class CapturingPort:
+    #Passes everything through to the real port and records each non-empty read
+    def __init__(self, port, path):
+        self.port = port
+        self.writer = CaptureWriter(path)
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if data:
+            self.writer.write(data)
+        return data
+
+    def close(self):
+        self.writer.close()
+        self.port.close()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+class ReplayPort:
+    #speed 1 replays in real time, N runs N times faster, 0 does not wait at all.
+    #Writes (e.g. image NACKs) are counted and discarded.
+    def __init__(self, path, speed=1.0, timeout=0.2):
+        self.path = path
+        self.speed = speed
+        self.timeout = timeout
+        self.records = read_capture(path)
+        self.next = next(self.records, None)
+        self.first_arrival = self.next[0] if self.next else 0.0
+        self.started = None
+        self.finished = self.next is None
+        self.is_open = True
+        self.last_arrival = None    #Capture time of the last record handed out
+        self.bytes_replayed = 0
+        self.bytes_written = 0
+
+    def _due_in(self):
+        #Seconds until the next record is due
+        if self.speed <= 0:
+            return 0.0
+        if self.started is None:
+            self.started = time.monotonic()
+        return (self.next[0] - self.first_arrival) / self.speed - (time.monotonic() - self.started)
+
+    @property
+    def in_waiting(self):
+        if self.next is None or self._due_in() > 0:
+            return 0
+        return len(self.next[1])
+
+    def read(self, size=1):
+        #Returns one recorded read once it is due (like a port read, it waits at most timeout)
+        if self.next is None:
+            self.finished = True
+            time.sleep(self.timeout if self.speed > 0 else 0)
+            return b''
+        wait = self._due_in()
+        if wait > self.timeout:
+            time.sleep(self.timeout)
+            return b''
+        if wait > 0:
+            time.sleep(wait)
+        self.last_arrival, data = self.next
+        self.next = next(self.records, None)
+        self.bytes_replayed += len(data)
+        return data
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+        self.records.close()
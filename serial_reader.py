@@ -0,0 +1,52 @@
+#This module reads LoRa messages from a serial port for the WES project.
+#It reads whatever bytes have arrived (no readline, no fixed sleep), hands them
+#to a StreamParser and yields complete frames and text lines as they appear.
+import time
+from telemetry_codec import StreamParser
+
+class SerialFrameReader:
+    def __init__(self, port):
+        self.port = port
+        self.parser = StreamParser()
+        self.bytes_read = 0
+        self.reads = 0
+        self.started = time.monotonic()
+        self.last_read = None       #time.monotonic() of the last read that returned data
+
+    def read(self):
+        #Blocks up to the port timeout for the first byte, then takes everything already waiting
+        data = self.port.read(self.port.in_waiting or 1)
+        self.reads += 1
+        if data:
+            self.last_read = time.monotonic()
+            self.bytes_read += len(data)
+            self.parser.feed(data)
+        else:
+            self.parser.flush_text()
+        return len(data)
+
+    def messages(self, stop_event):
+        #Generator of ('frame', Frame) and ('text', str) items until stop_event is set
+        while not stop_event.is_set():
+            self.read()
+            yield from self.parser.messages()
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'bytes': self.bytes_read,
+            'reads': self.reads,
+            'frames': self.parser.frames,
+            'lines': self.parser.lines,
+            'crc_errors': self.parser.crc_errors,
+            'skipped_bytes': self.parser.skipped_bytes,
+            'overlong_lines': self.parser.overlong_lines,
+            'bytes_per_s': self.bytes_read / elapsed,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return ("[LoRa RX] Reader: "
+                f"{stats['bytes']} bytes ({stats['bytes_per_s']:.0f} B/s), "
+                f"{stats['frames']} frames, {stats['lines']} lines, "
+                f"{stats['crc_errors']} CRC errors, {stats['skipped_bytes']} bytes skipped")
@@ -0,0 +1,55 @@
+#This module holds the time series store used by the ground station plots.
+#Samples live in a preallocated NumPy ring buffer. Every row is written twice
+#(at i and i + capacity) so the current window is always one contiguous slice
+#and can be handed to matplotlib without copying.
+import numpy as np
+
+class RingSeries:
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = list(fields)
+        self._index = {name: row + 1 for row, name in enumerate(self.fields)}
+        #Row 0 holds the time axis, one row per field after that
+        self._data = np.full((len(self.fields) + 1, 2 * capacity), np.nan)
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, *values):
+        i = self._next
+        self._data[0, i] = self._data[0, i + self.capacity] = t
+        for row, value in enumerate(values, start=1):
+            self._data[row, i] = self._data[row, i + self.capacity] = value
+        self._next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, times, values):
+        #times: (n,), values: (n, len(fields)); only the newest capacity rows are kept
+        rows = np.column_stack([np.asarray(times, dtype=float), np.asarray(values, dtype=float)]).T
+        rows = rows[:, -self.capacity:]
+        n = rows.shape[1]
+        idx = (self._next + np.arange(n)) % self.capacity
+        self._data[:, idx] = rows
+        self._data[:, idx + self.capacity] = rows
+        self._next = (self._next + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def _window(self):
+        start = self._next if self.count == self.capacity else 0
+        return slice(start, start + self.count)
+
+    def times(self):
+        return self._data[0, self._window()]
+
+    def column(self, name):
+        return self._data[self._index[name], self._window()]
+
+    def columns(self):
+        window = self._window()
+        return [self._data[row, window] for row in range(1, len(self.fields) + 1)]
+
+    def clear(self):
+        self._next = 0
+        self.count = 0
@@ -1,8 +1,40 @@
 #This module is used for accessing shared resources in the WES project.
-import queue
+import os
 import threading
 
-# Shared data queue
-data_queue = queue.Queue()
-ai_data_queue = queue.Queue()
+from channels import Channel, FanOut, BLOCK, DROP_OLDEST, COALESCE
+from latency_trace import LatencyTracer
+from startup import StartupTracker
+
+# Shared data channels (bounded; see channels.py for the overflow policies)
+# Sensor samples for the LoRa link: keep the newest if the radio falls behind
+data_queue = Channel("telemetry tx", 256, DROP_OLDEST)
+# Sensor samples for the CSV log: lossless, the sensor waits if the SD card stalls
+csv_queue = Channel("csv log", 1024, BLOCK)
+# One put from the sensor reaches both consumers
+sensor_samples = FanOut("sensor samples", data_queue, csv_queue)
+
+# One detection_codec.DetectionReport per camera frame with something to report
+ai_data_queue = Channel("detections", 64, DROP_OLDEST)
+command_reply_queue = Channel("command reply", 32, BLOCK)
+# (jpeg bytes, label, confidence) thumbnails for the LoRa downlink; a newer
+# thumbnail of the same label replaces one still waiting
+image_queue = Channel("thumbnails", 4, COALESCE, key=lambda item: item[1])
+
+channels = [data_queue, csv_queue, ai_data_queue, command_reply_queue, image_queue]
+# The LoRa transmitter's scheduler and reliable sender, once it runs; reported with the channels
+link_backlogs = []
+
 stop_event = threading.Event()
+
+# Device backend: "hardware" on the Pi, "sim" for the simulated devices in sim_devices.py
+DEVICE_BACKEND = os.environ.get("WES_BACKEND", "hardware")
+
+# Per-hop latency of sensor samples on this node (keyed by the sample's monotonic read time)
+tracer = LatencyTracer("flight node")
+
+# Lock for I2C communication (one bus shared by every I2C device)
+i2c_lock = threading.Lock()
+
+# Per-subsystem readiness and startup timings (see startup.py)
+startup = StartupTracker()
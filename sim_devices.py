@@ -0,0 +1,304 @@
+#This module simulates the flight node's devices for the WES project.
+#Select it with WES_BACKEND=sim to run the pipeline on an ordinary Linux box:
+#   SimulatedBME280      readings that follow a flight profile (ISA atmosphere)
+#   SimulatedSerialLink  a pair of pty serial ports joined by a relay that
+#                        applies baud rate, latency and packet loss
+#   Picamera2, IMX500    a synthetic camera and SSD-style network output with
+#                        a few objects moving through the frame
+import math
+import os
+import random
+import threading
+import time
+import tty
+from collections import deque
+
+import numpy as np
+
+#Flight profiles: altitude above the launch site (m) at t seconds into the flight
+def _static_profile(t):
+    return 0.0
+
+def _drone_profile(t):
+    #Climb at 3 m/s to 120 m, hover for two minutes, descend at 2 m/s, repeat
+    climb, hover, descent = 40.0, 120.0, 60.0
+    t = t % (climb + hover + descent + 30.0)
+    if t < climb:
+        return 3.0 * t
+    if t < climb + hover:
+        return 120.0 + 1.5 * math.sin(t / 7.0)
+    if t < climb + hover + descent:
+        return 120.0 - 2.0 * (t - climb - hover)
+    return 0.0
+
+def _balloon_profile(t):
+    #Ascend at 5 m/s to burst at 30 km, then fall under a parachute whose
+    #descent rate shrinks as the air gets denser
+    burst_time = 30000.0 / 5.0
+    if t < burst_time:
+        return 5.0 * t
+    altitude = 30000.0
+    fall = t - burst_time
+    while fall > 0 and altitude > 0:
+        step = min(fall, 10.0)
+        altitude -= step * 5.0 * math.exp(altitude / 14000.0)
+        fall -= step
+    return max(altitude, 0.0)
+
+PROFILES = {
+    'static': _static_profile,
+    'drone': _drone_profile,
+    'balloon': _balloon_profile,
+}
+
+def isa_atmosphere(altitude):
+    #Temperature (°C) and pressure (hPa) of the International Standard Atmosphere
+    if altitude < 11000:
+        temperature = 15.0 - 0.0065 * altitude
+        pressure = 1013.25 * (1 - 2.25577e-5 * altitude) ** 5.25588
+    else:
+        temperature = -56.5
+        pressure = 226.32 * math.exp(-(altitude - 11000) / 6341.6)
+    return temperature, pressure
+
+class SimulatedBME280:
+    #Same read() as bme280Data.BME280Sensor. time_scale > 1 fast-forwards the profile.
+    def __init__(self, profile='drone', launch_altitude=100.0, time_scale=1.0, noise=True, burst=False,
+                 measurement_time=0.0023):
+        self.profile = PROFILES[profile]
+        self.launch_altitude = launch_altitude
+        self.time_scale = time_scale
+        self.noise = noise
+        self.burst = burst
+        self.measurement_time = measurement_time
+        self.started = time.monotonic()
+        self.random = random.Random(1)
+
+    def read(self):
+        if not self.burst:
+            time.sleep(self.measurement_time)
+        read_time = time.monotonic()
+        altitude = self.launch_altitude + self.profile((read_time - self.started) * self.time_scale)
+        temperature, pressure = isa_atmosphere(altitude)
+        humidity = 60.0 * math.exp(-altitude / 3000.0) + 5.0
+        if self.noise:
+            temperature += self.random.gauss(0, 0.05)
+            pressure += self.random.gauss(0, 0.012)
+            humidity += self.random.gauss(0, 0.3)
+        return temperature, pressure, min(max(humidity, 0.0), 100.0), read_time
+
+class SimulatedSerialLink:
+    #Two pty serial ports (ports[0], ports[1]) joined by a relay in each direction.
+    #Every chunk written is treated as one radio packet: it is dropped with
+    #probability loss, delayed by latency seconds, and paced at baud (10 bits a byte).
+    def __init__(self, baud=9600, loss=0.0, latency=0.0, seed=None):
+        self.baud = baud
+        self.loss = loss
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.closed = threading.Event()
+        self.sent = [0, 0]
+        self.dropped = [0, 0]
+        self.masters = []
+        self.slaves = []
+        self.ports = []
+        for _ in range(2):
+            master, slave = os.openpty()
+            tty.setraw(master)
+            tty.setraw(slave)
+            self.masters.append(master)
+            self.slaves.append(slave)
+            self.ports.append(os.ttyname(slave))
+        self.threads = []
+        for direction in (0, 1):
+            pending = deque()
+            cond = threading.Condition()
+            self.threads.append(threading.Thread(target=self._receive, args=(direction, pending, cond),
+                                                 name=f"Sim Link Rx {direction}", daemon=True))
+            self.threads.append(threading.Thread(target=self._deliver, args=(direction, pending, cond),
+                                                 name=f"Sim Link Tx {direction}", daemon=True))
+        for t in self.threads:
+            t.start()
+
+    def _receive(self, direction, pending, cond):
+        source = self.masters[direction]
+        while not self.closed.is_set():
+            try:
+                data = os.read(source, 4096)
+            except OSError:
+                return
+            if not data:
+                continue
+            if self.random.random() < self.loss:
+                self.dropped[direction] += 1
+                continue
+            with cond:
+                pending.append((time.monotonic() + self.latency, data))
+                cond.notify()
+
+    def _deliver(self, direction, pending, cond):
+        target = self.masters[1 - direction]
+        line_free = 0.0
+        while not self.closed.is_set():
+            with cond:
+                while not pending and not self.closed.is_set():
+                    cond.wait(0.5)
+                if not pending:
+                    return
+                deliver_at, data = pending.popleft()
+            #The packet arrives once it has been delayed and the line has clocked it out
+            deliver_at = max(deliver_at, line_free) + len(data) * 10 / self.baud
+            line_free = deliver_at
+            delay = deliver_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(target, data)
+            except OSError:
+                return
+            self.sent[direction] += 1
+
+    def close(self):
+        self.closed.set()
+        for fd in self.masters + self.slaves:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+#Synthetic camera. Only the parts of the picamera2 API used by object_detection.
+SIM_LABELS = ['person', 'car', 'truck', 'bird', 'dog']
+
+class NetworkIntrinsics:
+    def __init__(self):
+        self.task = None
+        self.labels = list(SIM_LABELS)
+        self.inference_rate = 10
+        self.postprocess = ""
+        self.bbox_normalization = False
+        self.bbox_order = "yx"
+        self.ignore_dash_labels = False
+
+    def update_with_defaults(self):
+        pass
+
+class _SimObject:
+    def __init__(self, rng, category):
+        self.category = category
+        self.size = rng.uniform(0.08, 0.25)
+        self.phase = rng.uniform(0, 2 * math.pi)
+        self.speed = rng.uniform(0.05, 0.2)
+        self.base_conf = rng.uniform(0.45, 0.9)
+
+    def box(self, t):
+        cx = 0.5 + 0.35 * math.sin(self.phase + self.speed * t)
+        cy = 0.5 + 0.25 * math.cos(self.phase + 0.7 * self.speed * t)
+        half = self.size / 2
+        return (cy - half, cx - half, cy + half, cx + half)
+
+    def conf(self, t):
+        return min(0.99, self.base_conf + 0.08 * math.sin(3 * self.speed * t + self.phase))
+
+class IMX500:
+    #Produces SSD-style outputs: boxes (1, N, 4) normalized y0, x0, y1, x1, scores (1, N), classes (1, N)
+    MAX_OUTPUTS = 10
+
+    def __init__(self, model=None, objects=3, seed=1):
+        self.model = model
+        self.camera_num = 0
+        self.network_intrinsics = None
+        rng = random.Random(seed)
+        self.objects = [_SimObject(rng, rng.randrange(len(SIM_LABELS))) for _ in range(objects)]
+        self.started = time.monotonic()
+
+    def get_input_size(self):
+        return (320, 320)
+
+    def get_outputs(self, metadata, add_batch=False):
+        t = metadata.get('SensorTimestamp', time.monotonic()) - self.started
+        boxes = np.zeros((self.MAX_OUTPUTS, 4), np.float32)
+        scores = np.zeros(self.MAX_OUTPUTS, np.float32)
+        classes = np.zeros(self.MAX_OUTPUTS, np.float32)
+        for i, obj in enumerate(self.objects[:self.MAX_OUTPUTS]):
+            boxes[i] = obj.box(t)
+            scores[i] = obj.conf(t)
+            classes[i] = obj.category
+        if add_batch:
+            return [boxes[None], scores[None], classes[None]]
+        return [boxes, scores, classes]
+
+    def convert_inference_coords(self, coords, metadata, picam2, stream="main"):
+        y0, x0, y1, x1 = coords
+        width, height = picam2.camera_configuration()[stream]['size']
+        x, y = int(max(x0, 0) * width), int(max(y0, 0) * height)
+        w, h = int(min(x1, 1) * width) - x, int(min(y1, 1) * height) - y
+        return x, y, w, h
+
+class _SimRequest:
+    def __init__(self, camera, array, metadata):
+        self.camera = camera
+        self.array = array
+        self.metadata = metadata
+
+    def get_metadata(self):
+        return self.metadata
+
+    def release(self):
+        self.camera.buffers.append(self.array)
+
+class MappedArray:
+    def __init__(self, request, stream="main"):
+        self.request = request
+        self.array = request.array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Picamera2:
+    #Hands out XBGR frames from a small buffer pool at the configured frame rate
+    def __init__(self, camera_num=0, size=(640, 480)):
+        self.camera_num = camera_num
+        self.size = size
+        self.frame_rate = 10
+        self.buffers = deque()
+        self.next_frame = 0.0
+        self.frame_count = 0
+
+    def create_preview_configuration(self, controls=None, buffer_count=4, **kwargs):
+        return {'controls': dict(controls or {}), 'buffer_count': buffer_count, 'main': {'size': self.size}}
+
+    def camera_configuration(self):
+        return {'main': {'size': self.size}}
+
+    def start(self, config=None):
+        config = config or self.create_preview_configuration()
+        self.frame_rate = config['controls'].get('FrameRate') or self.frame_rate
+        width, height = self.size
+        #A fixed gradient background, copied into each buffer like a sensor readout would be
+        self.background = np.zeros((height, width, 4), np.uint8)
+        self.background[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)[None, :]
+        self.background[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+        self.buffers = deque(np.empty_like(self.background) for _ in range(config['buffer_count']))
+        self.next_frame = time.monotonic()
+
+    def capture_request(self):
+        self.next_frame += 1.0 / self.frame_rate
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame = time.monotonic()
+        while not self.buffers:
+            time.sleep(0.001)
+        array = self.buffers.popleft()
+        np.copyto(array, self.background)
+        self.frame_count += 1
+        metadata = {'SensorTimestamp': time.monotonic(), 'ScalerCrop': (0, 0, 4056, 3040),
+                    'FrameCount': self.frame_count}
+        return _SimRequest(self, array, metadata)
+
+    def stop(self):
+        pass
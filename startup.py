@@ -0,0 +1,58 @@
+#This module tracks staged startup for the WES project.
+#Each subsystem (sensor, lora, camera, ...) runs its own imports and device
+#initialization inside its worker thread, records the stages it passes and sets
+#its readiness event, so fast subsystems start working while slow ones (the
+#camera firmware upload) are still loading. Times are from process start.
+import threading
+import time
+
+try:
+    #Count from when the interpreter started, not from when this module was imported
+    import psutil
+    PROCESS_START = time.monotonic() - (time.time() - psutil.Process().create_time())
+except ImportError:
+    PROCESS_START = time.monotonic()
+
+class StartupTracker:
+    def __init__(self, started=PROCESS_START):
+        self.started = started
+        self.events = {}
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def _event(self, name):
+        with self.lock:
+            event = self.events.get(name)
+            if event is None:
+                event = self.events[name] = threading.Event()
+            return event
+
+    def stage(self, name, stage):
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            self.stages.append((elapsed, name, stage))
+        print(f"[Startup] +{elapsed:.2f}s {name}: {stage}")
+
+    def ready(self, name):
+        self.stage(name, "ready")
+        self._event(name).set()
+
+    def is_ready(self, name):
+        return self._event(name).is_set()
+
+    def wait(self, name, timeout=None):
+        return self._event(name).wait(timeout)
+
+    def once(self, name, stage):
+        #Record a stage only the first time it happens (e.g. first sample transmitted)
+        with self.lock:
+            if any(n == name and s == stage for _, n, s in self.stages):
+                return
+        self.stage(name, stage)
+
+    def report(self):
+        with self.lock:
+            stages = sorted(self.stages)
+        lines = ["[Startup] Timings (seconds from process start):"]
+        lines.extend(f"  {elapsed:7.2f}  {name:<10} {stage}" for elapsed, name, stage in stages)
+        return "\n".join(lines)
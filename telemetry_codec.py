@@ -0,0 +1,401 @@
+#This module holds the binary frame format used on the LoRa link in the WES project.
+#
+#Frame layout (big-endian):
+#   0   2  sync word 0xA5 0x5A
+#   2   1  version (high nibble) | frame type (low nibble)
+#   3   1  payload length
+#   4   1  node id (from the sensor id, e.g. "BME280-01" -> 1)
+#   5   2  sequence number
+#   7   N  payload
+#   7+N 2  CRC-16/CCITT over bytes 2 .. 7+N
+#
+#A single BME280 sample is 19 bytes on air instead of ~90 bytes of text.
+#
+#Batch payload: sample count, base timestamp (epoch s + ms), the first sample as
+#an absolute SAMPLE record, then one record per following sample made of
+#zigzag varint deltas (ms, temperature, humidity, pressure, altitude) in the
+#same fixed-point units. A steady sample costs about 5-7 bytes.
+#
+#Summary payload (sent instead of raw samples while the altitude is steady):
+#window start (epoch s + ms), duration (0.1 s), sample count, vertical rate
+#(cm/s), then mean, std, min and max of each field in the SAMPLE units. 52 bytes.
+import binascii
+import re
+import struct
+import time
+from collections import namedtuple
+from datetime import datetime
+
+SYNC = b'\xA5\x5A'
+VERSION = 1
+
+#Frame types
+FRAME_SAMPLE = 0x1
+FRAME_BATCH = 0x2
+FRAME_IMAGE_META = 0x3
+FRAME_IMAGE_CHUNK = 0x4
+FRAME_IMAGE_NACK = 0x5
+FRAME_SUMMARY = 0x6
+FRAME_RELIABLE = 0x7     #Acknowledged message (see reliable_link.py)
+FRAME_ACK = 0x8
+FRAME_DETECTIONS = 0x9   #Compact detection events (see detection_codec.py)
+
+HEADER = struct.Struct('>2sBBBH')
+CRC = struct.Struct('>H')
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 255
+MAX_FRAME_SIZE = HEADER_SIZE + MAX_PAYLOAD + CRC.size
+
+#Sample payload: temperature 0.01 °C, humidity 0.01 %, pressure 0.02 hPa, altitude cm
+SAMPLE = struct.Struct('>hHHi')
+TEMP_SCALE = 100
+HUMIDITY_SCALE = 100
+PRESSURE_SCALE = 50
+ALTITUDE_SCALE = 100
+
+BATCH_HEADER = struct.Struct('>BIH')
+SUMMARY = struct.Struct('>IHHHh' 'hHhh' 'HHHH' 'HHHH' 'iIii')
+DURATION_SCALE = 10
+RATE_SCALE = 100
+
+Frame = namedtuple('Frame', ['version', 'frame_type', 'node_id', 'seq', 'payload'])
+TelemetrySample = namedtuple('TelemetrySample', ['node_id', 'seq', 'temperature', 'humidity', 'pressure', 'altitude', 'timestamp'],
+                             defaults=(None,))
+#Each field of a summary is a (mean, std, min, max) tuple
+SummaryStats = namedtuple('SummaryStats', ['mean', 'std', 'min', 'max'])
+TelemetrySummary = namedtuple('TelemetrySummary', ['node_id', 'seq', 'timestamp', 'duration', 'count', 'vertical_rate',
+                                                   'temperature', 'humidity', 'pressure', 'altitude'])
+
+class FrameError(ValueError):
+    pass
+
+def node_id_from_sensor_id(sensor_id):
+    #"BME280-01" -> 1, anything without a trailing number -> 0
+    match = re.search(r'(\d+)$', str(sensor_id))
+    return int(match.group(1)) & 0xFF if match else 0
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+def _fixed(value, scale, low, high):
+    return _clamp(int(round(value * scale)), low, high)
+
+def encode_frame(frame_type, node_id, seq, payload):
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError(f"Payload too large: {len(payload)} bytes")
+    header = HEADER.pack(SYNC, (VERSION << 4) | (frame_type & 0x0F), len(payload), node_id & 0xFF, seq & 0xFFFF)
+    body = header[2:] + payload
+    return SYNC + body + CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+def decode_frame(buffer, offset=0):
+    #Decode one frame starting at offset without copying the payload.
+    #Returns (Frame, frame_length), or (None, 0) if the buffer does not hold a full frame yet.
+    #Raises FrameError if the bytes at offset are not a valid frame.
+    view = memoryview(buffer)
+    if len(view) - offset < HEADER_SIZE:
+        return None, 0
+    sync, version_type, length, node_id, seq = HEADER.unpack_from(view, offset)
+    if sync != SYNC:
+        raise FrameError("Missing sync word")
+    version = version_type >> 4
+    if version != VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    end = offset + HEADER_SIZE + length
+    if len(view) < end + CRC.size:
+        return None, 0
+    (crc,) = CRC.unpack_from(view, end)
+    if binascii.crc_hqx(view[offset + 2:end], 0xFFFF) != crc:
+        raise FrameError("CRC mismatch")
+    frame = Frame(version, version_type & 0x0F, node_id, seq, view[offset + HEADER_SIZE:end])
+    return frame, end + CRC.size - offset
+
+def _fixed_sample(sensor_data):
+    return (
+        _fixed(sensor_data.temperature, TEMP_SCALE, -32768, 32767),
+        _fixed(sensor_data.humidity, HUMIDITY_SCALE, 0, 65535),
+        _fixed(sensor_data.pressure, PRESSURE_SCALE, 0, 65535),
+        _fixed(sensor_data.altitude, ALTITUDE_SCALE, -2**31, 2**31 - 1),
+    )
+
+def _from_fixed(node_id, seq, fixed, timestamp=None):
+    temp, humidity, pressure, altitude = fixed
+    return TelemetrySample(
+        node_id, seq,
+        temp / TEMP_SCALE, humidity / HUMIDITY_SCALE,
+        pressure / PRESSURE_SCALE, altitude / ALTITUDE_SCALE,
+        timestamp,
+    )
+
+def encode_sample(sensor_data, seq):
+    payload = SAMPLE.pack(*_fixed_sample(sensor_data))
+    return encode_frame(FRAME_SAMPLE, node_id_from_sensor_id(sensor_data.sensor_id), seq, payload)
+
+def decode_sample(frame):
+    if frame.frame_type != FRAME_SAMPLE or len(frame.payload) != SAMPLE.size:
+        raise FrameError("Not a sample frame")
+    return _from_fixed(frame.node_id, frame.seq, SAMPLE.unpack_from(frame.payload))
+
+def write_varint(out, value):
+    #Zigzag + LEB128, so small negative deltas stay small
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(buffer, offset):
+    result = 0
+    shift = 0
+    while True:
+        if offset >= len(buffer):
+            raise FrameError("Truncated varint")
+        byte = buffer[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), offset
+
+def _timestamp_ms(sensor_data):
+    timestamp = sensor_data.timestamp
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    return int(round(timestamp * 1000))
+
+class TelemetryBatcher:
+    #Packs queued SensorData samples into one FRAME_BATCH packet.
+    #The batch is ready once it holds max_samples, reaches max_bytes, or its
+    #oldest sample has waited max_age seconds.
+    def __init__(self, max_samples=16, max_bytes=200, max_age=30.0):
+        self.max_samples = max_samples
+        self.max_bytes = min(max_bytes, MAX_PAYLOAD)
+        self.max_age = max_age
+        self.reset()
+
+    def reset(self):
+        self.payload = bytearray()
+        self.count = 0
+        self.node_id = 0
+        self.first_added = None
+        self.previous = None
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, sensor_data):
+        fixed = _fixed_sample(sensor_data)
+        ms = _timestamp_ms(sensor_data)
+        record = bytearray()
+        if self.previous is None:
+            record += BATCH_HEADER.pack(0, ms // 1000, ms % 1000)
+            record += SAMPLE.pack(*fixed)
+        else:
+            previous_ms, previous_fixed = self.previous
+            write_varint(record, ms - previous_ms)
+            for value, previous_value in zip(fixed, previous_fixed):
+                write_varint(record, value - previous_value)
+        return record, (ms, fixed)
+
+    def fits(self, sensor_data):
+        if self.count == 0:
+            return True
+        if self.count >= self.max_samples or self.count >= 0xFF:
+            return False
+        record, _ = self._record(sensor_data)
+        return len(self.payload) + len(record) <= self.max_bytes
+
+    def add(self, sensor_data):
+        #Callers should check fits() first and flush if it returns False
+        record, self.previous = self._record(sensor_data)
+        if self.count == 0:
+            self.node_id = node_id_from_sensor_id(sensor_data.sensor_id)
+            self.first_added = time.monotonic()
+        self.payload += record
+        self.count += 1
+
+    def ready(self, now=None):
+        if self.count == 0:
+            return False
+        if self.count >= self.max_samples or len(self.payload) >= self.max_bytes:
+            return True
+        now = time.monotonic() if now is None else now
+        return now - self.first_added >= self.max_age
+
+    def flush(self, seq):
+        #Returns the encoded frame (sequence number of the first sample) and empties the batch
+        self.payload[0] = self.count
+        frame = encode_frame(FRAME_BATCH, self.node_id, seq, bytes(self.payload))
+        self.reset()
+        return frame
+
+def decode_batch(frame):
+    #Unpack a FRAME_BATCH into individually timestamped TelemetrySample rows
+    if frame.frame_type != FRAME_BATCH:
+        raise FrameError("Not a batch frame")
+    payload = frame.payload
+    if len(payload) < BATCH_HEADER.size + SAMPLE.size:
+        raise FrameError("Truncated batch frame")
+    count, seconds, millis = BATCH_HEADER.unpack_from(payload)
+    ms = seconds * 1000 + millis
+    fixed = SAMPLE.unpack_from(payload, BATCH_HEADER.size)
+    offset = BATCH_HEADER.size + SAMPLE.size
+    samples = [_from_fixed(frame.node_id, frame.seq, fixed, datetime.fromtimestamp(ms / 1000))]
+    for i in range(1, count):
+        delta_ms, offset = read_varint(payload, offset)
+        ms += delta_ms
+        deltas = []
+        for _ in range(len(fixed)):
+            delta, offset = read_varint(payload, offset)
+            deltas.append(delta)
+        fixed = tuple(value + delta for value, delta in zip(fixed, deltas))
+        samples.append(_from_fixed(frame.node_id, (frame.seq + i) & 0xFFFF, fixed,
+                                   datetime.fromtimestamp(ms / 1000)))
+    return samples
+
+def decode_telemetry(frame):
+    #Decode a sample or batch frame into a list of TelemetrySample rows
+    if frame.frame_type == FRAME_BATCH:
+        return decode_batch(frame)
+    return [decode_sample(frame)]
+
+#Fixed-point scale and (low, high) range of each field, in summary order
+SUMMARY_FIELDS = [
+    ('temperature', TEMP_SCALE, -32768, 32767),
+    ('humidity', HUMIDITY_SCALE, 0, 65535),
+    ('pressure', PRESSURE_SCALE, 0, 65535),
+    ('altitude', ALTITUDE_SCALE, -2**31, 2**31 - 1),
+]
+
+def encode_summary(summary, seq):
+    #summary: rolling_stats.WindowSummary; seq is the telemetry sequence number at the window end
+    ms = _timestamp_ms(summary)
+    values = [ms // 1000, ms % 1000,
+              _fixed(summary.duration, DURATION_SCALE, 0, 65535),
+              _clamp(summary.count, 0, 65535),
+              _fixed(summary.vertical_rate, RATE_SCALE, -32768, 32767)]
+    for name, scale, low, high in SUMMARY_FIELDS:
+        stats = getattr(summary, name)
+        top = 65535 if high <= 65535 else 2**32 - 1     #std is unsigned (H, or I for altitude)
+        values += [_fixed(stats.mean, scale, low, high), _fixed(stats.std, scale, 0, top),
+                   _fixed(stats.min, scale, low, high), _fixed(stats.max, scale, low, high)]
+    return encode_frame(FRAME_SUMMARY, node_id_from_sensor_id(summary.sensor_id), seq, SUMMARY.pack(*values))
+
+def decode_summary(frame):
+    if frame.frame_type != FRAME_SUMMARY or len(frame.payload) != SUMMARY.size:
+        raise FrameError("Not a summary frame")
+    values = SUMMARY.unpack_from(frame.payload)
+    seconds, millis, duration, count, rate = values[:5]
+    fields = []
+    for i, (_, scale, _, _) in enumerate(SUMMARY_FIELDS):
+        fields.append(SummaryStats(*(value / scale for value in values[5 + 4 * i:9 + 4 * i])))
+    return TelemetrySummary(frame.node_id, frame.seq, datetime.fromtimestamp(seconds + millis / 1000),
+                            duration / DURATION_SCALE, count, rate / RATE_SCALE, *fields)
+
+def format_text_summary(summary):
+    #Text fallback: the window means as an ordinary text sample
+    return (
+        f"Temperature: {summary.temperature.mean:.2f}°C, "
+        f"Pressure: {summary.pressure.mean:.2f} hPa, "
+        f"Humidity: {summary.humidity.mean:.2f}%, "
+        f"Altitude: {summary.altitude.mean:.2f} m\n"
+    )
+
+def format_text_sample(sensor_data):
+    #Text fallback, same format the ground station has always parsed
+    return (
+        f"Temperature: {sensor_data.temperature:.2f}°C, "
+        f"Pressure: {sensor_data.pressure:.2f} hPa, "
+        f"Humidity: {sensor_data.humidity:.2f}%, "
+        f"Altitude: {sensor_data.altitude:.2f} m\n"
+    )
+
+class StreamParser:
+    #Splits a byte stream into binary frames and text lines.
+    #Bytes are appended to one bytearray and consumed by advancing an offset, so
+    #a burst is parsed in one pass; the buffer is compacted only occasionally.
+    #Corrupt frames are skipped one byte at a time until the next sync word.
+    MAX_LINE = 512
+    COMPACT_AT = 4096
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pos = 0
+        self.scan_from = 0  #Where the search for the end of a partial text line resumes
+        self.frames = 0
+        self.lines = 0
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+        self.overlong_lines = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def pending(self):
+        return len(self.buffer) - self.pos
+
+    def flush_text(self):
+        #The line went quiet: treat a partial text line as complete, like readline() did.
+        #Leftover bytes that may be the start of a frame (all or part of the sync word) are kept.
+        rest = self.buffer[self.pos:self.pos + len(SYNC)]
+        if rest and not (rest.startswith(SYNC) or SYNC.startswith(rest)):
+            self.buffer += b'\n'
+
+    def messages(self):
+        #Yields ('frame', Frame) and ('text', str) items for every complete message buffered so far
+        buffer = self.buffer
+        while self.pos < len(buffer):
+            pos = self.pos
+            if buffer.startswith(SYNC, pos):
+                try:
+                    frame, length = decode_frame(buffer, pos)
+                except FrameError:
+                    self.crc_errors += 1
+                    self.skipped_bytes += 1
+                    self.pos = pos + 1
+                    continue
+                if frame is None:
+                    break
+                #Copy the (small) payload and release the view so the buffer can grow or be compacted
+                payload = frame.payload
+                message = frame._replace(payload=bytes(payload))
+                payload.release()
+                self.pos = pos + length
+                self.frames += 1
+                yield 'frame', message
+                continue
+
+            start = max(pos, self.scan_from)
+            newline = buffer.find(b'\n', start)
+            sync = buffer.find(SYNC, start)
+            if newline == -1 and sync == -1:
+                if len(buffer) - pos > self.MAX_LINE:
+                    #No line end in sight: drop the garbage, keep the last byte (may be half a sync word)
+                    self.overlong_lines += 1
+                    self.skipped_bytes += len(buffer) - pos - 1
+                    self.pos = len(buffer) - 1
+                    self.scan_from = 0
+                else:
+                    self.scan_from = len(buffer) - 1
+                break
+            if sync != -1 and (newline == -1 or sync < newline):
+                #Text (or noise) running into a frame
+                end, self.pos = sync, sync
+            else:
+                end, self.pos = newline, newline + 1
+            self.scan_from = 0
+            text = buffer[pos:end].decode('utf-8', errors='replace').strip()
+            if text:
+                self.lines += 1
+                yield 'text', text
+        self._compact()
+
+    def _compact(self):
+        if self.pos >= len(self.buffer):
+            del self.buffer[:]
+            self.scan_from = 0
+            self.pos = 0
+        elif self.pos > self.COMPACT_AT:
+            del self.buffer[:self.pos]
+            self.scan_from = max(0, self.scan_from - self.pos)
+            self.pos = 0
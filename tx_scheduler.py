@@ -0,0 +1,194 @@
+#This module schedules packets onto the LoRa link for the WES project.
+#Packets are queued by priority class and sent highest priority first, paced by
+#a token bucket of airtime so the radio stays within its duty cycle.
+import math
+import threading
+import time
+from collections import deque
+
+#Priority classes, lowest number is sent first
+DETECTION = 0
+COMMAND_REPLY = 1
+TELEMETRY = 2
+IMAGE = 3               #Thumbnail chunks use whatever airtime is left
+CLASS_NAMES = {DETECTION: "detection", COMMAND_REPLY: "command reply", TELEMETRY: "telemetry", IMAGE: "image"}
+#Packets a class may have waiting before its feeder stops taking from its channel (see
+#wait_for_room), so a link that falls behind backs up into the bounded channels and
+#their overflow policies apply. Images are bounded by ImageSender (one image at a time).
+CLASS_LIMITS = {DETECTION: 4, COMMAND_REPLY: 4, TELEMETRY: 4, IMAGE: None}
+
+#LoRa modem settings used for the airtime estimate (match the radio's air data rate)
+SPREADING_FACTOR = 9
+BANDWIDTH_HZ = 125000
+CODING_RATE = 1          #1..4 means 4/5..4/8
+PREAMBLE_SYMBOLS = 8
+#Share of time the radio may transmit (regulatory limit); also sizes thumbnails (image_transfer.py)
+DUTY_CYCLE = 0.1
+
+def lora_airtime(payload_len, sf=SPREADING_FACTOR, bw=BANDWIDTH_HZ, cr=CODING_RATE,
+                 preamble=PREAMBLE_SYMBOLS, explicit_header=True, crc=True):
+    #Time on air in seconds for one LoRa packet (Semtech SX127x/SX126x datasheet formula)
+    symbol_time = (2 ** sf) / bw
+    low_data_rate = 1 if symbol_time > 0.016 else 0
+    numerator = 8 * payload_len - 4 * sf + 28 + 16 * int(crc) - 20 * int(not explicit_header)
+    payload_symbols = 8 + max(math.ceil(numerator / (4 * (sf - 2 * low_data_rate))) * (cr + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * symbol_time
+
+class TokenBucket:
+    #Tokens are seconds of airtime. They refill at duty_cycle seconds per second,
+    #up to burst seconds. A packet may go out once the bucket holds its cost
+    #(or is full, for packets bigger than the bucket); the balance may go negative.
+    def __init__(self, duty_cycle, burst):
+        self.rate = duty_cycle
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, cost, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        return max(missing, 0.0) / self.rate if self.rate > 0 else 0.0
+
+    def consume(self, cost, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= cost
+
+class ClassStats:
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+        self.airtime = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, size, airtime, latency):
+        self.sent += 1
+        self.bytes += size
+        self.airtime += airtime
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    @property
+    def latency_avg(self):
+        return self.latency_total / self.sent if self.sent else 0.0
+
+class TxScheduler:
+    def __init__(self, write, duty_cycle=DUTY_CYCLE, burst=2.0, airtime=lora_airtime, limits=None):
+        self.write = write
+        self.airtime = airtime
+        self.limits = dict(CLASS_LIMITS if limits is None else limits)
+        self.bucket = TokenBucket(duty_cycle, burst)
+        self.queues = {priority: deque() for priority in CLASS_NAMES}
+        self.stats = {priority: ClassStats() for priority in CLASS_NAMES}
+        self.cond = threading.Condition()
+
+    def submit(self, priority, packet, enqueued_at=None, on_sent=None, tag=None):
+        #enqueued_at (time.monotonic) lets latency include time spent before the scheduler;
+        #on_sent(write_time) is called once the packet has been written to the radio;
+        #tag marks packets that discard() may take back before they are sent
+        with self.cond:
+            self.queues[priority].append((packet, time.monotonic() if enqueued_at is None else enqueued_at, on_sent, tag))
+            self.cond.notify_all()
+
+    def discard(self, priority, tag):
+        #Remove the queued packets of a class that carry tag; returns how many were removed
+        with self.cond:
+            queue = self.queues[priority]
+            kept = deque(item for item in queue if item[3] is not tag)
+            removed = len(queue) - len(kept)
+            self.queues[priority] = kept
+            return removed
+
+    def backlog(self, priority):
+        with self.cond:
+            return len(self.queues[priority])
+
+    def wait_for_room(self, priority, timeout=None):
+        #Block until the class is below its limit; returns False if timeout passed first
+        limit = self.limits.get(priority)
+        if limit is None:
+            return True
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.queues[priority]) < limit, timeout)
+
+    def backlog_lines(self):
+        #Per-class backlog in the format of the channel report
+        with self.cond:
+            return [f"  {'tx ' + name:<14} backlog={len(self.queues[priority])}/{self.limits.get(priority) or '-'}"
+                    for priority, name in CLASS_NAMES.items()]
+
+    def _next(self):
+        for priority in sorted(self.queues):
+            if self.queues[priority]:
+                return priority
+        return None
+
+    def send_next(self, timeout=0.5):
+        #Send the highest priority packet once the bucket allows it.
+        #Returns the priority class sent, or None if nothing went out within timeout.
+        with self.cond:
+            priority = self._next()
+            if priority is None:
+                self.cond.wait(timeout)
+                return None
+            packet, enqueued_at, on_sent, _ = self.queues[priority][0]
+            cost = self.airtime(len(packet))
+            wait = self.bucket.time_until(cost)
+            if wait > 0:
+                #Wake early if something more urgent arrives while we wait for airtime
+                self.cond.wait(min(wait, timeout))
+                return None
+            self.queues[priority].popleft()
+            self.bucket.consume(cost)
+            #Wake feeders waiting for room in this class
+            self.cond.notify_all()
+        self.write(packet)
+        sent_at = time.monotonic()
+        self.stats[priority].record(len(packet), cost, sent_at - enqueued_at)
+        if on_sent is not None:
+            on_sent(sent_at)
+        return priority
+
+    def drain(self, timeout=10.0):
+        #Send what is still queued, waiting for airtime between packets, until the queues
+        #are empty or timeout seconds have passed. Whatever is left is discarded.
+        #Returns {priority: packets discarded}.
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.cond:
+                priority = self._next()
+                if priority is None:
+                    break
+                wait = self.bucket.time_until(self.airtime(len(self.queues[priority][0][0])))
+            if wait > 0:
+                time.sleep(min(wait, max(deadline - time.monotonic(), 0.0)))
+            self.send_next(timeout=0)
+        with self.cond:
+            discarded = {priority: len(queue) for priority, queue in self.queues.items() if queue}
+            for queue in self.queues.values():
+                queue.clear()
+        return discarded
+
+    def run(self, stop_event, report_interval=60.0):
+        next_report = time.monotonic() + report_interval
+        while not stop_event.is_set():
+            self.send_next()
+            if report_interval and time.monotonic() >= next_report:
+                print(self.report())
+                next_report = time.monotonic() + report_interval
+
+    def report(self):
+        lines = ["[LoRa TX] Scheduler report:"]
+        for priority, name in CLASS_NAMES.items():
+            stats = self.stats[priority]
+            lines.append(
+                f"  {name:<14} sent={stats.sent} bytes={stats.bytes} airtime={stats.airtime:.1f}s "
+                f"latency avg={stats.latency_avg:.2f}s max={stats.latency_max:.2f}s "
+                f"backlog={self.backlog(priority)}/{self.limits.get(priority) or '-'}"
+            )
+        return "\n".join(lines)